@@ -12,76 +12,33 @@ import zlib
 import os
 import pprint
 import csv
-import random
-import re
-import string
+import gzip
+import sys
+from esxfile import ESXFile, floorIndex, measurementFields, measuredRadioFields
+from metrics import Metrics
+import anonymize
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
 
 pp = pprint.PrettyPrinter(indent=3)
 
+# Output compression by file extension, when -z isn't given
+compressionByExtension={'.gz':'gzip', '.zst':'zstd'}
+
 
-def macAnon(sourceMac, laa=False, oui=False, delim=':'):
-	anonyMac=[]
-	macChunks=sourceMac.split(':')
-	for x in range(6):
-		a=random.randint(0,255)
-		if laa and x == 0:  	# Only first Octet if making LAA compliant
-			a |= (1<<1)			# Set second bit to 1
-			a &= ~(1<<0)		# Set first bit (LSB) to 0
-		hex = '%02x' % a
-		anonyMac.append(hex)
-	if oui :
-		for octet in range(2):
-			anonyMac[octet]=macChunks[octet]
-
-	if delim == '.':
-		anonymizedMac=anonyMac[0]+anonyMac[1]+'.'+anonyMac[2]+anonyMac[3]+'.'+anonyMac[4]+anonyMac[5] 
-	else:
-		anonymizedMac=delim.join(anonyMac)
-	return anonymizedMac
-
-def serAnon():
-	countries=['CN','TH','VN','US','JP','MX','CZ']
-	cc=random.choice(countries)
-	cc+=''.join(random.choices(string.ascii_uppercase, k=4))
-	cc+=random.choice(string.digits)
-	cc+=''.join(random.choices(string.ascii_uppercase + string.digits,k=3))
-	return cc
-
-
-
-def isThisAMac(sourceString):
-		isMac=False
-		delimiter=""
-		if '.' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{4}[.]){2}([0-9A-Fa-f]{4})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = '.'
-		if ':' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{2}[:]){5}([0-9A-Fa-f]{2})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = ':'
-		if '-' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{2}[-]){5}([0-9A-Fa-f]{2})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = '-'
-
-		if isMac :
-			return True, macMatch.group(), delimiter
-		else:
-			return False, None, None
-
-def isThisArubaSerial(sourceString):
-		isArubaSerial=False
-
-		serMatch=re.match(r"^([A-Z]{2})([A-Z]{4})([0-9A-Z]{4})$", sourceString)
-		if serMatch:
-			isArubaSerial=True
-			return True, serMatch.group()
-		else:
-			return False, None
+def openOutput(path, compression=None):
+	# Text file to write the CSV to, gzip or zstd compressed if asked for
+	if compression == 'gzip':
+		# Level 6 rather than gzip's default 9 - much faster for a barely bigger file
+		return gzip.open(path, 'wt', compresslevel=6, newline='')
+	if compression == 'zstd':
+		if zstandard is None:
+			sys.exit("zstd output needs the zstandard module (pip install zstandard)")
+		return zstandard.open(path, 'wt', newline='')
+	return open(path, 'w')
 
 
 def main():
@@ -96,14 +53,26 @@ def main():
 	cli.add_argument("-p", '--preserve-oui', required=False, action="store_true", help="preserve OUIs when anonymizing MACs")
 	cli.add_argument("-l", '--laa-macs', required=False, action="store_true", help="anonymized MACs are LAA compliant")
 	cli.add_argument("-s", '--anonymize-serials', required=False, action="store_true", help="anonymize Aruba serial numbers")
+	cli.add_argument('--anon-key', required=False, metavar='FILE', help="secret key file for anonymizing, so the same MAC or serial anonymizes the same way in every run and every project (default: "+anonymize.keyEnv+" from the environment, else a one-off key)", default=None)
+	cli.add_argument("-z", '--compress', required=False, choices=['none','gzip','zstd'], help="compress the CSV (default: by the output file's extension, .gz or .zst)", default=None)
+	cli.add_argument('--metrics', required=False, metavar='FILE', help="write per-stage timings, row counts and memory use to FILE as JSON", default=None)
+	cli.add_argument("-q", '--quiet', required=False, action="store_true", help="don't print progress output")
 
 
 	args = vars(cli.parse_args())
-	pp.pprint(args)
+	metrics = Metrics('ap_report', args['quiet'])
+	metrics.info['input'] = args['input']
+	metrics.pprint(pp, args)
+
+	compression=args['compress']
+	if compression is None:
+		compression=compressionByExtension.get(pathlib.PurePath(args['output']).suffix.lower())
+	elif compression == 'none':
+		compression=None
 
 	#Load Ekahau Project archive
 
-	orig_archive = zipfile.ZipFile(args['input'],'r')
+	esx = ESXFile(args['input'], metrics)
 
 	ap_data_by_bssid = {}
 	ap_data_by_id = {}
@@ -131,61 +100,29 @@ def main():
 		'Custom':{}
 	}
 	
-	# Load Notes
-
-	with orig_archive.open('notes.json') as json_file:
-		notesJSON = json.load(json_file)
-		json_file.close()
-
 	# Load AP Table
-	with orig_archive.open('accessPoints.json') as json_file:
-		accessPointsJSON = json.load(json_file)
-		json_file.close()
-
-	# Load Radios Table
-	with orig_archive.open('measuredRadios.json') as json_file:
-		measuredRadiosJSON = json.load(json_file)
-		json_file.close()		
-
-	# Load Measurements Table
-	with orig_archive.open('accessPointMeasurements.json') as json_file:
-		accessPointMeasurementsJSON = json.load(json_file)
-		json_file.close()		
+	accessPointsJSON = esx.load('accessPoints')
 
-	# Load Tag Keys Table
-	# Need to add error handling here in case tagKeys doesn't exist. 
+	# Radios and Measurements tables can be huge on a big survey, so these are streamed record by record
+	# further down rather than loaded here. 
 
-	with orig_archive.open('tagKeys.json') as json_file:
-		tagKeysJSON = json.load(json_file)
-		json_file.close()
+	# Load Tag Keys Table - not every project has tags defined, so fall back to an empty list.
+	tagKeysJSON = esx.load('tagKeys', {'tagKeys':[]})
 
-	# Load Floor Plans Table
-
-	with orig_archive.open('floorPlans.json') as json_file:
-		floorPlansJSON = json.load(json_file)
-		json_file.close()
-
-	# Load Buildings Table
-
-	with orig_archive.open('buildings.json') as json_file:
-		buildingsJSON = json.load(json_file)
-		json_file.close()
-
-	with orig_archive.open('buildingFloors.json') as json_file:
-		buildingFloorsJSON = json.load(json_file)
-		json_file.close()
-
-	# Close input file, we are done with it and don't need open files aimlessly hanging around. 
-	orig_archive.close()
+	# Floor plans and the buildings they're in, as one floorPlanId -> (building, floor, metersPerUnit) index (see esxfile.py).
+	# Buildings are optional - floors that aren't in one just have no building in the report.
+	floors = floorIndex(esx.table('floorPlans'), esx.table('buildingFloors'), esx.table('buildings'))
 
 	#Build indexes
 	#Build index of APs by MeasurementID
 
 	apByMeasurement={}
 
-	for ap in measuredRadiosJSON['measuredRadios']:
-		for measID in ap['accessPointMeasurementIds']:
-			apByMeasurement[measID]=ap['accessPointId']
+	with metrics.stage('ap_report.index') as stage:
+		for ap in esx.iterRecords('measuredRadios', measuredRadioFields):
+			for measID in ap['accessPointMeasurementIds']:
+				apByMeasurement[measID]=ap['accessPointId']
+		stage.rows(apByMeasurement)
 
 	#print("\n\nAPs by measurement ID\n")
 	#pp.pprint(apByMeasurement)
@@ -198,30 +135,6 @@ def main():
 	#print("\n\nAPs by AP ID\n")
 	#p.pprint(apByID)
 
-	#Initialize floor plan dicts
-	floorsByName={}
-	floorsbyID={}
-	bldgsByFloor={}
-
-	#Initialize building dicts
-	bldgsByName={}
-	bldgsbyID={}
-
-	# Create floor/ID Xref
-	for building in buildingsJSON['buildings']:
-		bldgsByName[building['name']]=building['id']
-		bldgsbyID[building['id']]=building['name']
-		
-	# Create floor/ID Xref
-	for floor in floorPlansJSON['floorPlans']:
-		floorsByName[floor['name']]=floor['id']
-		floorsbyID[floor['id']]=floor['name']
-		for bldgfloor in buildingFloorsJSON['buildingFloors']:
-			if floor['id'] == bldgfloor['floorPlanId']:
-				bldgsByFloor[floor['id']]=bldgsbyID[bldgfloor['buildingId']]
-
-	#pp.pprint(bldgsByFloor)
-
 	#Initialize tag dicts	
 	tagsByName={}
 	tagsByID={}
@@ -231,40 +144,22 @@ def main():
 		tagsByName[key['key']]=key['id']
 		tagsByID[key['id']]=key['key']
 
-	#Initialize output list - this is a list of dict objects.
-
 	# generate MAC anonymization table to sanitize output while keeping each AP consistent - resulting MACs can either keep OUI or are LAA compliant.
+	# The mappings are keyed (see anonymize.py), so a given MAC or serial anonymizes the same way in every project for the same key.
 	macAnonTable={}
 	serAnonTable={}
+	anonymizer=anonymize.fromArgs(args)
 
-	if args['anonymize_macs'] :
-
-		# Add all BSSIDs to the MAC Anonymizer
-
-		for measuredRadio in accessPointMeasurementsJSON['accessPointMeasurements']:
-			anonymizedMac=macAnon(measuredRadio['mac'], args['laa_macs'], args['preserve_oui'],':')
-
-			macAnonTable[measuredRadio['mac']] = anonymizedMac
-					
-		# Look for MACs in the tag values and add them as well
-
-		for ap in accessPointsJSON['accessPoints']:
-			for tag in ap['tags']:
-				isAMac, macAddress, delim = isThisAMac(tag['value'])
-				if isAMac:
-					anonymizedMac=macAnon(macAddress, args['laa_macs'], args['preserve_oui'], delim)
-					macAnonTable[macAddress] = anonymizedMac
-	
-	if args['anonymize_serials']:
-		for ap in accessPointsJSON['accessPoints']:
-			for tag in ap['tags']:
-				isASerial,serial=isThisArubaSerial(tag['value'])
-				if isASerial:
-					serAnonTable[serial]=serAnon()
+	with metrics.stage('ap_report.anonymize') as stage:
+		if anonymizer is not None:
+			# MACs and serials in the tag values, picked out in one pass over them, plus all the BSSIDs
+			macAnonTable, serAnonTable = anonymizer.tables([tag['value'] for ap in accessPointsJSON['accessPoints'] for tag in ap['tags']], args['anonymize_macs'], args['anonymize_serials'])
+			if args['anonymize_macs']:
+				macAnonTable.update(anonymizer.tables([measuredRadio['mac'] for measuredRadio in esx.iterRecords('accessPointMeasurements', measurementFields)], serials=False)[0])
+		stage.rows(len(macAnonTable)+len(serAnonTable))
 
 
-	pp.pprint(serAnonTable)
-	outputData=[]
+	metrics.pprint(pp, serAnonTable)
 
 	# What contains what?
 	#
@@ -329,108 +224,76 @@ def main():
 	for tag in tagsByName.keys():
 		fields.append(tag)
 
-	#Iterate through each accessPoint element. Good thing computers are fast at repetitive tasks!
-	for measuredRadio in accessPointMeasurementsJSON['accessPointMeasurements']:
-		ap=apByID[apByMeasurement[measuredRadio['id']]]
-
-		outputRow={}
-		for f in fields:
-			outputRow[f]=None
-		if measuredRadio['mac'] in macAnonTable:
-			outputRow['bssid']=macAnonTable[measuredRadio['mac']]
-		else:
-			outputRow['bssid']=measuredRadio['mac']
-
-		if 'ssid' in measuredRadio.keys():
-			if measuredRadio['ssid'] != "":
-				outputRow['essid']=measuredRadio['ssid']
-			else:
-				outputRow['essid']='[Hidden]'
-		
-		if 'security' in measuredRadio.keys():
-			outputRow['encryption']=measuredRadio['security']
-		
-		if 'channel' in measuredRadio.keys():
-			chans=measuredRadio['channel']
-			if chans[0] < 36:
-				outputRow['band']="2.4"
-			else:
-				outputRow['band']="5"
-
-			if len(chans) == 1:
-				outputRow['pri_channel']=chans[0]
-				outputRow['chan_width']=20
-			if len(chans) == 2:
-				outputRow['pri_channel']=chans[0]
-				outputRow['sec_channel']=chans[1]
-				outputRow['chan_width']=40
-			if len(chans) == 4:
-				outputRow['pri_channel']=chans[0]
-				outputRow['sec_channel']=chans[1]
-				outputRow['channel_3']=chans[2]
-				outputRow['channel_4']=chans[3]
-				outputRow['chan_width']=80
-			if len(chans) == 8:
-				outputRow['pri_channel']=chans[0]
-				outputRow['sec_channel']=chans[1]
-				outputRow['channel_3']=chans[2]
-				outputRow['channel_4']=chans[3]
-				outputRow['channel_5']=chans[4]
-				outputRow['channel_6']=chans[5]
-				outputRow['channel_7']=chans[6]
-				outputRow['channel_8']=chans[7]
-				outputRow['chan_width']=160
-
-		for phy in technologies:
-
-			header="PHY_"+str(phy)
-
-			outputRow[header]=False
-			if phy in measuredRadio['technologies']:
-				outputRow[header]=True
-
-
-		outputRow['ap_name']=ap['name']
-		outputRow['mine']=ap['mine']
+	# Column of each tag in the tag part of a row
+	tagColumns={}
+	for tag in tagsByName.keys():
+		tagColumns[tag]=len(tagColumns)
 
-		if 'location' in ap.keys():
-			outputRow['building']=bldgsByFloor[ap['location']['floorPlanId']]
-			outputRow['floor']=floorsbyID[ap['location']['floorPlanId']]
-			outputRow['x-coord']=ap['location']['coord']['x']
-			outputRow['y-coord']=ap['location']['coord']['y']
+	# Channel width for the number of channels in a measurement
+	chanWidths={1:20, 2:40, 4:80, 8:160}
 
-		for tag in tagsByName.keys():
-			outputRow[tag]=""
+	def apColumns(ap):
+		# The parts of a row that come from the AP rather than the measurement, worked out once per AP:
+		# (ap_name, [mine, vendor, model], [building ... color, tags])
+		building=floor=x=y=None
+		if 'location' in ap.keys():
+			building, floor = floors.get(ap['location']['floorPlanId'], (None, None, None))[:2]
+			x=ap['location']['coord']['x']
+			y=ap['location']['coord']['y']
 
+		tagValues=[""]*len(tagColumns)
 		for tag in ap['tags']:
-			header=tagsByID[tag['tagKeyId']]
-			outputRow[header]=tag['value']
-			if tag['value'] in macAnonTable:
-				outputRow[header]=macAnonTable[tag['value']]
-			if tag['value'] in serAnonTable:
-				outputRow[header]=serAnonTable[tag['value']]
-		if 'vendor' in ap.keys():
-			outputRow['vendor']=ap['vendor']
-		if 'model' in ap.keys():
-			outputRow['model']=ap['model']
-		if 'color' in ap.keys():
-			outputRow['color']=ap['color']
-
-		outputData.append(outputRow)
-
-	# Create the CSV
-
-	with open(args['output'], 'w') as csvfile:
-		outputFile=csv.writer(csvfile)
-
-		outputFile.writerow(fields)
-		for row in outputData:
-			datarow=[]
-			for f in fields:
-				datarow.append(row[f])
-			outputFile.writerow(datarow)
-
-	csvfile.close()
+			# A serial wins over a MAC if a value is somehow both
+			value=tag['value']
+			tagValues[tagColumns[tagsByID[tag['tagKeyId']]]]=serAnonTable.get(value, macAnonTable.get(value, value))
+
+		return ap['name'], [ap['mine'], ap.get('vendor'), ap.get('model')], [building, floor, x, y, ap.get('color')]+tagValues
+
+	def reportRows():
+		# One row (in the order of fields) per measurement, yielded as soon as it's joined to its AP, so nothing piles up in
+		# memory however big the survey is. Only the per-AP columns are kept, one entry per AP.
+		apCache={}
+		for measuredRadio in esx.iterRecords('accessPointMeasurements', measurementFields):
+			apId=apByMeasurement[measuredRadio['id']]
+			if apId not in apCache:
+				apCache[apId]=apColumns(apByID[apId])
+			apName, apInfo, apPlacement = apCache[apId]
+
+			bssid=macAnonTable.get(measuredRadio['mac'], measuredRadio['mac'])
+
+			essid=None
+			if 'ssid' in measuredRadio.keys():
+				essid=measuredRadio['ssid'] if measuredRadio['ssid'] != "" else '[Hidden]'
+
+			band=None
+			channels=[None]*9
+			if 'channel' in measuredRadio.keys():
+				chans=measuredRadio['channel']
+				band="2.4" if chans[0] < 36 else "5"
+				if len(chans) in chanWidths:
+					channels[0]=chanWidths[len(chans)]
+					channels[1:1+len(chans)]=chans
+
+			phys=[phy in measuredRadio['technologies'] for phy in technologies]
+
+			yield [apName, bssid]+apInfo+[essid, measuredRadio.get('security'), band]+phys+channels+apPlacement
+
+	# Rows go straight from the measurements table to the CSV (compressed on the way if asked for)
+	with metrics.stage('ap_report.csv') as stage:
+		with openOutput(args['output'], compression) as csvfile:
+			outputFile=csv.writer(csvfile)
+
+			outputFile.writerow(fields)
+			rowCount=0
+			for row in reportRows():
+				outputFile.writerow(row)
+				rowCount+=1
+		stage.rows(rowCount)
+
+	# Close input file, we are done with it and don't need open files aimlessly hanging around. 
+	esx.close()
+
+	metrics.finish(args['metrics'])
 
 if __name__ == "__main__":
 	main()
@@ -11,6 +11,8 @@ import zlib
 import os
 from pprint import pprint
 import csv
+from esxfile import ESXFile, ESXWriter
+from macaddr import parseMacs
 
 def main():
 	#This script allows you to update the AP Name attribute of an AP object in Ekahau by using a CSV file containing bss,ess,ap_name,group,model,serial,wired-mac,color
@@ -22,12 +24,14 @@ def main():
 
 	usage = "usage: %prog [options] csv_file project_file\n CSV file should be formatted as bss,ess,ap_name,group,model,serial,wired-mac,color"
 	parser = OptionParser(usage)
+	parser.add_option("-d", "--delta", action="store_true", dest="delta", default=False,
+		help="CSV is a delta file from apbss-db-ekahau.py --delta: added/changed BSSIDs are applied, APs whose BSSIDs were removed are set as not mine, and nothing else is touched")
 	(options, args) = parser.parse_args()
 
 	#Load Ekahau Project archive
 	current_filename = pathlib.PurePath(args[1]).stem
 
-	orig_archive = zipfile.ZipFile(args[1],'r')
+	esx = ESXFile(args[1])
 
 	ap_data_by_bssid = {}
 	ap_data_by_id = {}
@@ -62,51 +66,52 @@ def main():
 			 'Wired MAC':'wired-mac'}
 
 
+	# BSSIDs the controllers no longer have, from a delta file
+	removedBssids = []
+
 	#Load CSV file provided from CLI
 	with open(args[0], 'r') as csvfile:
 		reader = csv.DictReader(csvfile, dialect=csv.excel)
-		for row in reader:
-			values = {
-			'bssid':row['bss'], 
-			'ap_name':row['ap_name'], 
-			'ssid':row['ess'],
-			'model':row['model']
-			}
-
-			values['color']= row['color']
+		rows = list(reader)
+
+	# BSSIDs are matched as 48-bit integers (see macaddr.py), so the CSV can use any case or notation and still match the survey.
+	# A BSSID listed twice in any notation is the same key, so the last row wins.
+	bssKeys, bssValid = parseMacs([row['bss'] for row in rows])
+	badBss = 0
+	for row, bssKey, valid in zip(rows, bssKeys.tolist(), bssValid.tolist()):
+		if not valid:
+			badBss += 1
+			continue
+
+		if options.delta and row['change'] == 'removed':
+			removedBssids.append(bssKey)
+			continue
+
+		values = {
+		'bssid':row['bss'], 
+		'ap_name':row['ap_name'], 
+		'ssid':row['ess'],
+		'model':row['model']
+		}
+
+		values['color']= row['color']
 	
-			for tag in tagXref:
-				values[tagXref[tag]]=row[tagXref[tag]]
+		for tag in tagXref:
+			values[tagXref[tag]]=row[tagXref[tag]]
 
-			ap_data_by_bssid[row['bss']] = values
+		ap_data_by_bssid[bssKey] = values
 			
-	# Load Notes
-
-	with orig_archive.open('notes.json') as json_file:
-		notesJSON = json.load(json_file)
-		json_file.close()
-
 	# Load AP Table
-	with orig_archive.open('accessPoints.json') as json_file:
-		accessPointsJSON = json.load(json_file)
-		json_file.close()
+	accessPointsJSON = esx.load('accessPoints')
 
 	# Load Radios Table
-	with orig_archive.open('measuredRadios.json') as json_file:
-		measuredRadiosJSON = json.load(json_file)
-		json_file.close()		
+	measuredRadiosJSON = esx.load('measuredRadios')
 
 	# Load Measurements Table
-	with orig_archive.open('accessPointMeasurements.json') as json_file:
-		accessPointMeasurementsJSON = json.load(json_file)
-		json_file.close()		
+	accessPointMeasurementsJSON = esx.load('accessPointMeasurements')
 
-	# Load Tag Keys Table
-	# Need to add error handling here in case tagKeys doesn't exist. 
-
-	with orig_archive.open('tagKeys.json') as json_file:
-		tagKeysJSON = json.load(json_file)
-		json_file.close()
+	# Load Tag Keys Table - not every project has tags defined, so fall back to an empty list.
+	tagKeysJSON = esx.load('tagKeys', {'tagKeys':[]})
 
 	#Initialize tag dicts	
 	tagsByName={}
@@ -119,100 +124,149 @@ def main():
 
 	# Check to see if tags exist
 
-	for tag in tagXref.keys():
+	for tag in list(tagXref.keys()):
 		# remove any tags from the xref that are not in the Ekahau tagKeys JSON
 		if tag not in tagsByName:
 			del tagXref[tag]
 
-
-	#Iterate through each accessPoint element. Good thing computers are fast at repetitive tasks!
+	# Build indexes up front so matching a BSSID is a lookup rather than a scan through every table
+
+	# Measurements and their BSSIDs (as integers, parsed in one pass) by measurement ID
+	measurements=accessPointMeasurementsJSON['accessPointMeasurements']
+	measurementMacs, measurementValid = parseMacs([accessPointMeasurement.get('mac') for accessPointMeasurement in measurements])
+	measurementsByID={}
+	for accessPointMeasurement, mac, valid in zip(measurements, measurementMacs.tolist(), measurementValid.tolist()):
+		if valid:
+			measurementsByID[accessPointMeasurement['id']]=(accessPointMeasurement, mac)
+
+	# Measured radios by AP ID
+	radiosByAP={}
+	for measuredRadio in measuredRadiosJSON['measuredRadios']:
+		radiosByAP.setdefault(measuredRadio['accessPointId'],[]).append(measuredRadio)
+
+	# APs and their measurements by BSSID. A BSSID can show up in more than one measurement, so each entry is a list. 
+	apsByBssid={}
+	surveyedAPs={}
+	wasMine={}
 	for ap in accessPointsJSON['accessPoints']:
-		# Iterate through each measuredRadios with accessPointId = current ap
-		for measuredRadio in measuredRadiosJSON['measuredRadios']:
-			# If we find a match:
-			if measuredRadio['accessPointId'] == ap['id']:
-				# Iterate through the measurements list to find the measurement IDs
-				for accessPointMeasurementId in measuredRadio['accessPointMeasurementIds']:
-					# Iterate through the measurements to find the actual measurement
-					for accessPointMeasurement in accessPointMeasurementsJSON['accessPointMeasurements']:
-						# If it's a match, then we've found our bssid. 
-						if accessPointMeasurement['id'] == accessPointMeasurementId:
-							bssid = accessPointMeasurement['mac']
-							# If the BSSID is in our list, do the stuff we want to do. 
-							if bssid in ap_data_by_bssid:
-								print("Matched bssid {0}".format(bssid))
-
-								# This AP is in the controller BSS list, and is therefore "mine", and we need to set the mine flag to true. 
-								ap['mine']=True
-
-								# Update the ESSID Name
-								accessPointMeasurement['ssid'] = ap_data_by_bssid[bssid]['ssid']
-								print("\tUpdated ESSID to {0}".format(ap_data_by_bssid[bssid]['ssid']))
-
-								# Update the AP Name
-								ap['name'] = ap_data_by_bssid[bssid]['ap_name']
-								print("\tUpdated AP Name to {0}".format(ap['name']))
-
-								# Update the AP model
-								ap['model'] = ap_data_by_bssid[bssid]['model']
-								print("\tUpdated AP Model to {0}".format(ap['model']))
-
-								# Update the AP color
-								# Is the scheme/color in our list?
-								print("Color:"+ap_data_by_bssid[bssid]['color'])
-								if '/' in ap_data_by_bssid[bssid]['color']: 
-									scheme, color=ap_data_by_bssid[bssid]['color'].split('/')
-									if scheme in colors:
-										if color in colors[scheme]:
-											# Update the color. 						
-											ap['color']=colors[scheme][color]
-											print("\tUpdated color to "+scheme+"/"+color+" ("+colors[scheme][color]+")")
-									else:
-										# Remove this entire else block if you just want to leave whatever value, if any, alone. 
-										# Check to see if an existing color tag exists
-										if 'color' in ap.keys():
-											# delete it
-											del ap['color']
-
-								# Update the tags - start by creating an empty array
-								taglist=[]
-
-								# Iterate through the tag keys list for the stuff we're interested in. 
-								for tag in tagXref.keys():
-									# If it exists in the list, we have a tag key ID for it. 
-									if tag in tagsByName.keys():
-										# Append the tags list with the new tags
-										taglist.append({"tagKeyId" : tagsByName[tag],"value" : ap_data_by_bssid[bssid][tagXref[tag]]})
-										print("\tAdded tag "+tag+" : "+tagXref[tag]+" ("+tagsByName[tag]+")")
-
-								# Update the tags object in the ap dict with the list object we just made		
-								ap['tags']=taglist
-							else:
-								#This AP is unknown to the controller, and thus not mine, and we need to set the mine flag to false. 
-								ap['mine']=False
-
-	# Building the new file and Writing the updated data back out to it
-	with tempfile.TemporaryDirectory() as tmpdirname:
-		# Get all the other stuff from the input ESX
-		orig_archive.extractall(tmpdirname)
-
-		# Write out the AP data
-		with open(os.path.join(tmpdirname, 'accessPoints.json'), 'w') as outfile:
-			json.dump(accessPointsJSON, outfile)
-
-		# Write out the Measurements data
-		with open(os.path.join(tmpdirname, 'accessPointMeasurements.json'), 'w') as outfile:
-			json.dump(accessPointMeasurementsJSON, outfile)
-		
-		# Create new ESX file
-		new_archive = zipfile.ZipFile(current_filename + "_modified.esx",'w',zipfile.ZIP_DEFLATED)
-		for dirname, subdirs, files in os.walk(tmpdirname):
-			for filename in files:
-				new_archive.write(os.path.join(tmpdirname, filename), filename)
+		wasMine[ap['id']]=ap.get('mine', False)
+		for measuredRadio in radiosByAP.get(ap['id'],[]):
+			for accessPointMeasurementId in measuredRadio['accessPointMeasurementIds']:
+				if accessPointMeasurementId in measurementsByID:
+					measurement, mac = measurementsByID[accessPointMeasurementId]
+					apsByBssid.setdefault(mac,[]).append((ap, measurement))
+					surveyedAPs[ap['id']]=ap
+
+	matchedAPs={}
+	matchedBss=0
+	unmatchedBss=0
+
+	#Iterate through each BSSID from the controller. Good thing computers are fast at repetitive tasks!
+	for bssKey in ap_data_by_bssid:
+		if bssKey not in apsByBssid:
+			unmatchedBss+=1
+			continue
+
+		matchedBss+=1
+		bssid=ap_data_by_bssid[bssKey]['bssid']
+		for ap, measurement in apsByBssid[bssKey]:
+			matchedAPs[ap['id']]=ap
+
+			print("Matched bssid {0}".format(bssid))
+
+			# This AP is in the controller BSS list, and is therefore "mine", and we need to set the mine flag to true. 
+			ap['mine']=True
+
+			# Update the ESSID Name
+			measurement['ssid'] = ap_data_by_bssid[bssKey]['ssid']
+			print("\tUpdated ESSID to {0}".format(ap_data_by_bssid[bssKey]['ssid']))
+
+			# Update the AP Name
+			ap['name'] = ap_data_by_bssid[bssKey]['ap_name']
+			print("\tUpdated AP Name to {0}".format(ap['name']))
+
+			# Update the AP model
+			ap['model'] = ap_data_by_bssid[bssKey]['model']
+			print("\tUpdated AP Model to {0}".format(ap['model']))
+
+			# Update the AP color
+			# Is the scheme/color in our list?
+			print("Color:"+ap_data_by_bssid[bssKey]['color'])
+			if '/' in ap_data_by_bssid[bssKey]['color']: 
+				scheme, color=ap_data_by_bssid[bssKey]['color'].split('/')
+				if scheme in colors:
+					if color in colors[scheme]:
+						# Update the color. 						
+						ap['color']=colors[scheme][color]
+						print("\tUpdated color to "+scheme+"/"+color+" ("+colors[scheme][color]+")")
+				else:
+					# Remove this entire else block if you just want to leave whatever value, if any, alone. 
+					# Check to see if an existing color tag exists
+					if 'color' in ap.keys():
+						# delete it
+						del ap['color']
+
+			# Update the tags - start by creating an empty array
+			taglist=[]
+
+			# Iterate through the tag keys list for the stuff we're interested in. 
+			for tag in tagXref.keys():
+				# If it exists in the list, we have a tag key ID for it. 
+				if tag in tagsByName.keys():
+					# Append the tags list with the new tags
+					taglist.append({"tagKeyId" : tagsByName[tag],"value" : ap_data_by_bssid[bssKey][tagXref[tag]]})
+					print("\tAdded tag "+tag+" : "+tagXref[tag]+" ("+tagsByName[tag]+")")
+
+			# Update the tags object in the ap dict with the list object we just made		
+			ap['tags']=taglist
+
+	# Any surveyed AP that didn't match anything from the controller is unknown to it, and thus not mine. 
+	# A delta file only has what changed, so there the only APs that stop being mine are ones whose BSSIDs were removed.
+	if options.delta:
+		notMine={}
+		for bssid in removedBssids:
+			for ap, measurement in apsByBssid.get(bssid, []):
+				if ap['id'] not in matchedAPs:
+					notMine[ap['id']]=ap
+	else:
+		notMine={}
+		for apId in surveyedAPs:
+			if apId not in matchedAPs:
+				notMine[apId]=surveyedAPs[apId]
+	for apId in notMine:
+		notMine[apId]['mine']=False
+
+	newlyMine=0
+	for apId in matchedAPs:
+		if not wasMine[apId]:
+			newlyMine+=1
+
+	print("==========")
+	print("Matched "+str(matchedBss)+" BSSIDs on "+str(len(matchedAPs))+" APs")
+	print(str(unmatchedBss)+" BSSIDs in "+args[0]+" not found in survey")
+	if badBss:
+		print(str(badBss)+" rows in "+args[0]+" skipped, bss isn't a MAC address")
+	if options.delta:
+		print(str(len(removedBssids))+" BSSIDs removed from the controllers, "+str(len(notMine))+" surveyed APs set as not mine")
+	else:
+		print(str(len(notMine))+" surveyed APs not matched (set as not mine)")
+	print(str(newlyMine)+" APs newly set as mine")
+
+	# Building the new file and Writing the updated data back out to it.
+	# Everything we didn't touch is copied across as-is, without being decompressed. 
+	new_archive = ESXWriter(esx, current_filename + "_modified.esx")
+
+	# Write out the AP data
+	new_archive.replace('accessPoints.json', accessPointsJSON)
+
+	# Write out the Measurements data
+	new_archive.replace('accessPointMeasurements.json', accessPointMeasurementsJSON)
+
+	# Create new ESX file
+	new_archive.save()
 
 	# Close the files
-	orig_archive.close()
-	new_archive.close()
+	esx.close()
 
 if __name__ == "__main__":
 	main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Keyed MAC and serial number anonymization for the report scripts.
+# Every fake value is derived from an HMAC-SHA256 of the real one under a secret key, so the same MAC or serial always
+# anonymizes to the same thing for the same key - across runs, across files, and across batch workers - with no lookup
+# table to share. Anyone with the key can re-run the mapping; without it, the output can't be walked back to the real values.
+# The key comes from a file (--anon-key FILE) or the ESX_ANON_KEY environment variable. With neither, a random key is used
+# for the run, so it's consistent within that run only.
+# MACs and serials are anonymized a column at a time: values are classified and parsed as a whole (see macaddr.py), and the
+# HMAC is worked out once per distinct value.
+# (c) 2024 Ian Beyer
+
+import hmac
+import os
+import sys
+import numpy as np
+from macaddr import classify, formatMacs, kindColon, kindDash, kindDot, kindSerial, kindDelimiters
+
+keyEnv='ESX_ANON_KEY'
+
+# Made up serials look like real ones: country of manufacture, four letters, a digit and three letters/digits
+countries=['CN','TH','VN','US','JP','MX','CZ']
+letters='ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+digits='0123456789'
+
+ouiMask=np.uint64(0xFFFFFF000000)
+hostMask=np.uint64(0x000000FFFFFF)
+laaBit=np.uint64(0x020000000000)
+multicastBit=np.uint64(0x010000000000)
+
+
+def loadKey(path=None, warn=True):
+	# Key bytes from the key file, else the environment, else a random one-off key
+	if path:
+		with open(path, 'rb') as keyFile:
+			key=keyFile.read().strip()
+		if not key:
+			sys.exit("Anonymization key file "+path+" is empty")
+		return key
+	if os.environ.get(keyEnv):
+		return os.environ[keyEnv].encode('utf-8')
+	if warn:
+		print("No anonymization key given (--anon-key or "+keyEnv+"), using a one-off key: anonymized values won't match other runs", file=sys.stderr)
+	return os.urandom(32)
+
+
+class Anonymizer:
+
+	def __init__(self, key, laa=False, oui=False):
+		self.key=key
+		self.laa=laa
+		self.oui=oui
+		# HMAC-SHA256 keyed once up front and copied for every value, so the key schedule isn't redone each time
+		self.hmac=hmac.new(key, digestmod='sha256')
+
+	def digests(self, kind, values):
+		# HMACs of a list of byte strings. kind keeps the MAC and serial mappings independent of each other.
+		prefix=self.hmac.copy()
+		prefix.update(kind+b':')
+		out=[]
+		for value in values:
+			mac=prefix.copy()
+			mac.update(value)
+			out.append(mac.digest())
+		return out
+
+	def macInts(self, macs):
+		# Anonymized 48-bit values for an array of real ones
+		macs=np.asarray(macs, dtype=np.uint64)
+		distinct, inverse = np.unique(macs, return_inverse=True)
+		raw=distinct.astype('>u8').tobytes()
+		digests=self.digests(b'mac', [raw[i+2:i+8] for i in range(0, len(raw), 8)])
+		fake=np.frombuffer(b''.join(d[:8] for d in digests), dtype='>u8').astype(np.uint64) >> np.uint64(16)
+		if self.laa:
+			# Locally administered, unicast
+			fake=(fake | laaBit) & ~multicastBit
+		if self.oui:
+			fake=(distinct & ouiMask) | (fake & hostMask)
+		return fake[inverse.reshape(-1)]
+
+	def values(self, values, macs=True, serials=True):
+		# Anonymizes the MACs (aa:bb:cc:dd:ee:ff, aa-bb-..., aabb.ccdd.eeff) and/or Aruba serial numbers in a list/column of values,
+		# in one pass over it (see macaddr.classify). MACs are written in the same notation (lower case) as the original, serials
+		# are replaced with a made up serial of the same shape. Anything else comes back as it was.
+		# Bare hex is left alone, since a 12 digit number in a tag is more likely to be something else.
+		# Returns an object array, and the kinds from classify().
+		out=np.array(values, dtype=object)
+		kinds, parsed = classify(out)
+		if macs:
+			for kind in [kindColon, kindDash, kindDot]:
+				rows=np.flatnonzero(kinds == kind)
+				if len(rows):
+					out[rows]=formatMacs(self.macInts(parsed[rows]), kindDelimiters[kind])
+		if serials:
+			rows=np.flatnonzero(kinds == kindSerial)
+			if len(rows):
+				distinct, inverse = np.unique(out[rows].astype(str), return_inverse=True)
+				digests=self.digests(b'serial', [serial.encode('ascii') for serial in distinct.tolist()])
+				fake=np.array([fakeSerial(d) for d in digests], dtype=object)
+				out[rows]=fake[inverse.reshape(-1)]
+		return out, kinds
+
+	def macs(self, values):
+		return self.values(values, serials=False)[0]
+
+	def serials(self, values):
+		return self.values(values, macs=False)[0]
+
+	def pseudonyms(self, kind, values, prefix):
+		# Stand-ins for free text such as AP names and SSIDs: prefix plus 12 hex digits of the HMAC. Empty values stay empty.
+		distinct=[value for value in dict.fromkeys(values) if value]
+		digests=self.digests(kind, [value.encode('utf-8') for value in distinct])
+		table={value: prefix+d[:6].hex() for value, d in zip(distinct, digests)}
+		return [table.get(value, value) for value in values]
+
+	def tables(self, values, macs=True, serials=True):
+		# ({real: anonymized} for the MACs, the same for the serials) among values, for scripts that look values up one at a time
+		values=list(dict.fromkeys(values))
+		fakes, kinds = self.values(values, macs, serials)
+		macTable={}
+		serialTable={}
+		for real, fake, kind in zip(values, fakes, kinds.tolist()):
+			if fake is real:
+				continue
+			if kind == kindSerial:
+				serialTable[real]=fake
+			else:
+				macTable[real]=fake
+		return macTable, serialTable
+
+	def frame(self, df, columns, macs=True, serials=True):
+		# A copy of the DataFrame with the MACs and/or serials in the given columns anonymized
+		df=df.copy()
+		for column in columns:
+			if column in df.columns:
+				df[column]=self.values(df[column].astype(object).to_numpy(), macs, serials)[0]
+		return df
+
+
+def fakeSerial(d):
+	# A serial of the same shape as an Aruba one, from the HMAC of the real one
+	fake=countries[d[0] % len(countries)]
+	fake+=''.join(letters[b % 26] for b in d[1:5])
+	fake+=digits[d[5] % 10]
+	fake+=''.join((letters+digits)[b % 36] for b in d[6:9])
+	return fake
+
+
+def fromArgs(args):
+	# The Anonymizer for a script's -a/-s/-l/-p/--anon-key options, or None if it isn't anonymizing anything
+	if not (args['anonymize_macs'] or args['anonymize_serials']):
+		return None
+	return Anonymizer(loadKey(args['anon_key']), args['laa_macs'], args['preserve_oui'])
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+# HTTP client for the ArubaOS 8 REST API, shared by everything that talks to conductors and controllers.
+# - One keep-alive connection pool per host, reused for every call to that host
+# - Separate connect and read timeouts on every request
+# - Bounded retries with exponential backoff and full jitter, for connection errors, timeouts, 429 and 5xx
+# - A circuit breaker per host: after a run of failed requests (retries included) the rest of the retries and any further
+#   calls to the host are skipped outright for a cooldown period, so a dead controller costs a few timeouts instead of one
+#   per attempt of every call
+# - Request counts and latency histograms, per host and overall, for the end of run summary
+# Status is checked before anything is pulled out of the response body, so a failed call raises AOSError with the
+# controller's own error message rather than a KeyError.
+# (c) 2024 Ian Beyer
+
+import random
+import threading
+import time
+import requests
+import requests.adapters
+
+
+class AOSError(Exception):
+	pass
+
+
+class CircuitOpenError(AOSError):
+	# Raised without making a request when the host's circuit breaker is open
+	pass
+
+
+# Status codes worth another try. Anything else (401, 404, etc.) is going to fail the same way again.
+retryStatus={429, 500, 502, 503, 504}
+
+
+class Histogram:
+	# Latency histogram with fixed bucket edges in seconds. Not thread safe on its own - ClientStats holds the lock.
+
+	edges=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+	def __init__(self):
+		self.counts=[0]*(len(self.edges)+1)
+		self.total=0.0
+		self.n=0
+		self.max=0.0
+
+	def add(self, seconds):
+		i=0
+		while i < len(self.edges) and seconds > self.edges[i]:
+			i+=1
+		self.counts[i]+=1
+		self.total+=seconds
+		self.n+=1
+		self.max=max(self.max, seconds)
+
+	def mean(self):
+		return self.total/self.n if self.n else 0.0
+
+	def percentile(self, p):
+		# Upper edge of the bucket the p'th percentile falls in, which is as close as a histogram can get
+		if self.n == 0:
+			return 0.0
+		target=p/100.0*self.n
+		seen=0
+		for i, count in enumerate(self.counts):
+			seen+=count
+			if seen >= target:
+				return self.edges[i] if i < len(self.edges) else self.max
+		return self.max
+
+	def format(self):
+		labels=['<='+str(e)+'s' for e in self.edges]+['>'+str(self.edges[-1])+'s']
+		return "  ".join(label+":"+str(count) for label, count in zip(labels, self.counts) if count)
+
+
+class ClientStats:
+
+	def __init__(self):
+		self.lock=threading.Lock()
+		self.requests=0
+		self.retries=0
+		self.failures=0
+		self.shortCircuited=0
+		self.status={}
+		self.latency=Histogram()
+		self.hostLatency={}
+
+	def record(self, host, seconds, status):
+		# status is the HTTP status code, or the exception name if there was no response
+		with self.lock:
+			self.requests+=1
+			self.status[status]=self.status.get(status, 0)+1
+			self.latency.add(seconds)
+			self.hostLatency.setdefault(host, Histogram()).add(seconds)
+
+	def count(self, name):
+		with self.lock:
+			setattr(self, name, getattr(self, name)+1)
+
+	def summary(self):
+		lines=[]
+		lines.append(str(self.requests)+" requests, "+str(self.retries)+" retries, "+str(self.failures)+" failed calls, "+str(self.shortCircuited)+" skipped by circuit breaker")
+		lines.append("Responses: "+", ".join(str(k)+": "+str(v) for k, v in sorted(self.status.items(), key=lambda item: str(item[0]))))
+		lines.append("Latency: mean {:.3f}s, p50 <={}s, p95 <={}s, max {:.3f}s".format(self.latency.mean(), self.latency.percentile(50), self.latency.percentile(95), self.latency.max))
+		lines.append("  "+self.latency.format())
+		return "\n".join(lines)
+
+
+class CircuitBreaker:
+	# Opens after threshold consecutive failed requests - every attempt counts, retries included - then lets one trial
+	# request through once cooldown seconds have passed. A success closes it again.
+
+	def __init__(self, threshold, cooldown):
+		self.threshold=threshold
+		self.cooldown=cooldown
+		self.failures=0
+		self.openedAt=None
+		self.lock=threading.Lock()
+
+	def allow(self):
+		with self.lock:
+			if self.openedAt is None:
+				return True
+			if time.monotonic()-self.openedAt >= self.cooldown:
+				# Half open: let this one through, and the next failure opens it again straight away
+				self.openedAt=None
+				self.failures=self.threshold-1
+				return True
+			return False
+
+	def success(self):
+		with self.lock:
+			self.failures=0
+			self.openedAt=None
+
+	def failure(self):
+		with self.lock:
+			self.failures+=1
+			if self.failures >= self.threshold:
+				self.openedAt=time.monotonic()
+
+
+class AOSClient:
+
+	def __init__(self, port="4343", api="v1", verify=False, connectTimeout=5, readTimeout=30, retries=3, backoff=0.5, maxBackoff=10,
+			breakerThreshold=3, breakerCooldown=60, poolSize=4):
+		self.port=str(port)
+		self.api=api
+		self.verify=verify
+		self.timeout=(connectTimeout, readTimeout)
+		self.retries=retries
+		self.backoff=backoff
+		self.maxBackoff=maxBackoff
+		self.breakerThreshold=breakerThreshold
+		self.breakerCooldown=breakerCooldown
+		self.poolSize=poolSize
+		self.sessions={}
+		self.breakers={}
+		self.lock=threading.Lock()
+		self.stats=ClientStats()
+
+	def baseUrl(self, host):
+		return "https://"+host+":"+self.port+"/"+self.api+"/"
+
+	def session(self, host):
+		# One session (and so one connection pool) per host. A host is only ever worked on by one thread at a time in
+		# apbss-db-ekahau.py, so the sessions don't need to be thread safe themselves.
+		with self.lock:
+			if host not in self.sessions:
+				session=requests.Session()
+				adapter=requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.poolSize)
+				session.mount("https://", adapter)
+				self.sessions[host]=session
+				self.breakers[host]=CircuitBreaker(self.breakerThreshold, self.breakerCooldown)
+			return self.sessions[host]
+
+	def breaker(self, host):
+		self.session(host)
+		return self.breakers[host]
+
+	def get(self, host, path, params=None, retry=True):
+		# GET baseUrl(host)+path. Returns the response if it came back 200, otherwise raises AOSError.
+		breaker=self.breaker(host)
+		if not breaker.allow():
+			self.stats.count('shortCircuited')
+			raise CircuitOpenError(host+" has failed "+str(self.breakerThreshold)+" requests in a row, skipping it for "+str(self.breakerCooldown)+"s")
+
+		session=self.session(host)
+		attempts=self.retries+1 if retry else 1
+		error=None
+		for attempt in range(attempts):
+			if attempt > 0:
+				if not breaker.allow():
+					# Too many failed attempts in a row - don't wait out the rest of the retries on a host that isn't answering
+					self.stats.count('shortCircuited')
+					break
+				self.stats.count('retries')
+				# Full jitter: anywhere between zero and the exponential backoff, so retries from many workers don't line up
+				time.sleep(random.uniform(0, min(self.maxBackoff, self.backoff*(2**(attempt-1)))))
+			start=time.perf_counter()
+			try:
+				response=session.get(self.baseUrl(host)+path, params=params, verify=self.verify, timeout=self.timeout)
+			except requests.RequestException as e:
+				self.stats.record(host, time.perf_counter()-start, type(e).__name__)
+				error=AOSError(host+": "+type(e).__name__+": "+str(e))
+				breaker.failure()
+				continue
+			self.stats.record(host, time.perf_counter()-start, response.status_code)
+			if response.status_code == 200:
+				breaker.success()
+				return response
+			error=AOSError(host+": HTTP "+str(response.status_code)+" "+errorMessage(response))
+			breaker.failure()
+			if response.status_code not in retryStatus:
+				break
+
+		self.stats.count('failures')
+		raise error
+
+	def getJSON(self, host, path, params=None, retry=True):
+		response=self.get(host, path, params, retry)
+		try:
+			return response.json()
+		except ValueError:
+			raise AOSError(host+": response to "+path+" isn't JSON")
+
+	def login(self, host, username, password):
+		# Returns the UIDARUBA session token
+		result=self.getJSON(host, "api/login", {'username': username, 'password': password}).get('_global_result', {})
+		if 'UIDARUBA' not in result:
+			raise AOSError(host+": login failed - "+str(result.get('status_str', 'no session token returned')))
+		return result['UIDARUBA']
+
+	def logout(self, host, token):
+		# Logging out isn't worth retrying - the session times out on the controller anyway
+		self.get(host, "api/logout", {'UIDARUBA': token}, retry=False)
+
+	def show(self, host, token, command):
+		# Runs a show command and returns the response, for the caller to decode (JSON, XML or text)
+		return self.get(host, "configuration/showcommand", {'command': command, 'UIDARUBA': token})
+
+	def close(self):
+		with self.lock:
+			for session in self.sessions.values():
+				session.close()
+			self.sessions={}
+
+
+def errorMessage(response):
+	# The controller's own error message, if it sent one
+	try:
+		return str(response.json()['_global_result']['status_str'])
+	except (ValueError, KeyError, TypeError):
+		return response.reason or ''
@@ -5,7 +5,6 @@
 # (c) 2021 Ian Beyer, Aruba Networks <canerdian@hpe.com>
 # This code is provided as-is with no warranties. Use at your own risk. 
 
-import requests
 import argparse
 import json
 import csv
@@ -14,9 +13,13 @@ import warnings
 import sys
 import xmltodict
 import datetime
+import time
+import concurrent.futures
 import yaml
 from yaml.loader import FullLoader
 from pathlib import Path
+from bsssnapshot import BSSSnapshot
+from aosclient import AOSClient, AOSError
 
 
 # Set output file name
@@ -42,6 +45,12 @@ cli.add_argument("-j", "--json", required=False, help='Output to JSON', default=
 cli.add_argument("-v", "--verify", required=False, help='Verify HTTPS', default=False, action='store_true')
 cli.add_argument("-P", "--port", required=False, help="Target Port", default="4343")
 cli.add_argument("-a", "--api", required=False, help="API Version (default is v1)", default="v1")
+cli.add_argument("-w", "--workers", required=False, type=int, help="Number of controllers to poll at once (default 8)", default=8)
+cli.add_argument("-d", "--delta", required=False, help="Only write BSSIDs added, removed or changed since the last --delta run, tracked in a snapshot database", default=False, action="store_true")
+cli.add_argument("-s", "--snapshot", required=False, help="Snapshot database for --delta (default: output/<conductor>_bss-snapshot.sqlite)", default=None)
+cli.add_argument("-T", "--timeout", required=False, type=float, help="Read timeout in seconds for each API request (default 30)", default=30)
+cli.add_argument("--connect-timeout", required=False, type=float, help="Connect timeout in seconds for each API request (default 5)", default=5)
+cli.add_argument("-r", "--retries", required=False, type=int, help="Retries for a failed API request, with backoff (default 3)", default=3)
 
 args = vars(cli.parse_args())
 
@@ -84,6 +93,8 @@ if args['json']: outjson=True
 outfile=args['output']
 port=args['port']
 api=args['api']
+workers=max(1, args['workers'])
+timeout=args['timeout']
 
 #Set things up
 
@@ -98,41 +109,24 @@ if username == None:
 if password == None:
 	exit()
 
-baseurl = "https://"+aosDevice+":"+port+"/"+api+"/"
-
-
-headers = {}
-payload = ""
-cookies = ""
-
-session=requests.Session()
+# All API calls go through one client - pooled connections, timeouts, retries and a circuit breaker per controller (see aosclient.py)
+client = AOSClient(port, api, httpsVerify, connectTimeout=args['connect_timeout'], readTimeout=timeout, retries=args['retries'])
 
 ## Log in to Mobility Condusctor and get session token
 
-loginparams = {'username': username, 'password' : password}
-response = session.get(baseurl+"api/login", params = loginparams, headers=headers, data=payload, verify = httpsVerify)
-jsonData = response.json()['_global_result']
-
-if response.status_code == 200 :
-
-	#print(jsonData['status_str'])
-	sessionToken = jsonData['UIDARUBA']
-
-#	print(sessionToken)
-else :
-	sys.exit("Conductor Login Failed - Could not get session token")
-
-reqParams = {'UIDARUBA':sessionToken}
+try:
+	sessionToken = client.login(aosDevice, username, password)
+except AOSError as e:
+	sys.exit("Conductor Login Failed - Could not get session token: "+str(e))
 
 
 ## Define Functions
 
 def showCmd(command, datatype):
-	showParams = {
-		'command' : 'show '+command,
-		'UIDARUBA':sessionToken
-			}
-	response = session.get(baseurl+"configuration/showcommand", params = showParams, headers=headers, data=payload, verify = httpsVerify)
+	try:
+		response = client.show(aosDevice, sessionToken, 'show '+command)
+	except AOSError as e:
+		sys.exit("show "+command+" failed: "+str(e))
 	#print(response.url)
 	#print(response.text)
 	if datatype == 'JSON' :
@@ -192,6 +186,8 @@ timestamp=datetime.datetime.now()
 #If using default output filename, send to timestamped file in output folder, otherwise go with what the user specified. 
 
 if outfile == defaultfile :
+	if args['delta']:
+		outfile="ap-bss-delta"
 	csvfilename="./output/"+mcrHostname+"_"+timestamp.strftime("%Y%m%d_%H%M")+"_"+outfile+'.csv'
 	#jsonfilename="./output/"+mcrHostname+"_"+timestamp.strftime("%Y%m%d_%H%M")+"_"+outfile+'.json'
 else:
@@ -204,107 +200,127 @@ totalEntries=0
 
 columns=['bss','ess','ap_name','group','model','serial','wired-mac','color']
 
+# In delta mode, rows are held until every controller has answered, then compared against the snapshot from the last run.
+# The CSV gets an extra first column saying what happened to each BSSID: added, changed or removed. Update_APs.py --delta reads this.
+snapshot=None
+polled={}
+if args['delta']:
+	snapshotfile=args['snapshot'] or "./output/"+mcrHostname+"_bss-snapshot.sqlite"
+	snapshot=BSSSnapshot(snapshotfile)
+	print("Comparing against "+str(len(snapshot))+" BSSIDs in "+snapshotfile)
+
+def pollController(md):
+	# Log in to one MD, pull its BSS table and log out again. Runs in a worker thread.
+	# Returns a result dict with the CSV rows rather than writing them, so only the main thread ever touches the CSV.
+	result={'md':md, 'rows':[], 'error':None, 'seconds':0.0}
+	start=time.perf_counter()
+	host=md['IP Address']
+	try:
+		mdSessionToken = client.login(host, username, password)
+
+		bsstable=client.show(host, mdSessionToken, 'show ap bss-table details').json()
+
+		# Iterate through the list of BSS
+		# columns=['bss','ess','ap_name','group','model','serial','wired-mac','color']
+		for bss in bsstable["Aruba AP BSS Table"]:
+			result['rows'].append([
+				bss['bss'],
+				bss['ess'],
+				bss['ap name'],
+				apByName[bss['ap name']]['Group'],
+				"AP-"+apByName[bss['ap name']]['AP Type'],
+				apByName[bss['ap name']]['Serial #'],
+				apByName[bss['ap name']]['Wired MAC Address'],
+				""
+				])
+
+		# Log out
+		try:
+			client.logout(host, mdSessionToken)
+		except AOSError:
+			print("Logout failed from "+host+". Session token may remain in memory.")
+		del mdSessionToken
+	except (AOSError, ValueError, KeyError) as e:
+		# Login failures, timeouts, controllers the circuit breaker has given up on, and responses that aren't what we
+		# expect all just fail this controller
+		result['error']=type(e).__name__+": "+str(e)
+	finally:
+		result['seconds']=time.perf_counter()-start
+	return result
+
+
+results=[]
+pollStart=time.perf_counter()
+
 with open(csvfilename, 'w') as csvfile:
 	write=csv.writer(csvfile)
-	write.writerow(columns)
+	if snapshot is None:
+		write.writerow(columns)
+	else:
+		write.writerow(['change']+columns)
 
+	upList=[]
 	for md in mdList:
 		if md['Status'] == 'up' :
-			valid = False
-			## valid only set to True if we get a token. 
-
-			
 			## Add code here to skip from a denylist. 
-
-
-			#print("logging into controller at "+md['IP Address']+"...", end='')
-
-			mdsession = requests.Session()
-			mdbaseurl = "https://"+md['IP Address']+":"+port+"/"+api+"/"
-			mdloginparams = {'username': username, 'password' : password}
-			mdresponse = mdsession.get(mdbaseurl+"api/login", params = mdloginparams, headers=headers, data=payload, verify = httpsVerify)
-			mdjsonData = mdresponse.json()['_global_result']
-
-			
-			if mdresponse.status_code == 200 :
-
-				mdSessionToken = mdjsonData['UIDARUBA']
-				valid=True
-				#print("Success")
-			else :
-				print("Login to "+md['Name']+" Failed. Unable to get session token.")
-				#sys.exit("MD Login Failed on "+md['IP Address'])
-	 		
-
-
-			if valid: 
-				mdReqParams = {
-					'UIDARUBA':mdSessionToken,
-					'command':'show ap bss-table details'
-					}
-
-				showresponse = mdsession.get(mdbaseurl+"configuration/showcommand", params = mdReqParams, headers=headers, data=payload, verify = httpsVerify)
-				bsstable=showresponse.json()
-				
-				if loop == 0:
-					write.writerow(columns)
-				loop += 1
-				# Iterate through the list of BSS
-				records = 0
-				# columns=['bss','ess','ap_name','group','model','serial','wired-mac','color']
-				for bss in bsstable["Aruba AP BSS Table"]:
-					datarow=[
-						bss['bss'],
-						bss['ess'],
-						bss['ap name'],
-						apByName[bss['ap name']]['Group'],
-						"AP-"+apByName[bss['ap name']]['AP Type'],
-						apByName[bss['ap name']]['Serial #'],
-						apByName[bss['ap name']]['Wired MAC Address'],
-						""
-						]
-
-					# Put it in the CSV 
-					write.writerow(datarow)
-					records+=1
-					#Move on to the next AP
-
-				# Sum up and log out
-				totalEntries+=records
-				print("Processed "+str(records)+" Entries from "+md['Name'])
-				logoutresponse = mdsession.get(mdbaseurl+"api/logout", verify=False)
-				jsonData = logoutresponse.json()['_global_result']
-
-				if response.status_code == 200 :
-					token = jsonData['UIDARUBA']
-					del mdSessionToken
-					#print("MD Logout from "+md['Name']+" at "+md['IP Address']+" successful. Token deleted.")
-				else :
-					del mdSessionToken
-					print("Logout failed from "+md['IP Address']+". Session token may remain in memory.")	
-			else:
-				print("Controller has no valid token. Skipping. ")
+			upList.append(md)
 		else :
 			print("Controller is down. Skipping "+md['Name']+" at "+md['IP Address'])
 
+	# Poll the controllers concurrently. Rows are written here, one controller's worth at a time as each one finishes.
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+		futures=[pool.submit(pollController, md) for md in upList]
+		for future in concurrent.futures.as_completed(futures):
+			result=future.result()
+			results.append(result)
+			md=result['md']
+			if result['error'] is None:
+				if snapshot is None:
+					write.writerows(result['rows'])
+					totalEntries+=len(result['rows'])
+				else:
+					polled[md['IP Address']]=result['rows']
+				print("Processed "+str(len(result['rows']))+" Entries from "+md['Name']+" in {:.2f}s".format(result['seconds']))
+			else:
+				print("Skipping "+md['Name']+" at "+md['IP Address']+": "+result['error'])
+
+	if snapshot is not None:
+		added, changed, removed = snapshot.apply(polled, timestamp)
+		for change, rows in (('added', added), ('changed', changed), ('removed', removed)):
+			for row in rows:
+				write.writerow([change]+row)
+		totalEntries=len(added)+len(changed)+len(removed)
+		snapshot.close()
+		print(str(len(added))+" BSSIDs added, "+str(len(changed))+" changed, "+str(len(removed))+" removed since the last run")
+
 	# Close the file handle
 	csvfile.close()
-	print("Wrote "+str(totalEntries)+" records from "+str(len(mdList))+" controllers to "+csvfilename)
 
+pollTime=time.perf_counter()-pollStart
 
+# Summary, in controller list order
+results.sort(key=lambda r: upList.index(r['md']))
+print("==========")
+print("{:<24} {:<16} {:>8} {:>9}  {}".format('controller','address','entries','seconds','status'))
+for r in results:
+	print("{:<24} {:<16} {:>8} {:>9.2f}  {}".format(r['md']['Name'], r['md']['IP Address'], len(r['rows']), r['seconds'], 'OK' if r['error'] is None else 'FAILED'))
+print("==========")
+print("Wrote "+str(totalEntries)+" records from "+str(len([r for r in results if r['error'] is None]))+" of "+str(len(mdList))+" controllers to "+csvfilename+" in {:.2f}s".format(pollTime))
 
-## Log out of MCR and remove session
 
 
-response = session.get(baseurl+"api/logout", verify=False)
-jsonData = response.json()['_global_result']
+## Log out of MCR and remove session
+
 
-if response.status_code == 200 :
+print("API calls:")
+print(client.stats.summary())
 
-	#remove 
-	token = jsonData['UIDARUBA']
+try:
+	client.logout(aosDevice, sessionToken)
 	del sessionToken
 	print("MCR Logout successful. Token deleted.")
-else :
+except AOSError as e:
 	del sessionToken
-	sys.exit("Logout failed:")
\ No newline at end of file
+	sys.exit("Logout failed: "+str(e))
+finally:
+	client.close()
\ No newline at end of file
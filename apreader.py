@@ -16,20 +16,14 @@ import zipfile
 import pprint
 from yaml.loader import FullLoader
 from pathlib import Path
+from esxfile import ESXFile
 
 pp = pprint.PrettyPrinter(indent=2)
 print("==================================================================")
-with zipfile.ZipFile('test.esx', 'r') as ekahau:
-	with ekahau.open('accessPointMeasurements.json', 'r') as apmjson :
-		apmstring=apmjson.read()
-		apmdict=json.loads(apmstring)
-		#print(apmdict)
-	with ekahau.open('accessPoints.json', 'r') as apjson :
-		apstring=apjson.read()
-		apdict=json.loads(apstring)
-	with ekahau.open('measuredRadios.json', 'r') as radiojson :
-		radiostring=radiojson.read()
-		radiodict=json.loads(radiostring)
+with ESXFile(sys.argv[1] if len(sys.argv) > 1 else 'test.esx') as ekahau:
+	apmdict=ekahau.load('accessPointMeasurements')
+	apdict=ekahau.load('accessPoints')
+	radiodict=ekahau.load('measuredRadios')
 
 masterlist={}
 for ap in apdict['accessPoints']:
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Benchmark apbss-db-ekahau.py against the mock AOS8 server (mock-aos8.py).
+# Starts the mock with the given controller/AP counts, latency and failures, then runs the collector once per worker count
+# and reports wall time, peak memory (max RSS) and how many records and controllers came back.
+# Useful for picking -w/-T values before pointing the collector at production controllers.
+# (c) 2024 Ian Beyer
+
+import argparse
+import csv
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+scriptDir=os.path.dirname(os.path.abspath(__file__))
+
+
+def startMock(options):
+	cmd=[sys.executable, os.path.join(scriptDir, 'mock-aos8.py'),
+		'-P', str(options['port']),
+		'-C', str(options['controllers']),
+		'-A', str(options['aps']),
+		'-B', str(options['bss']),
+		'-l', str(options['latency']),
+		'-j', str(options['jitter']),
+		'-f', str(options['fail_rate']),
+		'--down', str(options['down']),
+		'--hang-count', str(options['hang_count']),
+		'--hang', str(options['hang'])]
+	mock=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	# It prints one line once it's listening
+	banner=mock.stdout.readline()
+	if mock.poll() is not None or not banner.startswith('Mock conductor'):
+		sys.exit("Mock server didn't start: "+banner+mock.stdout.read())
+	print(banner.strip())
+	return mock
+
+
+def runCollector(options, workers, outDir):
+	# Runs one collection and returns wall time, max RSS in MB, records written and the collector's output
+	prefix=os.path.join(outDir, 'bench_w'+str(workers))
+	cmd=[sys.executable, options['collector'],
+		'-t', '127.0.0.1', '-P', str(options['port']),
+		'-u', 'admin', '-p', 'admin',
+		'-o', prefix,
+		'-w', str(workers),
+		'-T', str(options['timeout'])]
+	start=time.perf_counter()
+	collector=subprocess.Popen(cmd, cwd=outDir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	output=collector.stdout.read()
+	# wait4 gives the resource usage of this one child, rather than the max over all children so far
+	pid, status, usage = os.wait4(collector.pid, 0)
+	elapsed=time.perf_counter()-start
+	collector.returncode=os.waitstatus_to_exitcode(status)
+
+	# ru_maxrss is in KB on Linux, bytes on macOS
+	maxrss=usage.ru_maxrss/1024.0
+	if sys.platform == 'darwin':
+		maxrss=maxrss/1024.0
+
+	records=0
+	if os.path.exists(prefix+'.csv'):
+		with open(prefix+'.csv', 'r') as csvfile:
+			records=max(0, sum(1 for row in csv.reader(csvfile))-1)
+	failed=sum(1 for line in output.splitlines() if line.rstrip().endswith('FAILED'))
+	return {'workers':workers, 'seconds':elapsed, 'maxrss':maxrss, 'records':records, 'failed':failed, 'exit':collector.returncode, 'output':output}
+
+
+def main():
+
+	cli=argparse.ArgumentParser(description='Benchmark apbss-db-ekahau.py against a local mock AOS8 environment')
+
+	cli.add_argument("--collector", required=False, help="Collector script to run (default: apbss-db-ekahau.py next to this script)", default=os.path.join(scriptDir, 'apbss-db-ekahau.py'))
+	cli.add_argument("-w", "--workers", required=False, type=int, nargs='+', help="Collector worker counts to try (default: 1 4 8 16)", default=[1,4,8,16])
+	cli.add_argument("-n", "--repeat", required=False, type=int, help="Runs per worker count, best time is reported (default 1)", default=1)
+	cli.add_argument("-T", "--timeout", required=False, type=float, help="Collector per-request timeout in seconds (default 5)", default=5)
+	cli.add_argument("-P", "--port", required=False, type=int, help="Port for the mock server (default 14343)", default=14343)
+	cli.add_argument("-C", "--controllers", required=False, type=int, help="Number of mock controllers (default 20)", default=20)
+	cli.add_argument("-A", "--aps", required=False, type=int, help="APs per controller (default 100)", default=100)
+	cli.add_argument("-B", "--bss", required=False, type=int, help="BSSIDs per AP (default 4)", default=4)
+	cli.add_argument("-l", "--latency", required=False, type=float, help="Added latency per request in milliseconds (default 100)", default=100)
+	cli.add_argument("-j", "--jitter", required=False, type=float, help="Random extra latency per request in milliseconds (default 50)", default=50)
+	cli.add_argument("-f", "--fail-rate", required=False, type=float, help="Fraction of requests that fail with HTTP 500 (default 0)", default=0)
+	cli.add_argument("--down", required=False, type=int, help="Controllers reported as down (default 0)", default=0)
+	cli.add_argument("--hang-count", required=False, type=int, help="Controllers that stall (default 0)", default=0)
+	cli.add_argument("--hang", required=False, type=float, help="How long stalled controllers take to answer, in seconds (default 60)", default=60)
+	cli.add_argument("-O", "--output-dir", required=False, help="Keep the collector CSVs here (default: a temp directory)", default=None)
+	cli.add_argument("-v", "--verbose", required=False, action="store_true", help="Print the collector output for every run")
+
+	options=vars(cli.parse_args())
+
+	mock=startMock(options)
+	results=[]
+	try:
+		with tempfile.TemporaryDirectory() as tmpDir:
+			outDir=options['output_dir'] or tmpDir
+			os.makedirs(outDir, exist_ok=True)
+			for workers in options['workers']:
+				best=None
+				for i in range(options['repeat']):
+					result=runCollector(options, workers, outDir)
+					if options['verbose']:
+						print(result['output'])
+					if result['exit'] != 0:
+						print("Collector exited with status "+str(result['exit'])+" at "+str(workers)+" workers:")
+						print(result['output'])
+					if best is None or result['seconds'] < best['seconds']:
+						best=result
+				results.append(best)
+				print("{:>3} workers: {:8.2f}s {:8.1f} MB  {} records, {} controllers failed".format(workers, best['seconds'], best['maxrss'], best['records'], best['failed']))
+	finally:
+		mock.send_signal(signal.SIGINT)
+		try:
+			mock.wait(timeout=10)
+		except subprocess.TimeoutExpired:
+			mock.kill()
+
+	print("==========")
+	print("{:>8} {:>10} {:>10} {:>10} {:>8} {:>9}".format('workers','seconds','max RSS MB','records','failed','speedup'))
+	for r in results:
+		print("{:>8} {:>10.2f} {:>10.1f} {:>10} {:>8} {:>8.1f}x".format(r['workers'], r['seconds'], r['maxrss'], r['records'], r['failed'], results[0]['seconds']/r['seconds']))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# End to end benchmark of the project scripts against synthetic projects from esxgen.py.
+# For each project size, generates a project (and a matching BSS table CSV), then runs AP_Report.py, ekahau-deploy.py,
+# ekahau-report.py, Update_APs.py and update-tags.py against it, each in its own process, and reports wall time and peak
+# memory (max RSS). A script that fails or runs past the timeout is marked as such, and isn't tried at the bigger sizes,
+# since it's only going to take longer to fall over there.
+# (c) 2024 Ian Beyer
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import esxgen
+
+scriptDir=os.path.dirname(os.path.abspath(__file__))
+
+# Script name and the arguments to run it with. {esx} and {csv} are filled in with the generated project and BSS CSV.
+# Everything runs in a scratch directory, since some of the scripts write their output to the current directory.
+scripts=[
+	('AP_Report.py', ['-i', '{esx}', '-o', 'ap_report.csv']),
+	('ekahau-deploy.py', ['-i', '{esx}', '-o', 'deploy']),
+	('ekahau-report.py', ['-i', '{esx}']),
+	('Update_APs.py', ['{csv}', '{esx}']),
+	('update-tags.py', ['-i', '{esx}', '-t', 'Benchmark Tag']),
+	]
+
+
+def runScript(script, args, workDir, timeout):
+	# Runs one script and returns its wall time, max RSS in MB, exit status and output
+	cmd=[sys.executable, os.path.join(scriptDir, script)]+args
+	output=tempfile.TemporaryFile(mode='w+')
+	start=time.perf_counter()
+	process=subprocess.Popen(cmd, cwd=workDir, stdout=output, stderr=subprocess.STDOUT, text=True)
+	timedOut=False
+	while True:
+		# wait4 gives the resource usage of this one child, rather than the max over all children so far
+		pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+		if pid != 0:
+			break
+		if time.perf_counter()-start > timeout:
+			process.kill()
+			timedOut=True
+			pid, status, usage = os.wait4(process.pid, 0)
+			break
+		time.sleep(0.05)
+	elapsed=time.perf_counter()-start
+	process.returncode=os.waitstatus_to_exitcode(status)
+
+	# ru_maxrss is in KB on Linux, bytes on macOS
+	maxrss=usage.ru_maxrss/1024.0
+	if sys.platform == 'darwin':
+		maxrss=maxrss/1024.0
+
+	output.seek(0)
+	text=output.read()
+	output.close()
+	if timedOut:
+		result='timeout'
+	elif process.returncode != 0:
+		result='exit '+str(process.returncode)
+	else:
+		result='ok'
+	return {'script':script, 'seconds':elapsed, 'maxrss':maxrss, 'result':result, 'output':text}
+
+
+def main():
+
+	cli=argparse.ArgumentParser(description='Benchmark the Ekahau project scripts against synthetic projects of increasing size')
+
+	cli.add_argument("-n", "--sizes", required=False, type=int, nargs='+', help="Project sizes to try, in APs (default: 100 1000 10000 50000)", default=[100,1000,10000,50000])
+	cli.add_argument("-S", "--scripts", required=False, nargs='+', help="Scripts to run (default: all of "+", ".join(s for s, a in scripts)+")", default=[s for s, a in scripts])
+	cli.add_argument("-T", "--timeout", required=False, type=float, help="Give up on a script after this many seconds (default 1800)", default=1800)
+	cli.add_argument("-r", "--radios", required=False, type=int, help="Wi-Fi radios per AP (default 3)", default=3)
+	cli.add_argument("-m", "--measurements", required=False, type=int, help="BSSIDs per measured radio (default 4)", default=4)
+	cli.add_argument("-b", "--buildings", required=False, type=int, help="Number of buildings (default: one per 500 APs)", default=None)
+	cli.add_argument("-f", "--floors", required=False, type=int, help="Floors per building (default 5)", default=5)
+	cli.add_argument("-t", "--extra-tags", required=False, type=int, help="Extra tag keys per project (default 2)", default=2)
+	cli.add_argument("-s", "--seed", required=False, type=int, help="Random seed for the projects (default 1)", default=1)
+	cli.add_argument("-O", "--output-dir", required=False, help="Keep the generated projects and script outputs here (default: a temp directory)", default=None)
+	cli.add_argument("-j", "--json", required=False, metavar='FILE', help="Also write the results to FILE as JSON", default=None)
+	cli.add_argument("-v", "--verbose", required=False, action="store_true", help="Print the output of every run")
+
+	options=vars(cli.parse_args())
+
+	for script in options['scripts']:
+		if script not in [s for s, a in scripts]:
+			sys.exit("Don't know how to run "+script+" - choose from "+", ".join(s for s, a in scripts))
+
+	results=[]
+	fallenOver={}
+	with tempfile.TemporaryDirectory() as tmpDir:
+		outDir=options['output_dir'] or tmpDir
+		os.makedirs(outDir, exist_ok=True)
+		for size in options['sizes']:
+			print("==========")
+			workDir=os.path.join(outDir, 'aps-'+str(size))
+			os.makedirs(workDir, exist_ok=True)
+			# ekahau-report.py looks for the SKU table in the current directory
+			shutil.copy(os.path.join(scriptDir, 'sku_lookup.json'), workDir)
+			esxPath=os.path.join(workDir, 'bench.esx')
+			csvPath=os.path.join(workDir, 'bench-bss.csv')
+			buildings=options['buildings'] or max(1, size//500)
+
+			start=time.perf_counter()
+			counts=esxgen.generate(esxPath, size, buildings, options['floors'], options['radios'], options['measurements'],
+				extraTags=options['extra_tags'], seed=options['seed'], bssCSV=csvPath)
+			print("{} APs: generated in {:.2f}s, {:.1f} MB, {} simulated radios, {} measurements".format(size, time.perf_counter()-start,
+				os.path.getsize(esxPath)/1048576.0, counts['simulatedRadios'], counts['accessPointMeasurements']))
+
+			for script, args in scripts:
+				if script not in options['scripts']:
+					continue
+				if script in fallenOver:
+					print("  {:<18} skipped ({} at {} APs)".format(script, fallenOver[script][1], fallenOver[script][0]))
+					continue
+				result=runScript(script, [a.format(esx=esxPath, csv=csvPath) for a in args], workDir, options['timeout'])
+				result['aps']=size
+				results.append(result)
+				if options['verbose'] or result['result'] != 'ok':
+					print(result['output'])
+				if result['result'] != 'ok':
+					fallenOver[script]=(size, result['result'])
+				print("  {:<18} {:8.2f}s {:8.1f} MB  {}".format(script, result['seconds'], result['maxrss'], result['result']))
+
+	print("==========")
+	print("{:<18} {:>8} {:>10} {:>10} {:>8}".format('script','APs','seconds','max RSS MB','result'))
+	for r in results:
+		print("{:<18} {:>8} {:>10.2f} {:>10.1f} {:>8}".format(r['script'], r['aps'], r['seconds'], r['maxrss'], r['result']))
+
+	if options['json']:
+		with open(options['json'], 'w') as jsonFile:
+			json.dump([{k: v for k, v in r.items() if k != 'output'} for r in results], jsonFile, indent=1)
+
+
+if __name__ == "__main__":
+	main()
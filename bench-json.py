@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Benchmark the JSON backends in esxjson.py against the original json.load() from the zip member stream.
+# Times parse (including decompression) and re-serialization for every JSON table in one or more ESX files.
+# (c) 2024 Ian Beyer
+
+import argparse
+import zipfile
+import json
+import time
+import esxjson
+
+
+def bestOf(repeat, func):
+	best=None
+	for i in range(repeat):
+		start=time.perf_counter()
+		result=func()
+		elapsed=time.perf_counter()-start
+		if best is None or elapsed < best:
+			best=elapsed
+	return best, result
+
+
+def main():
+
+	cli=argparse.ArgumentParser(description='Benchmark JSON backends for reading and writing Ekahau ESX tables')
+
+	cli.add_argument("-i", "--input", required=True, nargs='+', help='Input File(s)')
+	cli.add_argument("-n", "--repeat", required=False, type=int, default=3, help='Repetitions per measurement, best time is reported')
+
+	args = vars(cli.parse_args())
+
+	backends=esxjson.available()
+	print("Available backends: "+", ".join(backends))
+
+	# Totals across all files: current stdlib path, then load/dump per backend
+	totals={'current':0.0}
+	for b in backends:
+		totals[b+' load']=0.0
+		totals[b+' dump']=0.0
+
+	header="{:<32} {:>10} {:>10}".format('member','MB','current')
+	for b in backends:
+		header+=" {:>10} {:>10}".format(b+' ld', b+' dp')
+
+	for esxFile in args['input']:
+		print("==========")
+		print(esxFile)
+		print(header)
+		with zipfile.ZipFile(esxFile,'r') as archive:
+			for info in archive.infolist():
+				if not info.filename.endswith('.json'):
+					continue
+
+				# This is what the scripts did originally: stdlib json.load straight off the member stream
+				def current():
+					with archive.open(info.filename) as json_file:
+						return json.load(json_file)
+				elapsed, document = bestOf(args['repeat'], current)
+				totals['current']+=elapsed
+				line="{:<32} {:>10.2f} {:>10.4f}".format(info.filename[:32], info.file_size/1e6, elapsed)
+
+				for b in backends:
+					elapsed, document = bestOf(args['repeat'], lambda: esxjson.loads(archive.read(info.filename), using=b))
+					totals[b+' load']+=elapsed
+					line+=" {:>10.4f}".format(elapsed)
+					elapsed, data = bestOf(args['repeat'], lambda: esxjson.dumps(document, using=b))
+					totals[b+' dump']+=elapsed
+					line+=" {:>10.4f}".format(elapsed)
+				print(line)
+
+	print("==========")
+	print("Totals (seconds):")
+	for k in totals:
+		speedup=""
+		if k.endswith(' load') and totals[k] > 0:
+			speedup="  ({:.1f}x vs current)".format(totals['current']/totals[k])
+		print("  {:<16} {:>10.4f}{}".format(k, totals[k], speedup))
+
+if __name__ == "__main__":
+	main()
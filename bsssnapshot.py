@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Persistent snapshot of the controller BSS table, keyed by BSSID, for apbss-db-ekahau.py --delta.
+# Each run is compared against the snapshot to work out which BSSIDs were added, removed or changed since the last run.
+# Only those rows are written out, and the snapshot is updated to match.
+# The snapshot is a SQLite database, so it's a single file and updates are transactional - an interrupted run leaves
+# the previous snapshot intact.
+# (c) 2024 Ian Beyer
+
+import sqlite3
+
+# Same columns as the collector CSV, in the same order. 'group' is a reserved word in SQL, hence the different names.
+columns=['bss','ess','ap_name','group','model','serial','wired-mac','color']
+dbColumns=['bss','ess','ap_name','ap_group','model','serial','wired_mac','color']
+
+
+class BSSSnapshot:
+
+	def __init__(self, path):
+		self.path=path
+		self.db=sqlite3.connect(path)
+		self.db.execute("CREATE TABLE IF NOT EXISTS bss ("
+			"bss TEXT PRIMARY KEY, ess TEXT, ap_name TEXT, ap_group TEXT, model TEXT, serial TEXT, wired_mac TEXT, color TEXT, "
+			"controller TEXT, first_seen TEXT, last_changed TEXT)")
+		self.db.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		self.db.close()
+
+	def __len__(self):
+		return self.db.execute("SELECT COUNT(*) FROM bss").fetchone()[0]
+
+	def apply(self, polled, timestamp):
+		# polled maps each controller that answered this run to its list of rows (in collector column order).
+		# Returns the added, changed and removed rows, and updates the snapshot to match in one transaction.
+		# A BSSID only counts as removed if the controller it was last seen on answered this run - a controller that was
+		# down or timed out hasn't lost its APs, we just didn't hear about them.
+		previous={}
+		for record in self.db.execute("SELECT "+", ".join(dbColumns)+", controller FROM bss"):
+			previous[record[0]]=(list(record[:-1]), record[-1])
+
+		current={}
+		for controller, rows in polled.items():
+			for row in rows:
+				# An AP that failed over shows up on two controllers. Last one wins, same as Update_APs.py would do with the CSV.
+				current[row[0]]=(list(row), controller)
+
+		added=[]
+		changed=[]
+		moved=[]
+		for bss, (row, controller) in current.items():
+			if bss not in previous:
+				added.append(row)
+			elif previous[bss][0] != row:
+				changed.append(row)
+			elif previous[bss][1] != controller:
+				# Same data on a different controller isn't a change as far as the output goes, but the snapshot needs to know
+				moved.append((controller, bss))
+
+		removed=[]
+		for bss, (row, controller) in previous.items():
+			if bss not in current and controller in polled:
+				removed.append(row)
+
+		stamp=timestamp.isoformat(timespec='seconds')
+		with self.db:
+			self.db.executemany("INSERT INTO bss ("+", ".join(dbColumns)+", controller, first_seen, last_changed) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+				[row+[current[row[0]][1], stamp, stamp] for row in added])
+			self.db.executemany("UPDATE bss SET "+", ".join(c+"=?" for c in dbColumns[1:])+", controller=?, last_changed=? WHERE bss=?",
+				[row[1:]+[current[row[0]][1], stamp, row[0]] for row in changed])
+			self.db.executemany("UPDATE bss SET controller=? WHERE bss=?", moved)
+			self.db.executemany("DELETE FROM bss WHERE bss=?", [(row[0],) for row in removed])
+
+		return added, changed, removed
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+# Run ekahau-deploy.py over a whole directory (or glob) of ESX files in parallel.
+# Each project gets its own outputs, named after the project file: <output dir>/<project>_deploy.csv and <project>_deploy_table.xlsx
+# A project that fails is reported in the summary at the end rather than stopping the rest of the batch.
+# (c) 2024 Ian Beyer
+
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import glob
+import importlib.util
+import io
+import json
+import os
+import pathlib
+import pprint
+import secrets
+import sys
+import time
+import traceback
+import anonymize
+
+scriptDir=os.path.dirname(os.path.abspath(__file__))
+deployModule=None
+
+
+def loadDeploy():
+	# ekahau-deploy.py isn't importable by name because of the hyphen, so load it from its path. Once per worker process.
+	global deployModule
+	if deployModule is None:
+		spec=importlib.util.spec_from_file_location('ekahau_deploy', os.path.join(scriptDir, 'ekahau-deploy.py'))
+		deployModule=importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(deployModule)
+	return deployModule
+
+
+def findProjects(inputs):
+	# Each input can be a directory (all .esx files in it), a glob pattern, or a single file.
+	projects=[]
+	for source in inputs:
+		if os.path.isdir(source):
+			matches=sorted(glob.glob(os.path.join(source, '*.esx')))
+		else:
+			matches=sorted(glob.glob(source))
+		for match in matches:
+			if match not in projects:
+				projects.append(match)
+	return projects
+
+
+def outputPrefixes(projects, outputDir):
+	# Output names come from the project file name. If two projects in different folders share a name, number them.
+	prefixes={}
+	used={}
+	for project in projects:
+		stem=pathlib.PurePath(project).stem
+		used[stem]=used.get(stem, 0)+1
+		if used[stem] > 1:
+			stem=stem+"_"+str(used[stem])
+		prefixes[project]=os.path.join(outputDir, stem+"_deploy")
+	return prefixes
+
+
+def runProject(project, prefix, debugDump, cacheDir=None, incremental=False, anonymizeArgs=None):
+	# Runs in a worker process. Never raises - success or failure comes back in the result so the batch carries on.
+	# anonymizeArgs are the -a/-p/-l/-s/--anon-key options to pass on to the deploy script.
+	log=io.StringIO()
+	result={'input':project, 'output':prefix, 'ok':False, 'error':None}
+	start=time.perf_counter()
+	try:
+		# Module load (pandas import) happens once per worker and isn't counted against the project
+		deploy=loadDeploy()
+		start=time.perf_counter()
+		# Its pretty printer holds on to the real stdout, so point it at the log as well
+		deploy.pp=pprint.PrettyPrinter(indent=3, stream=log)
+		argv=['-i', project, '-o', prefix]
+		if debugDump is not None:
+			argv+=['--debug-dump', os.path.join(debugDump, pathlib.PurePath(prefix).name)]
+		if cacheDir is not None:
+			argv+=['--cache', cacheDir]
+		if incremental:
+			argv+=['--incremental']
+		if anonymizeArgs:
+			argv+=anonymizeArgs
+		with contextlib.redirect_stdout(log):
+			metrics=deploy.run(deploy.parseArgs(argv))
+		result['ok']=True
+		result['metrics']=metrics.report()
+	except SystemExit:
+		# The deploy script exits when it finds a corrupt project - the last thing it printed says why
+		lines=log.getvalue().strip().splitlines()
+		result['error']=lines[-1] if lines else "exited"
+	except Exception as e:
+		result['error']=type(e).__name__+": "+str(e)
+		result['traceback']=traceback.format_exc()
+	result['seconds']=time.perf_counter()-start
+	return result
+
+
+def main():
+
+	cli=argparse.ArgumentParser(description='Run ekahau-deploy.py over many Ekahau project files in parallel')
+
+	cli.add_argument("input", nargs='+', help='Input directories, glob patterns (quote them) or files')
+	cli.add_argument("-O", "--output-dir", required=False, help='Directory for the per-project outputs', default='.')
+	cli.add_argument("-w", "--workers", required=False, type=int, help='Number of worker processes (default: number of CPUs)', default=os.cpu_count())
+	cli.add_argument("-d", '--debug-dump', required=False, metavar='DIR', help="write snapshots of intermediate tables to DIR/<project>_deploy/", default=None)
+	cli.add_argument('--cache', required=False, metavar='DIR', help="table cache directory shared by all the projects (see ekahau-deploy.py --cache)", default=None)
+	cli.add_argument('--incremental', required=False, action="store_true", help="only rebuild what changed in each project since the last batch (see ekahau-deploy.py --incremental)")
+	cli.add_argument('--metrics', required=False, metavar='FILE', help="write per-project stage timings, row counts and memory use to FILE as JSON")
+	cli.add_argument("-a", '--anonymize-macs', required=False, action="store_true", help="anonymize MACs")
+	cli.add_argument("-p", '--preserve-oui', required=False, action="store_true", help="preserve OUIs when anonymizing MACs")
+	cli.add_argument("-l", '--laa-macs', required=False, action="store_true", help="anonymized MACs are LAA compliant")
+	cli.add_argument("-s", '--anonymize-serials', required=False, action="store_true", help="anonymize Aruba serial numbers")
+	cli.add_argument('--anon-key', required=False, metavar='FILE', help="secret key file for anonymizing, so MACs and serials anonymize the same way across every project and batch (default: "+anonymize.keyEnv+" from the environment, else a one-off key for this batch)", default=None)
+	cli.add_argument("-v", '--verbose', required=False, action="store_true", help="print full tracebacks for failed projects")
+
+	args = vars(cli.parse_args())
+
+	projects=findProjects(args['input'])
+	if len(projects) == 0:
+		sys.exit("No ESX files found")
+
+	os.makedirs(args['output_dir'], exist_ok=True)
+	prefixes=outputPrefixes(projects, args['output_dir'])
+
+	anonymizeArgs=[flag for flag, option in [('-a','anonymize_macs'), ('-p','preserve_oui'), ('-l','laa_macs'), ('-s','anonymize_serials')] if args[option]]
+	if args['anon_key']:
+		anonymizeArgs+=['--anon-key', args['anon_key']]
+	elif (args['anonymize_macs'] or args['anonymize_serials']) and not os.environ.get(anonymize.keyEnv):
+		# Every worker has to use the same key for the projects to match up, so pick one here for the workers to inherit
+		print("No anonymization key given (--anon-key or "+anonymize.keyEnv+"), using a one-off key: anonymized values match across this batch only")
+		os.environ[anonymize.keyEnv]=secrets.token_hex(32)
+
+	print("Processing "+str(len(projects))+" projects with "+str(args['workers'])+" workers...")
+	started=datetime.datetime.now().astimezone()
+	batchStart=time.perf_counter()
+	results=[]
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=args['workers']) as pool:
+		futures={}
+		for project in projects:
+			futures[pool.submit(runProject, project, prefixes[project], args['debug_dump'], args['cache'], args['incremental'], anonymizeArgs)]=project
+		for future in concurrent.futures.as_completed(futures):
+			try:
+				result=future.result()
+			except Exception as e:
+				# Worker process died outright (out of memory, killed, etc.)
+				result={'input':futures[future], 'ok':False, 'error':type(e).__name__+": "+str(e), 'seconds':0.0}
+			results.append(result)
+			status="OK  " if result['ok'] else "FAIL"
+			print(status+" {:8.2f}s  ".format(result['seconds'])+result['input'])
+
+	elapsed=time.perf_counter()-batchStart
+
+	# Summary, in input order
+	results.sort(key=lambda r: projects.index(r['input']))
+	failed=[r for r in results if not r['ok']]
+	print("==========")
+	print("{:<6} {:>10}  {}".format('status','seconds','project'))
+	for r in results:
+		print("{:<6} {:>10.2f}  {}".format('OK' if r['ok'] else 'FAIL', r['seconds'], r['input']))
+	print("==========")
+	if args['metrics']:
+		# Same stage records as ekahau-deploy.py --metrics, one set per project
+		with open(args['metrics'], 'w') as metricsFile:
+			json.dump({
+				'tool':'batch',
+				'started':started.isoformat(timespec='seconds'),
+				'seconds':round(elapsed, 6),
+				'workers':args['workers'],
+				'projects':[{
+					'input':r['input'],
+					'ok':r['ok'],
+					'error':r['error'],
+					'seconds':round(r['seconds'], 6),
+					# Workers are reused, and peak RSS is for the life of the process, so this is the most the worker had
+					# used by the end of this project - not this project's own peak
+					'workerPeakRSSMB':r['metrics']['peakRSSMB'] if 'metrics' in r else None,
+					'stages':r['metrics']['stages'] if 'metrics' in r else []
+					} for r in results]
+				}, metricsFile, indent=1)
+	print(str(len(results)-len(failed))+" succeeded, "+str(len(failed))+" failed, {:.2f}s wall time, {:.2f}s total processing time".format(elapsed, sum(r['seconds'] for r in results)))
+	if failed:
+		print("Errors:")
+		for r in failed:
+			print("  "+r['input']+": "+str(r['error']))
+			if args['verbose'] and r.get('traceback'):
+				print(r['traceback'])
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
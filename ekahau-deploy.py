@@ -12,102 +12,66 @@ import zlib
 import os
 import pprint
 import csv
-import random
-import re
-import string
 import pandas as pd
+from esxfile import ESXFile
+from esxtables import debugDump, projectTable, cachedStage, channelsFromFrequencies, radioPivot, radioIndexes, placeAPs
+from esxcache import openCache, defaultSizeMB, defaultCacheDir, memberCRCs, reportChanges, finishRun
+from metrics import Metrics
+import anonymize
 
 pp = pprint.PrettyPrinter(indent=3)
 
 pd.set_option('future.no_silent_downcasting', True)
 
-channelmap={}
-
-def macAnon(sourceMac, laa=False, oui=False, delim=':'):
-	anonyMac=[]
-	macChunks=sourceMac.split(':')
-	for x in range(6):
-		a=random.randint(0,255)
-		if laa and x == 0:  	# Only first Octet if making LAA compliant
-			a |= (1<<1)			# Set second bit to 1
-			a &= ~(1<<0)		# Set first bit (LSB) to 0
-		hex = '%02x' % a
-		anonyMac.append(hex)
-	if oui :
-		for octet in range(2):
-			anonyMac[octet]=macChunks[octet]
-
-	if delim == '.':
-		anonymizedMac=anonyMac[0]+anonyMac[1]+'.'+anonyMac[2]+anonyMac[3]+'.'+anonyMac[4]+anonyMac[5] 
-	else:
-		anonymizedMac=delim.join(anonyMac)
-	return anonymizedMac
-
-def serAnon():
-	countries=['CN','TH','VN','US','JP','MX','CZ']
-	cc=random.choice(countries)
-	cc+=''.join(random.choices(string.ascii_uppercase, k=4))
-	cc+=random.choice(string.digits)
-	cc+=''.join(random.choices(string.ascii_uppercase + string.digits,k=3))
-	return cc
-
-
-
-def isThisAMac(sourceString):
-		isMac=False
-		delimiter=""
-		if '.' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{4}[.]){2}([0-9A-Fa-f]{4})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = '.'
-		if ':' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{2}[:]){5}([0-9A-Fa-f]{2})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = ':'
-		if '-' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{2}[-]){5}([0-9A-Fa-f]{2})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = '-'
-
-		if isMac :
-			return True, macMatch.group(), delimiter
-		else:
-			return False, None, None
-
-def isThisArubaSerial(sourceString):
-		isArubaSerial=False
-
-		serMatch=re.match(r"^([A-Z]{2})([A-Z]{4})([0-9A-Z]{4})$", sourceString)
-		if serMatch:
-			isArubaSerial=True
-			return True, serMatch.group()
-		else:
-			return False, None
+# Joins and pivots that are cached between runs, and the archive members each one depends on (see esxtables.cachedStage)
+stageSources={
+	'deploy.aps': ['accessPoints.json','tagKeys.json','floorPlans.json','buildings.json','buildingFloors.json'],
+	'deploy.radios': ['simulatedRadios.json','antennaTypes.json'],
+}
 
 
-def main():
+def parseArgs(argv=None):
 
-	defaultfile="ekahau_ap_report.csv"
+	defaultfile="deploy"
 
 	cli=argparse.ArgumentParser(description='Generate CSV report of all APs in an Ekahau survey file')
 
-	cli.add_argument("-o", "--output", required=False, help='Output File', default=defaultfile)
+	cli.add_argument("-o", "--output", required=False, help='Output file prefix - writes <prefix>.csv and <prefix>_table.xlsx', default=defaultfile)
 	cli.add_argument("-i", "--input", required=True, help='Input File')
 	cli.add_argument("-a", '--anonymize-macs', required=False, action="store_true", help="anonymize MACs")
 	cli.add_argument("-p", '--preserve-oui', required=False, action="store_true", help="preserve OUIs when anonymizing MACs")
 	cli.add_argument("-l", '--laa-macs', required=False, action="store_true", help="anonymized MACs are LAA compliant")
 	cli.add_argument("-s", '--anonymize-serials', required=False, action="store_true", help="anonymize Aruba serial numbers")
+	cli.add_argument('--anon-key', required=False, metavar='FILE', help="secret key file for anonymizing, so the same MAC or serial anonymizes the same way in every run and every project (default: "+anonymize.keyEnv+" from the environment, else a one-off key)", default=None)
+	cli.add_argument("-d", '--debug-dump', required=False, metavar='DIR', help="write snapshots of intermediate tables to DIR (Parquet, or CSV if pyarrow isn't installed)", default=None)
+	cli.add_argument('--cache', required=False, metavar='DIR', help="cache the parsed project tables in DIR, so re-runs against an unchanged project skip the JSON parsing (needs pyarrow)", default=None)
+	cli.add_argument('--incremental', required=False, action="store_true", help="only rebuild the tables and joins that depend on archive members changed since the last run (uses --cache, or "+defaultCacheDir+")")
+	cli.add_argument('--cache-size', required=False, type=int, metavar='MB', help="size limit for the cache directory, least recently used tables are evicted first (default: "+str(defaultSizeMB)+")", default=defaultSizeMB)
+	cli.add_argument('--metrics', required=False, metavar='FILE', help="write per-stage timings, row counts and memory use to FILE as JSON", default=None)
+	cli.add_argument("-q", '--quiet', required=False, action="store_true", help="don't print progress banners")
 
+	return vars(cli.parse_args(argv))
 
-	args = vars(cli.parse_args())
-	pp.pprint(args)
+
+def main():
+	run(parseArgs())
+
+
+def run(args):
+	# Does the actual work, so ekahau-batch.py can call this directly with its own args for each project.
+	# Returns the run's Metrics.
+	metrics = Metrics('deploy', args['quiet'])
+	metrics.info['input'] = args['input']
+	metrics.pprint(pp, args)
+	anonymizer = anonymize.fromArgs(args)
 
 	#Load Ekahau Project archive
 
-	orig_archive = zipfile.ZipFile(args['input'],'r')
+	esx = ESXFile(args['input'], metrics)
+	cache = openCache(args['cache'], args['cache_size'], args['incremental'])
+	crcs = memberCRCs(esx)
+	if args['incremental']:
+		reportChanges(cache, crcs, args['input'], 'deploy')
 
 	ap_data_by_bssid = {}
 	ap_data_by_id = {}
@@ -139,220 +103,125 @@ def main():
 	measData = False
 	tagData = False
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Metadata
 	workingFile='project.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+" (Metadata) ...")
-		with orig_archive.open(workingFile) as json_file:
-			metaJSON = json.load(json_file)
-			json_file.close()
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+" (Metadata) ...")
+		metaJSON = esx.load(workingFile)
 	else:
 		print(workingFile+" not found in archive. File is probably corrupt. Exiting. ")
 		exit()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Tag Keys Table
 	workingFile='tagKeys.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			tagKeysJSON = json.load(json_file)
-			json_file.close()
-		tagKeysDF=pd.DataFrame(tagKeysJSON['tagKeys'])		
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		tagKeysDF=projectTable(esx, 'tagKeys', cache, metrics)
 		tagKeysDF.drop(columns=['status'])
 		tagData = True
 
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		tagKeysDF=pd.DataFrame()
 		tagData = False
 
 
-	print("==========")
-	# Load Notes
-	workingFile='notes.json'
-
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			notesJSON = json.load(json_file)
-			json_file.close()
-		notesDF=pd.DataFrame(notesJSON['notes'])
-		notesDF.set_index('id')
-
-	else:
-		print(workingFile+" not found in archive. Skipping. ")
-		notesDF=pd.DataFrame()
-
-	print("==========")
+	metrics.banner("==========")
 	# Load AP Table (This includes both measured and simulated)
 	workingFile='accessPoints.json'
 	tagnameList=[]
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			accessPointsJSON = json.load(json_file)
-			json_file.close()
-		accessPointsDF=pd.DataFrame(accessPointsJSON['accessPoints'])
-		accessPointsDF=accessPointsDF.join(pd.json_normalize(accessPointsDF.location))
-		# Extract Tags list by AP ID for further processing
-		apTagsRawDF=accessPointsDF[['id','tags']]
-
-		accessPointsDF.drop(columns=['location','tags','status'], inplace=True)
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		# Location comes already flattened, tags come already pivoted into one column per tag key (see esxtables.py)
+		accessPointsDF=projectTable(esx, 'accessPoints', cache, metrics)
+		apTagsListDF=projectTable(esx, 'apTags', cache, metrics)
+		tagnameList=list(apTagsListDF.columns[1:])
+
+		accessPointsDF.drop(columns=['status'], inplace=True)
 		accessPointsDF.rename(columns={'id':'ap_id','name':'ap_name'}, inplace=True)
 
-		apTagsListDF=pd.DataFrame()
-		
-		for row in apTagsRawDF.iterrows():
-			taglist=row[1][1]
-			df_dict={'accessPointId' : row[1][0]}
-			for tag in row[1][1]:
-				tagrec=tagKeysDF.loc[tagKeysDF["id"]==tag['tagKeyId']]
-				tagname='tag_'+tagrec.key.values[0].replace(" ","_")
-				if tagname not in tagnameList : tagnameList.append(tagname)
-				df_dict[tagname]=tag['value']
-			tmp_df = pd.DataFrame(df_dict, index=[0])
-
-			apTagsListDF = apTagsListDF._append(tmp_df) # append the tmp_df to our final df
-
-		apTagsListDF.reset_index(drop=True)  # Reset the final DF index sinze we assign index 0 to each tmp df
-
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		accessPointsDF=pd.DataFrame()
 
-	accessPointsDF.to_csv(path_or_buf='aps.csv')
+	debugDump(args['debug_dump'], 'aps_loaded', accessPointsDF)
 
 
-	print("==========")
-	# Load Radios Table
-	workingFile='measuredRadios.json'
-
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			measuredRadiosJSON = json.load(json_file)
-			json_file.close()		
-		measuredRadiosDF=pd.DataFrame(measuredRadiosJSON['measuredRadios'])
-		measuredRadiosDF.set_index('id')
-		measData = True
-	else:
-		print(workingFile+" not found in archive. Skipping. ")
-		measuredRadiosDF=pd.DataFrame()
-		measData = False
-
-
-	print("==========")
+	metrics.banner("==========")
 	# Load Antennas
 	workingFile="antennaTypes.json"
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			antennasJSON = json.load(json_file)
-			json_file.close()
-		antennasDF=pd.DataFrame(antennasJSON['antennaTypes'])
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		antennasDF=projectTable(esx, 'antennaTypes', cache, metrics)
 		antennasDF.set_index('id')
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		antennasDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	
-	if measData ==True:
-
-		# Load Measurements Table
-		workingFile='accessPointMeasurements.json'
-
-		if workingFile in orig_archive.namelist():
-			print ("Loading "+workingFile+"...")
-			with orig_archive.open(workingFile) as json_file:
-				accessPointMeasurementsJSON = json.load(json_file)
-				json_file.close()		
-			apMeasurementsDF=pd.DataFrame(accessPointMeasurementsJSON['accessPointMeasurements'])
-			apMeasurementsDF.set_index('id')
-		else:
-			print(workingFile+" not found in archive. Skipping. ")
-			apMeasurementsDF=pd.DataFrame()
-	else:
-		print("Measured Radios not found, skipping measurements")
-	# end conditional
-
-	print("==========")
+	metrics.banner("==========")
 	# Load Floor Plans Table
 	workingFile='floorPlans.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			floorPlansJSON = json.load(json_file)
-			json_file.close()
-		floorPlansDF=pd.DataFrame(floorPlansJSON['floorPlans'])		
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		floorPlansDF=projectTable(esx, 'floorPlans', cache, metrics)
 		floorPlansDF.set_index('id')
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		floorPlansDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Buildings Table
 	workingFile='buildings.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			buildingsJSON = json.load(json_file)
-			json_file.close()
-		buildingsDF=pd.DataFrame(buildingsJSON['buildings'])
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		buildingsDF=projectTable(esx, 'buildings', cache, metrics)
 		buildingsDF.set_index('id')
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		buildingsDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Buildings Table
 	workingFile='buildingFloors.json'
-	building = False
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			buildingFloorsJSON = json.load(json_file)
-			json_file.close()
-		buildingFloorsDF=pd.DataFrame(buildingFloorsJSON['buildingFloors'])
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		buildingFloorsDF=projectTable(esx, 'buildingFloors', cache, metrics)
 		buildingFloorsDF.set_index('id')
-		building = True
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		buildingFloorsDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Simulated APs Table
 	workingFile='simulatedRadios.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			simRadiosJSON = json.load(json_file)
-			json_file.close()
-
-		simRadiosDF=pd.DataFrame(simRadiosJSON['simulatedRadios'])		
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		simRadiosDF=projectTable(esx, 'simulatedRadios', cache, metrics)
 		simRadiosDF.set_index('id')
 		#simRadiosDF=simRadiosDF.join(pd.json_normalize(simRadiosDF.defaultAntennas))
 		#simRadiosDF.drop(columns='defaultAntennas', inplace=True)
 		simData=True
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		simRadiosDF=pd.DataFrame()
 		simData=False
 
-	print("==========")
+	metrics.banner("==========")
 
 
 
 	# Close input file, we are done with it and don't need open files aimlessly hanging around. 
-	orig_archive.close()
+	esx.close()
 
 	#print("\nNotes:")
 	#print(notesDF)
@@ -375,22 +244,22 @@ def main():
 	#print("\nSimulated Radios:")
 	#print(simRadiosDF)
 
-	if tagData == True:
-		# Add Tags to AP List
-		accessPointsDF=pd.merge(accessPointsDF, apTagsListDF, left_on='ap_id', right_on='accessPointId',how='left')
-		accessPointsDF.drop(columns=['accessPointId'], inplace=True)
-		accessPointsDF.to_csv(path_or_buf='aps.csv')
-	# end tag data conditional block
-
-	# Extrapolate building data
-	if building == True:
-		accessPointsDF=pd.merge(accessPointsDF, buildingFloorsDF[['floorPlanId','buildingId']], on='floorPlanId')
-		accessPointsDF=pd.merge(accessPointsDF, buildingsDF[['name','id']], left_on='buildingId', right_on='id',suffixes=(None,"_bldg"))
-	accessPointsDF=pd.merge(accessPointsDF, floorPlansDF[['name','id']], left_on='floorPlanId', right_on='id', suffixes=(None,"_floor"))
-	if building== True: 
-		accessPointsDF.drop(columns=['floorPlanId','buildingId','id_floor','id'], inplace=True)
-		accessPointsDF.rename(columns={'name':'building','name_floor':'floor'}, inplace=True)
-	accessPointsDF.to_csv(path_or_buf='aps.csv')
+	def joinAPs():
+		apsDF=accessPointsDF
+		if tagData == True:
+			# Add Tags to AP List
+			apsDF=pd.merge(apsDF, apTagsListDF, left_on='ap_id', right_on='accessPointId',how='left')
+			apsDF.drop(columns=['accessPointId'], inplace=True)
+			debugDump(args['debug_dump'], 'aps_tagged', apsDF)
+		# end tag data conditional block
+
+		# Building and floor names from the floor plan, by lookup rather than merging the tables in
+		apsDF=placeAPs(apsDF, floorPlansDF, buildingFloorsDF, buildingsDF)
+		return apsDF
+
+	# Only redone when the APs, tags or floors/buildings have changed since the last run (with --cache)
+	accessPointsDF=cachedStage(cache, crcs, 'deploy.aps', stageSources['deploy.aps'], joinAPs, metrics)
+	debugDump(args['debug_dump'], 'aps', accessPointsDF)
 
 	# Break out the radios
 
@@ -398,150 +267,69 @@ def main():
 	if simData == True: 
 
 
-		simRadiosDF.drop(columns=['defaultAntennas','status'])
-		simRadiosDF=pd.merge(simRadiosDF, accessPointsDF[['ap_id','ap_name',]],left_on='accessPointId', right_on='ap_id', how='left')
-
-		simRadioWifi=simRadiosDF.query('radioTechnology == "IEEE802_11"')
-		simRadioWifi.to_csv(path_or_buf='simRadiosWiFi.csv')
-
-		simRadioBLE=simRadiosDF.query('radioTechnology == "BLUETOOTH"')
-		simRadioBLE.to_csv(path_or_buf='simRadiosBLE.csv')
-
-
-		# Radio 0
-		simRadioWifi0=simRadioWifi.query('accessPointIndex == 0')
-		simRadioWifi0=pd.merge(simRadioWifi0, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-
-		simRadioWifi0.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioWifi0.to_csv(path_or_buf='simRadiosWiFi0.csv')
-
-		simapDF=pd.merge(accessPointsDF, simRadioWifi0, left_on='ap_id', right_on='accessPointId',how='left', suffixes=(None,'_r0'))
-		simapDF.drop(columns=['accessPointId','defaultAntennas'], inplace=True)
-		simapDF.rename(columns={
-				'name':'r0-antenna',
-				'transmitPower':'r0-tx_mw',
-				'channelByCenterFrequencyDefinedNarrowChannels':'r0-channels',
-				'antennaDirection':'r0-azimuth',
-				'antennaTilt':'r0-tilt',
-				'antennaHeight':'r0-height',
-				'antennaMounting':'r0-mounting',
-				'technology':'r0-phy',
-				'spatialStreamCount':'r0-ss',
-				'shortGuardInterval':'r0-sgi',
-				'enabled':'r0-enabled',
-				'greenfield':'r0-greenfield',
-				'maxGain':'r0-gain',
-				'apCoupling':'r0-ant-type',
-				'frequencyBand':'r0-band'
-				}, inplace=True)
-
-		# Radio 1
-		simRadioWifi1=simRadioWifi.query('accessPointIndex == 1')
-		simRadioWifi1=pd.merge(simRadioWifi1, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi1.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioWifi1.to_csv(path_or_buf='simRadiosWiFi1.csv')
-		
-		simapDF=pd.merge(simapDF, simRadioWifi1, left_on='ap_id', right_on='accessPointId',how='left',suffixes=(None,'_r1'))
-		simapDF.drop(columns=['accessPointId','defaultAntennas'], inplace=True)
-		simapDF.rename(columns={
-				'name':'r1-antenna',
-				'transmitPower':'r1-tx_mw',
-				'channelByCenterFrequencyDefinedNarrowChannels':'r1-channels',
-				'antennaDirection':'r1-azimuth',
-				'antennaTilt':'r1-tilt',
-				'antennaHeight':'r1-height',
-				'antennaMounting':'r1-mounting',
-				'technology':'r1-phy',
-				'spatialStreamCount':'r1-ss',
-				'shortGuardInterval':'r1-sgi',
-				'enabled':'r1-enabled',
-				'greenfield':'r1-greenfield',
-				'maxGain':'r1-gain',
-				'apCoupling':'r1-ant-type',
-				'frequencyBand':'r1-band'
-				}, inplace=True)
-		
-		# Radio 2
-		simRadioWifi2=simRadioWifi.query('accessPointIndex == 2')
-		simRadioWifi2=pd.merge(simRadioWifi2, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi2.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioWifi2.to_csv(path_or_buf='simRadiosWiFi2.csv')
-
-		simapDF=pd.merge(simapDF, simRadioWifi2, left_on='ap_id', right_on='accessPointId',how='left',suffixes=(None,'_r2'))
-		simapDF.drop(columns=['accessPointId','defaultAntennas'], inplace=True)
-		simapDF.rename(columns={
-				'name':'r2-antenna',
-				'transmitPower':'r2-tx_mw',
-				'channelByCenterFrequencyDefinedNarrowChannels':'r2-channels',
-				'antennaDirection':'r2-azimuth',
-				'antennaTilt':'r2-tilt',
-				'antennaHeight':'r2-height',
-				'antennaMounting':'r2-mounting',
-				'technology':'r2-phy',
-				'spatialStreamCount':'r2-ss',
-				'shortGuardInterval':'r2-sgi',
-				'enabled':'r2-enabled',
-				'greenfield':'r2-greenfield',
-				'maxGain':'r2-gain',
-				'apCoupling':'r2-ant-type',
-				'frequencyBand':'r2-band'
-				}, inplace=True)
-
-		# Bluetooth
-
-		simRadioBLE=pd.merge(simRadioBLE, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioBLE.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioBLE.to_csv(path_or_buf='simRadiosBLE.csv')
-
-		simapDF=pd.merge(simapDF, simRadioBLE, left_on='ap_id', right_on='accessPointId',how='left',suffixes=(None,'_bt'))
-		#simapDF.drop(columns=['accessPointId','defaultAntennas','greenfield','shortGuardInterval','spatialStreamCount','technology','channel','frequencyBand'], inplace=True)
-		simapDF.rename(columns={
-				'name':'ble-antenna',
-				'transmitPower':'ble-tx_mw',
-				'antennaDirection':'ble-azimuth',
-				'antennaTilt':'ble-tilt',
-				'antennaHeight':'ble-height',
-				'antennaMounting':'ble-mounting',
-				'enabled':'ble-enabled',
-				'maxGain':'ble-gain',
-				'apCoupling':'ble-ant-type'
-				}, inplace=True)
-
-		simapDF['tilt']=simapDF[['r0-tilt','r1-tilt','r2-tilt']].mean(axis=1).round()
-		simapDF['azimuth']=simapDF[['r0-azimuth','r1-azimuth','r2-azimuth']].mean(axis=1).round()
-		simapDF['height']=simapDF[['r0-height','r1-height','r2-height']].mean(axis=1).round(decimals=2)
-		simapDF['ap_model']=simapDF['model'].str.split('+').str[0]
-		simapDF['ap_antenna']=simapDF['model'].str.split('+').str[1]
-		simapDF.rename(columns={'r0-mounting':'mount_location'},inplace=True)
-		simapDF['ble-azimuth']=simapDF['ble-azimuth'].round(decimals=0)
-		simapDF['ble-height']=simapDF['ble-height'].round(decimals=2)
-		for r in range(3):
-			radio='r'+str(r)+'-'
-			simapDF[radio+'tx_mw']=simapDF[radio+'tx_mw'].round(decimals=1)
-			simapDF[radio+'band']=simapDF[radio+'band'].replace(to_replace={'TWO':'2.4','FIVE':'5','SIX':'6'})
-			simapDF[radio+'channels']=simapDF[radio+'channels'].replace(to_replace=channelmap)
-
-		simapDF['r0-chanwidth']=None
-		simapDF['r1-chanwidth']=None
-		simapDF['r2-chanwidth']=None
-
-		for index, row in simapDF.iterrows():
-			for r in range(3):
-				radio='r'+str(r)+'-'
-				chanlist=[]
-				if type(row[radio+'channels']) == list:
-					for ch in row[radio+'channels']:
-						ctrfrq=int(ch)
-						if row[radio+'band']=='2.4':
-							chanlist.append(int((ctrfrq-2412)/5+1))
-						if row[radio+'band']=='5':
-							chanlist.append(int((ctrfrq-5160)/5+32))
-						if row[radio+'band']=='6':
-							chanlist.append(int((ctrfrq-5955)/5+1))
-					simapDF.loc[index, radio+'channels']=chanlist
+		if args['debug_dump']:
+			simRadiosDebugDF=pd.merge(simRadiosDF.drop(columns=['defaultAntennas','status'], errors='ignore'), accessPointsDF[['ap_id','ap_name',]],left_on='accessPointId', right_on='ap_id', how='left')
+			debugDump(args['debug_dump'], 'simRadiosWiFi', simRadiosDebugDF.query('radioTechnology == "IEEE802_11"'))
+			debugDump(args['debug_dump'], 'simRadiosBLE', simRadiosDebugDF.query('radioTechnology == "BLUETOOTH"'))
+
+
+		def pivotRadios():
+			# Reshape the radios into r<N>- and ble- columns per AP, with the antenna details looked up once for all of them
+			radiosDF, radioList = radioPivot(simRadiosDF, antennasDF, {
+					'name':'antenna',
+					'transmitPower':'tx_mw',
+					'channelByCenterFrequencyDefinedNarrowChannels':'channels',
+					'antennaDirection':'azimuth',
+					'antennaTilt':'tilt',
+					'antennaHeight':'height',
+					'antennaMounting':'mounting',
+					'technology':'phy',
+					'spatialStreamCount':'ss',
+					'shortGuardInterval':'sgi',
+					'enabled':'enabled',
+					'greenfield':'greenfield',
+					'maxGain':'gain',
+					'apCoupling':'ant-type',
+					'frequencyBand':'band'
+					}, {
+					'name':'ble-antenna',
+					'transmitPower':'ble-tx_mw',
+					'antennaDirection':'ble-azimuth',
+					'antennaTilt':'ble-tilt',
+					'antennaHeight':'ble-height',
+					'antennaMounting':'ble-mounting',
+					'enabled':'ble-enabled',
+					'maxGain':'ble-gain',
+					'apCoupling':'ble-ant-type'
+					})
+			for r in radioList:
+				radiosDF['r'+str(r)+'-channels'], radiosDF['r'+str(r)+'-chanwidth'] = channelsFromFrequencies(radiosDF['r'+str(r)+'-channels'])
+			return radiosDF
+
+		# Only redone when the radios or antennas have changed since the last run (with --cache)
+		radiosDF=cachedStage(cache, crcs, 'deploy.radios', stageSources['deploy.radios'], pivotRadios, metrics)
+		radioList=radioIndexes(radiosDF)
+
+		with metrics.stage('deploy.merge', accessPointsDF) as stage:
+			simapDF=pd.merge(accessPointsDF, radiosDF, left_on='ap_id', right_on='accessPointId', how='left')
+			simapDF.drop(columns=['accessPointId'], inplace=True)
+
+			radioPrefixes=['r'+str(r)+'-' for r in radioList]
+			simapDF['tilt']=simapDF[[radio+'tilt' for radio in radioPrefixes]].mean(axis=1).round()
+			simapDF['azimuth']=simapDF[[radio+'azimuth' for radio in radioPrefixes]].mean(axis=1).round()
+			simapDF['height']=simapDF[[radio+'height' for radio in radioPrefixes]].mean(axis=1).round(decimals=2)
+			simapDF['ap_model']=simapDF['model'].str.split('+').str[0]
+			simapDF['ap_antenna']=simapDF['model'].str.split('+').str[1]
+			simapDF.rename(columns={'r0-mounting':'mount_location'},inplace=True)
+			simapDF['ble-azimuth']=simapDF['ble-azimuth'].round(decimals=0)
+			simapDF['ble-height']=simapDF['ble-height'].round(decimals=2)
+			for radio in radioPrefixes:
+				simapDF[radio+'tx_mw']=simapDF[radio+'tx_mw'].round(decimals=1)
+				simapDF[radio+'band']=simapDF[radio+'band'].replace(to_replace={'TWO':'2.4','FIVE':'5','SIX':'6'})
+			stage.rows(simapDF)
 
 	
-		print("\n\nMerged APs and Simulated Radios:")
+		metrics.banner("\n\nMerged APs and Simulated Radios:")
 
 		simapDF['ap_serial']=None
 		simapDF['ap_hwmac']=None
@@ -583,40 +371,40 @@ def main():
 						'ble-height']
 		for f in basefields : fieldlist.append(f)
 		for f in tagnameList : fieldlist.append(f)
-		for r in range(3):
+		for radio in radioPrefixes:
 			for f in radiofields :
-				field="r"+str(r)+"-"+f
+				field=radio+f
 				fieldlist.append(field)
 		for f in blefields : fieldlist.append(f)
 
 		simapDF=simapDF[fieldlist]
-
-		for idx, row in simapDF.iterrows():
-			
-			for r in range(3):
-				radio="r"+str(r)
-				ch=radio+"-channels"
-				width=radio+"-chanwidth"
-				if isinstance(row[ch], list):
-					simapDF.at[idx,width]=len(row[ch])*20
-
-		simapDF.to_csv(path_or_buf='deploy.csv')
-
-		writer = pd.ExcelWriter("deploy_table.xlsx", engine='xlsxwriter')
-		simapDF.to_excel(writer, sheet_name='Sheet1', startrow=1, header=False, index=False)
-		workbook = writer.book
-		worksheet = writer.sheets['Sheet1']
-		(max_row, max_col) = simapDF.shape
-		column_settings = []
-		for header in simapDF.columns:
-		    column_settings.append({'header': header})
-		worksheet.add_table(0, 0, max_row, max_col - 1, {'columns': column_settings})
-		worksheet.set_column(0, max_col - 1, 1)
-		writer.close()
+		if anonymizer is not None:
+			# MACs and serials in the tags (Wired MAC, AP Serial etc.)
+			simapDF=anonymizer.frame(simapDF, tagnameList, args['anonymize_macs'], args['anonymize_serials'])
+
+		with metrics.stage('deploy.csv', simapDF):
+			simapDF.to_csv(path_or_buf=args['output']+'.csv')
+
+		with metrics.stage('deploy.xlsx', simapDF):
+			writer = pd.ExcelWriter(args['output']+"_table.xlsx", engine='xlsxwriter')
+			simapDF.to_excel(writer, sheet_name='Sheet1', startrow=1, header=False, index=False)
+			workbook = writer.book
+			worksheet = writer.sheets['Sheet1']
+			(max_row, max_col) = simapDF.shape
+			column_settings = []
+			for header in simapDF.columns:
+			    column_settings.append({'header': header})
+			worksheet.add_table(0, 0, max_row, max_col - 1, {'columns': column_settings})
+			worksheet.set_column(0, max_col - 1, 1)
+			writer.close()
 
 	# End Simulated AP conditional Block
-	
-	exit()
+
+	if args['incremental']:
+		finishRun(cache, crcs, args['input'], 'deploy')
+
+	metrics.finish(args['metrics'])
+	return metrics
 
 if __name__ == "__main__":
 	main()
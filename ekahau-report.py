@@ -12,77 +12,21 @@ import zlib
 import os
 import pprint
 import csv
-import random
-import re
-import string
 import pandas as pd
+from esxfile import ESXFile
+from esxtables import debugDump, projectTable, cachedStage, radioPivot, radioIndexes, placeAPs
+from esxcache import openCache, defaultSizeMB, defaultCacheDir, memberCRCs, reportChanges, finishRun
+from metrics import Metrics
+import anonymize
 
 pp = pprint.PrettyPrinter(indent=3)
 
-
-def macAnon(sourceMac, laa=False, oui=False, delim=':'):
-	anonyMac=[]
-	macChunks=sourceMac.split(':')
-	for x in range(6):
-		a=random.randint(0,255)
-		if laa and x == 0:  	# Only first Octet if making LAA compliant
-			a |= (1<<1)			# Set second bit to 1
-			a &= ~(1<<0)		# Set first bit (LSB) to 0
-		hex = '%02x' % a
-		anonyMac.append(hex)
-	if oui :
-		for octet in range(2):
-			anonyMac[octet]=macChunks[octet]
-
-	if delim == '.':
-		anonymizedMac=anonyMac[0]+anonyMac[1]+'.'+anonyMac[2]+anonyMac[3]+'.'+anonyMac[4]+anonyMac[5] 
-	else:
-		anonymizedMac=delim.join(anonyMac)
-	return anonymizedMac
-
-def serAnon():
-	countries=['CN','TH','VN','US','JP','MX','CZ']
-	cc=random.choice(countries)
-	cc+=''.join(random.choices(string.ascii_uppercase, k=4))
-	cc+=random.choice(string.digits)
-	cc+=''.join(random.choices(string.ascii_uppercase + string.digits,k=3))
-	return cc
-
-
-
-def isThisAMac(sourceString):
-		isMac=False
-		delimiter=""
-		if '.' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{4}[.]){2}([0-9A-Fa-f]{4})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = '.'
-		if ':' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{2}[:]){5}([0-9A-Fa-f]{2})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = ':'
-		if '-' in sourceString:
-			macMatch=re.match(r"^([0-9A-Fa-f]{2}[-]){5}([0-9A-Fa-f]{2})$", sourceString)
-			if macMatch:
-				isMac=True
-				delimiter = '-'
-
-		if isMac :
-			return True, macMatch.group(), delimiter
-		else:
-			return False, None, None
-
-def isThisArubaSerial(sourceString):
-		isArubaSerial=False
-
-		serMatch=re.match(r"^([A-Z]{2})([A-Z]{4})([0-9A-Z]{4})$", sourceString)
-		if serMatch:
-			isArubaSerial=True
-			return True, serMatch.group()
-		else:
-			return False, None
+# Joins and pivots that are cached between runs, and the archive members each one depends on (see esxtables.cachedStage)
+stageSources={
+	'report.aps': ['accessPoints.json','tagKeys.json','floorPlans.json','buildings.json','buildingFloors.json'],
+	'report.radios': ['simulatedRadios.json','antennaTypes.json'],
+	'report.measurements': ['measuredRadios.json','accessPointMeasurements.json'],
+}
 
 
 def main():
@@ -97,15 +41,29 @@ def main():
 	cli.add_argument("-p", '--preserve-oui', required=False, action="store_true", help="preserve OUIs when anonymizing MACs")
 	cli.add_argument("-l", '--laa-macs', required=False, action="store_true", help="anonymized MACs are LAA compliant")
 	cli.add_argument("-s", '--anonymize-serials', required=False, action="store_true", help="anonymize Aruba serial numbers")
+	cli.add_argument('--anon-key', required=False, metavar='FILE', help="secret key file for anonymizing, so the same MAC or serial anonymizes the same way in every run and every project (default: "+anonymize.keyEnv+" from the environment, else a one-off key)", default=None)
+	cli.add_argument("-d", '--debug-dump', required=False, metavar='DIR', help="write snapshots of intermediate tables to DIR (Parquet, or CSV if pyarrow isn't installed)", default=None)
 	cli.add_argument("-c", '--country', required=False, help="Specify country", default='US')
+	cli.add_argument('--cache', required=False, metavar='DIR', help="cache the parsed project tables in DIR, so re-runs against an unchanged project skip the JSON parsing (needs pyarrow)", default=None)
+	cli.add_argument('--incremental', required=False, action="store_true", help="only rebuild the tables and joins that depend on archive members changed since the last run (uses --cache, or "+defaultCacheDir+")")
+	cli.add_argument('--cache-size', required=False, type=int, metavar='MB', help="size limit for the cache directory, least recently used tables are evicted first (default: "+str(defaultSizeMB)+")", default=defaultSizeMB)
+	cli.add_argument('--metrics', required=False, metavar='FILE', help="write per-stage timings, row counts and memory use to FILE as JSON", default=None)
+	cli.add_argument("-q", '--quiet', required=False, action="store_true", help="don't print progress banners")
 
 
 	args = vars(cli.parse_args())
-	pp.pprint(args)
+	metrics = Metrics('report', args['quiet'])
+	metrics.info['input'] = args['input']
+	metrics.pprint(pp, args)
+	anonymizer = anonymize.fromArgs(args)
 
 	#Load Ekahau Project archive
-	print("opening archive...")
-	orig_archive = zipfile.ZipFile(args['input'],'r')
+	metrics.banner("opening archive...")
+	esx = ESXFile(args['input'], metrics)
+	cache = openCache(args['cache'], args['cache_size'], args['incremental'])
+	crcs = memberCRCs(esx)
+	if args['incremental']:
+		reportChanges(cache, crcs, args['input'], 'report')
 
 	ap_data_by_bssid = {}
 	ap_data_by_id = {}
@@ -132,12 +90,12 @@ def main():
 		},
 		'Custom':{}
 	}
-	print("Reading Data... ")
+	metrics.banner("Reading Data... ")
 	simData = False
 	measData = False
 	tagData = False
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Metadata
 	workingFile='project.json'
 	sku_file="sku_lookup.json"
@@ -147,61 +105,39 @@ def main():
 	sku.close()
 
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+" (Metadata) ...")
-		with orig_archive.open(workingFile) as json_file:
-			metaJSON = json.load(json_file)
-			json_file.close()
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+" (Metadata) ...")
+		metaJSON = esx.load(workingFile)
 	else:
 		print(workingFile+" not found in archive. File is probably corrupt. Exiting. ")
 		exit()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Tag Keys Table
 	workingFile='tagKeys.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			tagKeysJSON = json.load(json_file)
-			json_file.close()
-		tagKeysDF=pd.DataFrame(tagKeysJSON['tagKeys'])		
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		tagKeysDF=projectTable(esx, 'tagKeys', cache, metrics)
 		tagKeysDF.drop(columns=['status'])
 		tagData = True
 
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		tagKeysDF=pd.DataFrame()
 		tagData = False
 
 
-	print("==========")
-	# Load Notes
-	workingFile='notes.json'
-
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			notesJSON = json.load(json_file)
-			json_file.close()
-		notesDF=pd.DataFrame(notesJSON['notes'])
-		notesDF.set_index('id')
-
-	else:
-		print(workingFile+" not found in archive. Skipping. ")
-		notesDF=pd.DataFrame()
-
-	print("==========")
+	metrics.banner("==========")
 	# Load AP Table (This includes both measured and simulated)
 	workingFile='accessPoints.json'
 	tagnameList=[]
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			accessPointsJSON = json.load(json_file)
-			json_file.close()
-		accessPointsDF=pd.DataFrame(accessPointsJSON['accessPoints'])
-		accessPointsDF=accessPointsDF.join(pd.json_normalize(accessPointsDF.location))
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		# Location comes already flattened, tags come already pivoted into one column per tag key (see esxtables.py)
+		accessPointsDF=projectTable(esx, 'accessPoints', cache, metrics)
+		apTagsListDF=projectTable(esx, 'apTags', cache, metrics)
+		tagnameList=list(apTagsListDF.columns[1:])
 
 		accessPointsDF[['ap_model','antenna_model']]=accessPointsDF['model'].str.split('+', n=1, expand=True)
 		accessPointsDF['antenna_model']=accessPointsDF['antenna_model'].str.strip()
@@ -217,28 +153,8 @@ def main():
 
 
 
-		# Extract Tags list by AP ID for further processing
-		apTagsRawDF=accessPointsDF[['ap_id','tags']]
-		
-		accessPointsDF.drop(columns=['location','tags','status','model','mine','hidden','userDefinedPosition'], inplace=True)
-		accessPointsDF.to_csv(path_or_buf='./accessPoints.csv')
-
-
-		apTagsListDF=pd.DataFrame()
-		
-		for row in apTagsRawDF.iterrows():
-			taglist=row[1][1]
-			df_dict={'accessPointId' : row[1][0]}
-			for tag in row[1][1]:
-				tagrec=tagKeysDF.loc[tagKeysDF["id"]==tag['tagKeyId']]
-				tagname='tag_'+tagrec.key.values[0].replace(" ","_")
-				if tagname not in tagnameList : tagnameList.append(tagname)
-				df_dict[tagname]=tag['value']
-			tmp_df = pd.DataFrame(df_dict, index=[0])
-
-			apTagsListDF = apTagsListDF.append(tmp_df) # append the tmp_df to our final df
-
-		apTagsListDF.reset_index(drop=True)  # Reset the final DF index sinze we assign index 0 to each tmp df
+		accessPointsDF.drop(columns=['status','model','mine','hidden','userDefinedPosition'], inplace=True)
+		debugDump(args['debug_dump'], 'accessPoints', accessPointsDF)
 
 
 	else:
@@ -247,269 +163,188 @@ def main():
 
 
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Radios Table
 	workingFile='measuredRadios.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			measuredRadiosJSON = json.load(json_file)
-			json_file.close()		
-		measuredRadiosDF=pd.DataFrame(measuredRadiosJSON['measuredRadios'])
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		measuredRadiosDF=projectTable(esx, 'measuredRadios', cache, metrics)
 		measuredRadiosDF.set_index('id')
-		measuredRadiosDF.to_csv(path_or_buf='./measuredRadios.csv')
+		debugDump(args['debug_dump'], 'measuredRadios_loaded', measuredRadiosDF)
 
 		measData = True
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		measuredRadiosDF=pd.DataFrame()
 		measData = False
 
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Antennas
 	workingFile="antennaTypes.json"
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			antennasJSON = json.load(json_file)
-			json_file.close()
-		antennasDF=pd.DataFrame(antennasJSON['antennaTypes'])
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		antennasDF=projectTable(esx, 'antennaTypes', cache, metrics)
 		antennasDF.set_index('id')
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		antennasDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	
 	if measData ==True:
 
 		# Load Measurements Table
 		workingFile='accessPointMeasurements.json'
 
-		if workingFile in orig_archive.namelist():
-			print ("Loading "+workingFile+"...")
-			with orig_archive.open(workingFile) as json_file:
-				accessPointMeasurementsJSON = json.load(json_file)
-				json_file.close()		
-			apMeasurementsDF=pd.DataFrame(accessPointMeasurementsJSON['accessPointMeasurements'])
-			apMeasurementsDF.to_csv(path_or_buf='./apMeasurements.csv')
+		if esx.has(workingFile):
+			metrics.banner("Loading "+workingFile+"...")
+			apMeasurementsDF=projectTable(esx, 'accessPointMeasurements', cache, metrics)
+			debugDump(args['debug_dump'], 'apMeasurements', apMeasurementsDF)
 
 		else:
-			print(workingFile+" not found in archive. Skipping. ")
+			metrics.banner(workingFile+" not found in archive. Skipping. ")
 			apMeasurementsDF=pd.DataFrame()
 	else:
-		print("Measured Radios not found, skipping measurements")
+		metrics.banner("Measured Radios not found, skipping measurements")
 	# end conditional
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Floor Plans Table
 	workingFile='floorPlans.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			floorPlansJSON = json.load(json_file)
-			json_file.close()
-		floorPlansDF=pd.DataFrame(floorPlansJSON['floorPlans'])		
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		floorPlansDF=projectTable(esx, 'floorPlans', cache, metrics)
 		floorPlansDF.set_index('id')
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		floorPlansDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Buildings Table
 	workingFile='buildings.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			buildingsJSON = json.load(json_file)
-			json_file.close()
-		buildingsDF=pd.DataFrame(buildingsJSON['buildings'])
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		buildingsDF=projectTable(esx, 'buildings', cache, metrics)
 		buildingsDF.set_index('id')
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		buildingsDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Buildings Table
 	workingFile='buildingFloors.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			buildingFloorsJSON = json.load(json_file)
-			json_file.close()
-		buildingFloorsDF=pd.DataFrame(buildingFloorsJSON['buildingFloors'])
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		buildingFloorsDF=projectTable(esx, 'buildingFloors', cache, metrics)
 		buildingFloorsDF.set_index('id')
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		buildingFloorsDF=pd.DataFrame()
 
-	print("==========")
+	metrics.banner("==========")
 	# Load Simulated APs Table
 	workingFile='simulatedRadios.json'
 
-	if workingFile in orig_archive.namelist():
-		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			simRadiosJSON = json.load(json_file)
-			json_file.close()
-
-		simRadiosDF=pd.DataFrame(simRadiosJSON['simulatedRadios'])		
+	if esx.has(workingFile):
+		metrics.banner("Loading "+workingFile+"...")
+		simRadiosDF=projectTable(esx, 'simulatedRadios', cache, metrics)
 		simRadiosDF.set_index('id')
 		#simRadiosDF=simRadiosDF.join(pd.json_normalize(simRadiosDF.defaultAntennas))
 		#simRadiosDF.drop(columns='defaultAntennas', inplace=True)
 		simData=True
 	else:
-		print(workingFile+" not found in archive. Skipping. ")
+		metrics.banner(workingFile+" not found in archive. Skipping. ")
 		simRadiosDF=pd.DataFrame()
 		simData=False
 
-	print("==========")
+	metrics.banner("==========")
 
 
 
 	# Close input file, we are done with it and don't need open files aimlessly hanging around. 
-	orig_archive.close()
+	esx.close()
 
 
-	if tagData == True:
-		# Add Tags to AP List
-		accessPointsDF=pd.merge(accessPointsDF, apTagsListDF, left_on='ap_id', right_on='accessPointId',how='left')
-		accessPointsDF.drop(columns=['accessPointId'], inplace=True)
-		accessPointsDF.to_csv(path_or_buf='aps.csv')
-	# end tag data conditional block
+	def joinAPs():
+		apsDF=accessPointsDF
+		if tagData == True:
+			# Add Tags to AP List
+			apsDF=pd.merge(apsDF, apTagsListDF, left_on='ap_id', right_on='accessPointId',how='left')
+			apsDF.drop(columns=['accessPointId'], inplace=True)
+			debugDump(args['debug_dump'], 'aps_tagged', apsDF)
+		# end tag data conditional block
 
-	# Extrapolate building data
-	accessPointsDF=pd.merge(accessPointsDF, buildingFloorsDF[['floorPlanId','buildingId']], on='floorPlanId')
-	accessPointsDF=pd.merge(accessPointsDF, buildingsDF[['name','id']], left_on='buildingId', right_on='id',suffixes=(None,"_bldg"))
-	accessPointsDF=pd.merge(accessPointsDF, floorPlansDF[['name','id']], left_on='floorPlanId', right_on='id', suffixes=(None,"_floor"))
-	accessPointsDF.drop(columns=['floorPlanId','buildingId','id_floor','id'], inplace=True)
-	accessPointsDF.rename(columns={'name':'building','name_floor':'floor'}, inplace=True)
-	accessPointsDF.to_csv(path_or_buf='aps.csv')
+		# Building and floor names from the floor plan, by lookup rather than merging the tables in
+		apsDF=placeAPs(apsDF, floorPlansDF, buildingFloorsDF, buildingsDF)
+		return apsDF
+
+	# Only redone when the APs, tags or floors/buildings have changed since the last run (with --cache)
+	accessPointsDF=cachedStage(cache, crcs, 'report.aps', stageSources['report.aps'], joinAPs, metrics)
+	debugDump(args['debug_dump'], 'aps', accessPointsDF)
 
 	# Break out the radios
 
 	# First, simulated radios
 	if simData == True: 
 
-		simRadiosDF.drop(columns=['defaultAntennas','status'])
-
-		simRadioWifi=simRadiosDF.query('radioTechnology == "IEEE802_11"')
-		simRadioWifi.to_csv(path_or_buf='simRadiosWiFi.csv')
-
-		simRadioBLE=simRadiosDF.query('radioTechnology == "BLUETOOTH"')
-		simRadioBLE.to_csv(path_or_buf='simRadiosBLE.csv')
-
-
-		# Radio 0
-		simRadioWifi0=simRadioWifi.query('accessPointIndex == 0')
-		#simRadioWifi0=pd.merge(simRadioWifi0, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi0=pd.merge(simRadioWifi0, antennasDF[['id','name','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi0.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioWifi0.to_csv(path_or_buf='simRadiosWiFi0.csv')
-
-		simapDF=pd.merge(accessPointsDF, simRadioWifi0, left_on='ap_id', right_on='accessPointId',how='outer', suffixes=(None,'_r0'))
-		simapDF.drop(columns=['accessPointId','defaultAntennas'], inplace=True)
-		simapDF.rename(columns={
-				'name':'r0-antenna',
-				'transmitPower':'r0-tx_mw',
-				'channel':'r0-channels',
-				'antennaDirection':'r0-azimuth',
-				'antennaTilt':'r0-tilt',
-				'antennaHeight':'r0-height',
-				'antennaMounting':'r0-mounting',
-				'technology':'r0-phy',
-				'spatialStreamCount':'r0-ss',
-				'shortGuardInterval':'r0-sgi',
-				'enabled':'r0-enabled',
-				'greenfield':'r0-greenfield',
-				'apCoupling':'r0-ant-type',
-				'frequencyBand':'r0-band'
-				}, inplace=True)
-
-		# Radio 1
-		simRadioWifi1=simRadioWifi.query('accessPointIndex == 1')
-		#simRadioWifi1=pd.merge(simRadioWifi1, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi1=pd.merge(simRadioWifi1, antennasDF[['id','name','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi1.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioWifi1.to_csv(path_or_buf='simRadiosWiFi1.csv')
-		
-		simapDF=pd.merge(simapDF, simRadioWifi1, left_on='ap_id', right_on='accessPointId',how='outer',suffixes=(None,'_r1'))
-		simapDF.drop(columns=['accessPointId','defaultAntennas'], inplace=True)
-		simapDF.rename(columns={
-				'name':'r1-antenna',
-				'transmitPower':'r1-tx_mw',
-				'channel':'r1-channels',
-				'antennaDirection':'r1-azimuth',
-				'antennaTilt':'r1-tilt',
-				'antennaHeight':'r1-height',
-				'antennaMounting':'r1-mounting',
-				'technology':'r1-phy',
-				'spatialStreamCount':'r1-ss',
-				'shortGuardInterval':'r1-sgi',
-				'enabled':'r1-enabled',
-				'greenfield':'r1-greenfield',
-				'apCoupling':'r1-ant-type',
-				'frequencyBand':'r1-band'
-				}, inplace=True)
-		
-		# Radio 2
-		simRadioWifi2=simRadioWifi.query('accessPointIndex == 2')
-		#simRadioWifi2=pd.merge(simRadioWifi2, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi2=pd.merge(simRadioWifi2, antennasDF[['id','name','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioWifi2.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioWifi2.to_csv(path_or_buf='simRadiosWiFi2.csv')
-
-		simapDF=pd.merge(simapDF, simRadioWifi2, left_on='ap_id', right_on='accessPointId',how='outer',suffixes=(None,'_r2'))
-		simapDF.drop(columns=['accessPointId','defaultAntennas'], inplace=True)
-		simapDF.rename(columns={
-				'name':'r2-antenna',
-				'transmitPower':'r2-tx_mw',
-				'channel':'r2-channels',
-				'antennaDirection':'r2-azimuth',
-				'antennaTilt':'r2-tilt',
-				'antennaHeight':'r2-height',
-				'antennaMounting':'r2-mounting',
-				'technology':'r2-phy',
-				'spatialStreamCount':'r2-ss',
-				'shortGuardInterval':'r2-sgi',
-				'enabled':'r2-enabled',
-				'greenfield':'r2-greenfield',
-				'apCoupling':'r2-ant-type',
-				'frequencyBand':'r2-band'
-				}, inplace=True)
-
-		# Bluetooth
-
-		#simRadioBLE=pd.merge(simRadioBLE, antennasDF[['id','name','maxGain','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioBLE=pd.merge(simRadioBLE, antennasDF[['id','name','apCoupling','frequencyBand']],left_on='antennaTypeId', right_on='id', how='left')
-		simRadioBLE.drop(columns=['id_x','id_y','radioTechnology','status','antennaTypeId','accessPointIndex'], inplace=True)
-		simRadioBLE.to_csv(path_or_buf='simRadiosBLE.csv')
-
-		simapDF=pd.merge(simapDF, simRadioBLE, left_on='ap_id', right_on='accessPointId',how='outer',suffixes=(None,'_bt'))
-		simapDF.drop(columns=['accessPointId','defaultAntennas','greenfield','shortGuardInterval','spatialStreamCount','technology','channel','frequencyBand'], inplace=True)
-		simapDF.rename(columns={
-				'name':'ble-antenna',
-				'transmitPower':'ble-tx_mw',
-				'antennaDirection':'ble-azimuth',
-				'antennaTilt':'ble-tilt',
-				'antennaHeight':'ble-height',
-				'antennaMounting':'ble-mounting',
-				'enabled':'ble-enabled',
-				'apCoupling':'ble-ant-type'
-				}, inplace=True)
-
-		
+		if args['debug_dump']:
+			simRadiosDebugDF=simRadiosDF.drop(columns=['defaultAntennas','status'], errors='ignore')
+			debugDump(args['debug_dump'], 'simRadiosWiFi', simRadiosDebugDF.query('radioTechnology == "IEEE802_11"'))
+			debugDump(args['debug_dump'], 'simRadiosBLE', simRadiosDebugDF.query('radioTechnology == "BLUETOOTH"'))
+
+
+		def pivotRadios():
+			# Reshape the radios into r<N>- and ble- columns per AP, with the antenna details looked up once for all of them
+			radiosDF, radioList = radioPivot(simRadiosDF, antennasDF, {
+					'name':'antenna',
+					'transmitPower':'tx_mw',
+					'channel':'channels',
+					'antennaDirection':'azimuth',
+					'antennaTilt':'tilt',
+					'antennaHeight':'height',
+					'antennaMounting':'mounting',
+					'technology':'phy',
+					'spatialStreamCount':'ss',
+					'shortGuardInterval':'sgi',
+					'enabled':'enabled',
+					'greenfield':'greenfield',
+					'apCoupling':'ant-type',
+					'frequencyBand':'band'
+					}, {
+					'name':'ble-antenna',
+					'transmitPower':'ble-tx_mw',
+					'antennaDirection':'ble-azimuth',
+					'antennaTilt':'ble-tilt',
+					'antennaHeight':'ble-height',
+					'antennaMounting':'ble-mounting',
+					'enabled':'ble-enabled',
+					'apCoupling':'ble-ant-type'
+					})
+			return radiosDF
+
+		# Only redone when the radios or antennas have changed since the last run (with --cache)
+		radiosDF=cachedStage(cache, crcs, 'report.radios', stageSources['report.radios'], pivotRadios, metrics)
+		radioList=radioIndexes(radiosDF)
+
+		with metrics.stage('report.merge', accessPointsDF) as stage:
+			simapDF=pd.merge(accessPointsDF, radiosDF, left_on='ap_id', right_on='accessPointId', how='outer')
+			simapDF.drop(columns=['accessPointId'], inplace=True)
+
+			radioPrefixes=['r'+str(r)+'-' for r in radioList]
+
+			# Channel width is 20MHz per channel in the list, as a whole number (Int64, so APs without the radio stay empty)
+			for radio in radioPrefixes:
+				simapDF[radio+'chanwidth']=(simapDF[radio+'channels'].str.len()*20).astype('Int64')
+			stage.rows(simapDF)
+
 		simapDF['ap_serial']=None
 		simapDF['ap_hwmac']=None
-		simapDF['r0-chanwidth']=None
-		simapDF['r1-chanwidth']=None
-		simapDF['r2-chanwidth']=None
 
 		fieldlist=[]
 
@@ -551,153 +386,160 @@ def main():
 						'ble-height']
 		for f in basefields : fieldlist.append(f)
 		for f in tagnameList : fieldlist.append(f)
-		for r in range(3):
+		for radio in radioPrefixes:
 			for f in radiofields :
-				field="r"+str(r)+"-"+f
+				field=radio+f
 				fieldlist.append(field)
 		for f in blefields : fieldlist.append(f)
 
 		simapDF=simapDF[fieldlist]
+		if anonymizer is not None:
+			# MACs and serials in the tags (Wired MAC, AP Serial etc.)
+			simapDF=anonymizer.frame(simapDF, tagnameList, args['anonymize_macs'], args['anonymize_serials'])
 
-		for idx, row in simapDF.iterrows():
-			
-			for r in range(3):
-				radio="r"+str(r)
-				ch=radio+"-channels"
-				width=radio+"-chanwidth"
-				if isinstance(row[ch], list):
-					simapDF.at[idx,width]=len(row[ch])*20
-
-		simapDF.to_csv(path_or_buf='deploy.csv')
+		with metrics.stage('report.csv', simapDF):
+			simapDF.to_csv(path_or_buf='deploy.csv')
 
 		#pp.pprint(simapDF.ap_vendor.unique())
 
-		IrisBuildRaw=[]
+		with metrics.stage('report.iris', simapDF) as stage:
+			IrisBuildRaw=[]
 
-		country=args['country'].upper()
+			country=args['country'].upper()
 
-		for idx,row in simapDF.iterrows():
-			IrisBuildRaw.append(["---"])
-			outrow=["AP",str(row['ap_name'])]
-			IrisBuildRaw.append(outrow)
-			outrow=["vendor",row['ap_vendor']]
-			if row['ap_vendor'] in skuRefJSON:
-				outrow.append("SKUs Found")
+			for idx,row in simapDF.iterrows():
+				IrisBuildRaw.append(["---"])
+				outrow=["AP",str(row['ap_name'])]
 				IrisBuildRaw.append(outrow)
-				vendor_skus=skuRefJSON[row['ap_vendor']]
-				aps=vendor_skus['AccessPoints']
-				antennas=vendor_skus['Antennas']
-				apMounts=vendor_skus['APMounts']
-				antennaMounts=vendor_skus['AntennaMounts']
-				outrow=["model"]
-				if row['ap_model'] in aps:
+				outrow=["vendor",row['ap_vendor']]
+				if row['ap_vendor'] in skuRefJSON:
+					outrow.append("SKUs Found")
+					IrisBuildRaw.append(outrow)
+					vendor_skus=skuRefJSON[row['ap_vendor']]
+					aps=vendor_skus['AccessPoints']
+					antennas=vendor_skus['Antennas']
+					apMounts=vendor_skus['APMounts']
+					antennaMounts=vendor_skus['AntennaMounts']
+					outrow=["model"]
+					if row['ap_model'] in aps:
 					
-					model=row['ap_model']
+						model=row['ap_model']
 
-					if country in aps[model]:
-						cc=country
-					else:
-						cc='RW'
+						if country in aps[model]:
+							cc=country
+						else:
+							cc='RW'
 
-					outrow.append(model+"("+cc+")")
-					if cc in aps[model]:
-						outrow.append(aps[model][cc])
-						outrow.append(1)
+						outrow.append(model+"("+cc+")")
+						if cc in aps[model]:
+							outrow.append(aps[model][cc])
+							outrow.append(1)
+						else:
+							outrow.append(None)
+							outrow.append(1)
 					else:
+						outrow.append(row['ap_model'])
 						outrow.append(None)
 						outrow.append(1)
-				else:
-					outrow.append(row['ap_model'])
-					outrow.append(None)
-					outrow.append(1)
-				IrisBuildRaw.append(outrow)
+					IrisBuildRaw.append(outrow)
 
 
-				for radio in range(3):
+					for radio in radioPrefixes:
 					
-					r="r"+str(radio)
-					outrow=[r+" antenna"]
-					if row[r+'-ant-type'] == 'EXTERNAL_ANTENNA':
-						outrow.append(row[r+'-antenna'])
-						if row[r+'-antenna'] in antennas:
-							outrow.append(antennas[row[r+'-antenna']])
-							outrow.append(1)
+						r=radio[:-1]
+						outrow=[r+" antenna"]
+						if row[r+'-ant-type'] == 'EXTERNAL_ANTENNA':
+							outrow.append(row[r+'-antenna'])
+							if row[r+'-antenna'] in antennas:
+								outrow.append(antennas[row[r+'-antenna']])
+								outrow.append(1)
+								IrisBuildRaw.append(outrow)
+
+							else:
+								outrow.append(None)
+								outrow.append(1)
+								IrisBuildRaw.append(outrow)
+
+						elif row[r+'-ant-type'] == 'INTERNAL_ANTENNA':
+							outrow.append("Internal")
 							IrisBuildRaw.append(outrow)
 
+					outrow=["AP Mount"]
+					if row['tag_Mount']!= "" :
+						outrow.append(row['tag_Mount'])
+						mnt=str(row['tag_Mount'])
+						if mnt in apMounts:
+							outrow.append(apMounts[mnt])
+							outrow.append(1)
 						else:
 							outrow.append(None)
 							outrow.append(1)
-							IrisBuildRaw.append(outrow)
-
-					elif row[r+'-ant-type'] == 'INTERNAL_ANTENNA':
-						outrow.append("Internal")
-						IrisBuildRaw.append(outrow)
-
-				outrow=["AP Mount"]
-				print(type(row['tag_Mount']))
-				print(row['tag_Mount'])
-				if row['tag_Mount']!= "" :
-					outrow.append(row['tag_Mount'])
-					mnt=str(row['tag_Mount'])
-					if mnt in apMounts:
-						outrow.append(apMounts[mnt])
-						outrow.append(1)
 					else:
-						outrow.append(None)
-						outrow.append(1)
-				else:
-					outrow.append("None Specified")
+						outrow.append("None Specified")
 
-				IrisBuildRaw.append(outrow)
+					IrisBuildRaw.append(outrow)
 
-		pp.pprint(IrisBuildRaw)
+			metrics.pprint(pp, IrisBuildRaw)
 
 
 
-		with open("iris_build.csv", 'w') as irisBuild:
-			writer=csv.writer(irisBuild, delimiter=',')
-			for row in IrisBuildRaw:
-				writer.writerow(row)
+			with open("iris_build.csv", 'w') as irisBuild:
+				writer=csv.writer(irisBuild, delimiter=',')
+				for row in IrisBuildRaw:
+					writer.writerow(row)
 
-		irisBuild.close()
+			irisBuild.close()
+			stage.rows(IrisBuildRaw)
 
 
-		APBoMDF=simapDF['ap_model'].value_counts()
-		AntBoMDF=simapDF['antenna_model'].value_counts()
-		MountBoMDF=simapDF['tag_Mount'].value_counts()
-		BoMDF=APBoMDF.append(AntBoMDF)
-		IrisPartsDF=BoMDF.append(MountBoMDF)
+		with metrics.stage('report.parts', simapDF) as stage:
+			APBoMDF=simapDF['ap_model'].value_counts()
+			AntBoMDF=simapDF['antenna_model'].value_counts()
+			MountBoMDF=simapDF['tag_Mount'].value_counts()
+			IrisPartsDF=pd.concat([APBoMDF, AntBoMDF, MountBoMDF])
 
-		IrisPartsDF.to_csv(path_or_buf='irisparts.csv')
+			IrisPartsDF.to_csv(path_or_buf='irisparts.csv')
+			stage.rows(IrisPartsDF)
 
 	# End Simulated AP conditional Block
 	
 	if measData==True:
 
-		# Expand measuredRadios:
-		measuredRadiosDF.drop(columns=['status'], inplace=True)
-		measuredRadiosDF.rename(columns={'id':'measuredRadioId'}, inplace=True)
-		measuredRadiosDF.to_csv(path_or_buf='./measuredRadios.csv')
-
-		measuredRadiosDF=measuredRadiosDF.explode('accessPointMeasurementIds')
-		measuredRadiosDF.rename(columns={'accessPointMeasurementIds':'apMeasurementId'}, inplace=True)
-		
-		measuredRadiosDF.to_csv(path_or_buf='./measuredRadios_exploded.csv')
+		def joinMeasurements():
+			# Expand measuredRadios:
+			radiosDF=measuredRadiosDF.rename(columns={'id':'measuredRadioId'})
+			debugDump(args['debug_dump'], 'measuredRadios', radiosDF)
 
-		measurementsDF=pd.merge(measuredRadiosDF, apMeasurementsDF, left_on='apMeasurementId', right_on='id')
-		measurementsDF.drop(columns=['apMeasurementId','status','freezeTime','id'], inplace=True)
-		measurementsDF.rename(columns={'measuredRadioId':'radioId','mac':'bssid','ssid':'essid','channel':'channels'}, inplace=True)
-		measurementsDF.to_csv(path_or_buf='./measurements.csv')
-
-		measApsDF=pd.merge(accessPointsDF, measurementsDF, left_on='ap_id', right_on='accessPointId')
-		measurementsDF.drop(columns=['accessPointId'], inplace=True)
-		#measurementsDF.rename(columns={'measuredRadioId':'radioId','mac':'bssid','ssid':'essid','channel':'channels'}, inplace=True)
-		measApsDF.to_csv(path_or_buf='./measuredAccessPoints.csv')
+			radiosDF=radiosDF.explode('accessPointMeasurementIds')
+			radiosDF.rename(columns={'accessPointMeasurementIds':'apMeasurementId'}, inplace=True)
+			
+			debugDump(args['debug_dump'], 'measuredRadios_exploded', radiosDF)
+
+			measurementsDF=pd.merge(radiosDF, apMeasurementsDF, left_on='apMeasurementId', right_on='id')
+			measurementsDF.drop(columns=['apMeasurementId','id'], inplace=True)
+			measurementsDF.rename(columns={'measuredRadioId':'radioId','mac':'bssid','ssid':'essid','channel':'channels'}, inplace=True)
+			return measurementsDF
+
+		# Only redone when the survey data has changed since the last run (with --cache)
+		measurementsDF=cachedStage(cache, crcs, 'report.measurements', stageSources['report.measurements'], joinMeasurements, metrics)
+		debugDump(args['debug_dump'], 'measurements', measurementsDF)
+
+		with metrics.stage('report.measured', measurementsDF) as stage:
+			measApsDF=pd.merge(accessPointsDF, measurementsDF, left_on='ap_id', right_on='accessPointId')
+			if anonymizer is not None:
+				measApsDF=anonymizer.frame(measApsDF, ['bssid']+tagnameList, args['anonymize_macs'], args['anonymize_serials'])
+			measurementsDF.drop(columns=['accessPointId'], inplace=True)
+			#measurementsDF.rename(columns={'measuredRadioId':'radioId','mac':'bssid','ssid':'essid','channel':'channels'}, inplace=True)
+			measApsDF.to_csv(path_or_buf='./measuredAccessPoints.csv')
+			stage.rows(measApsDF)
 
 	#measurementsDF=pd.merge(measuredRadiosDF,apMeasurementsDF, left_on='id', right_on='')
 	# End Measured AP conditional Block
 
+	if args['incremental']:
+		finishRun(cache, crcs, args['input'], 'report')
 
+	metrics.finish(args['metrics'])
 	exit()
 
 if __name__ == "__main__":
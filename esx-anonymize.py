@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Writes an anonymized copy of a whole Ekahau project (.esx), for sending to vendors and support.
+# BSSIDs, wired MACs and any other MAC addresses, and Aruba serial numbers in the AP tags, are replaced with keyed pseudonyms
+# (see anonymize.py), and optionally AP names and SSIDs as well. The same key gives the same pseudonyms as AP_Report.py and
+# the other scripts, so anonymized projects and reports from different sites still line up with each other.
+# Each JSON member is inflated, rewritten and deflated again in its own worker process, and written to the new archive in
+# the original order as it comes back. Values are matched in the raw JSON text rather than parsing and re-serializing the
+# document, so everything else in a member comes through byte for byte. Floor plan images and other non-JSON members are
+# copied across as their original compressed bytes.
+# (c) 2024 Ian Beyer
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+import zlib
+import anonymize
+from esxfile import atomicOutput, copyRawMember, writeRawMember
+
+# Each pattern captures the text before a value and then the value itself, stopping short of the closing quote so that
+# split() keeps everything but the value as it was.
+# Quoted strings that could be MAC addresses (aa:bb:cc:dd:ee:ff, aa-bb-cc-dd-ee-ff or aabb.ccdd.eeff) anywhere in a member.
+# This is deliberately loose, since a plain character class scans much faster than the exact notations would - the
+# candidates are checked properly when they're parsed (see macaddr.py), and anything that isn't a MAC is left alone.
+macPattern=re.compile(rb'(")([0-9A-Fa-f:.\-]{14,17})(?=")')
+# Serials only in tag values, since plenty of ten letter enum values would pass for one
+serialPattern=re.compile(rb'("value"\s*:\s*")([A-Z]{6}[0-9A-Z]{4})(?=")')
+ssidPattern=re.compile(rb'("ssid"\s*:\s*")((?:[^"\\]|\\.)+)(?=")')
+namePattern=re.compile(rb'("name"\s*:\s*")((?:[^"\\]|\\.)+)(?=")')
+iePattern=re.compile(rb'("informationElements"\s*:\s*")(?:[^"\\]|\\.)*"')
+
+# Text that goes into JSON as it is, without escaping
+safeText=re.compile(r'[ !#-\[\]-~]*')
+
+# Members bigger than this are deflated in pieces on several threads
+deflateChunk=4<<20
+
+anonymizer=None
+
+
+def initWorker(key, laa, oui):
+	global anonymizer
+	anonymizer=anonymize.Anonymizer(key, laa, oui)
+
+
+def replaceValues(data, pattern, mapper):
+	# Replaces the last group of every match of pattern with whatever mapper gives for it. mapper takes the list of distinct
+	# (decoded) values and returns their replacements in the same order, so the anonymizing is done a column at a time.
+	# Returns the new data and the number of distinct values replaced.
+	parts=pattern.split(data)
+	step=pattern.groups+1
+	values=parts[pattern.groups::step]
+	if not values:
+		return data, 0
+	found=list(dict.fromkeys(values))
+	# Only values with escapes in them need a JSON decode
+	decoded=[json.loads(b'"'+value+b'"') if b'\\' in value else value.decode('utf-8') for value in found]
+	table={}
+	for raw, real, fake in zip(found, decoded, mapper(decoded)):
+		if isinstance(fake, str) and fake != real:
+			table[raw]=fake.encode('ascii') if safeText.fullmatch(fake) else json.dumps(fake, ensure_ascii=False).encode('utf-8')[1:-1]
+	if not table:
+		return data, 0
+	parts[pattern.groups::step]=[table.get(value, value) for value in values]
+	return b''.join(parts), len(table)
+
+
+def deflate(data, level):
+	# Raw deflate of a whole member. Big members are cut into pieces that are compressed on separate threads (zlib lets go of
+	# the GIL while it works) and joined back together: every piece but the last ends on a sync flush, so the pieces run on into
+	# one valid deflate stream, just as pigz does it.
+	pieces=[data[i:i+deflateChunk] for i in range(0, len(data), deflateChunk)] or [b'']
+
+	def piece(i):
+		compressor=zlib.compressobj(level, zlib.DEFLATED, -15)
+		return compressor.compress(pieces[i])+compressor.flush(zlib.Z_FINISH if i == len(pieces)-1 else zlib.Z_SYNC_FLUSH)
+
+	if len(pieces) == 1:
+		return piece(0)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(pieces), os.cpu_count() or 1)) as threads:
+		return b''.join(threads.map(piece, range(len(pieces))))
+
+
+def anonymizeMember(path, name, options):
+	# Runs in a worker process. Returns the member's new compressed bytes, CRC and size, and what was replaced.
+	with zipfile.ZipFile(path, 'r') as archive:
+		data=archive.read(name)
+	counts={}
+	data, counts['macs'] = replaceValues(data, macPattern, anonymizer.macs)
+	if options['serials']:
+		data, counts['serials'] = replaceValues(data, serialPattern, anonymizer.serials)
+	if options['ssids']:
+		data, counts['ssids'] = replaceValues(data, ssidPattern, lambda values: anonymizer.pseudonyms(b'ssid', values, 'SSID-'))
+	if options['ap_names'] and name == 'accessPoints.json':
+		data, counts['ap names'] = replaceValues(data, namePattern, lambda values: anonymizer.pseudonyms(b'name', values, 'AP-'))
+	if options['strip_ies']:
+		data, counts['information elements'] = iePattern.subn(lambda match: match.group(1)+b'"', data)
+
+	return {'name':name, 'data':deflate(data, options['level']), 'crc':zlib.crc32(data), 'size':len(data), 'counts':counts}
+
+
+def main():
+
+	cli=argparse.ArgumentParser(description='Write an anonymized copy of an Ekahau project file')
+
+	cli.add_argument("-i", "--input", required=True, help='Input File')
+	cli.add_argument("-o", "--output", required=False, help='Output File (default: <input>_anonymized.esx)', default=None)
+	cli.add_argument("-p", '--preserve-oui', required=False, action="store_true", help="preserve OUIs when anonymizing MACs")
+	cli.add_argument("-l", '--laa-macs', required=False, action="store_true", help="anonymized MACs are LAA compliant")
+	cli.add_argument("-S", '--keep-serials', required=False, action="store_true", help="don't anonymize Aruba serial numbers")
+	cli.add_argument("-n", '--ap-names', required=False, action="store_true", help="replace AP names with pseudonyms")
+	cli.add_argument("-e", '--ssids', required=False, action="store_true", help="replace SSIDs with pseudonyms")
+	cli.add_argument('--strip-ies', required=False, action="store_true", help="empty the captured beacon information elements, which carry the real SSID (and AP name on some vendors)")
+	cli.add_argument('--anon-key', required=False, metavar='FILE', help="secret key file, so the same MAC, serial or name anonymizes the same way in every project (default: "+anonymize.keyEnv+" from the environment, else a one-off key)", default=None)
+	cli.add_argument("-w", "--workers", required=False, type=int, help='Number of worker processes (default: number of CPUs)', default=os.cpu_count())
+	cli.add_argument("-c", "--compress-level", required=False, type=int, choices=range(0, 10), metavar='0-9', help='Deflate level for the rewritten members (default 6)', default=6)
+
+	args = vars(cli.parse_args())
+
+	outPath=args['output'] or os.path.splitext(args['input'])[0]+"_anonymized.esx"
+	if os.path.abspath(outPath) == os.path.abspath(args['input']):
+		sys.exit("Output would overwrite the input")
+
+	key=anonymize.loadKey(args['anon_key'])
+	options={
+		'serials':not args['keep_serials'],
+		'ssids':args['ssids'],
+		'ap_names':args['ap_names'],
+		'strip_ies':args['strip_ies'],
+		'level':args['compress_level']
+		}
+
+	start=time.perf_counter()
+	totals={}
+	source=zipfile.ZipFile(args['input'], 'r')
+	try:
+		with atomicOutput(outPath) as tmpPath:
+			with concurrent.futures.ProcessPoolExecutor(max_workers=args['workers'], initializer=initWorker, initargs=(key, args['laa_macs'], args['preserve_oui'])) as pool:
+				# Every JSON member goes to the pool up front. Members are then written in archive order, each as soon as it's
+				# ready, with the images copied across in between while the workers carry on.
+				jobs={}
+				for info in source.infolist():
+					if info.filename.endswith('.json'):
+						jobs[info.filename]=pool.submit(anonymizeMember, args['input'], info.filename, options)
+
+				with zipfile.ZipFile(tmpPath, 'w', zipfile.ZIP_DEFLATED) as newArchive:
+					for info in source.infolist():
+						if info.filename not in jobs:
+							copyRawMember(source, info, newArchive)
+							continue
+						result=jobs.pop(info.filename).result()
+						zinfo=zipfile.ZipInfo(info.filename, date_time=info.date_time)
+						zinfo.external_attr=info.external_attr
+						zinfo.compress_type=zipfile.ZIP_DEFLATED
+						zinfo.CRC=result['crc']
+						zinfo.file_size=result['size']
+						zinfo.compress_size=len(result['data'])
+						writeRawMember(newArchive, zinfo, [result['data']])
+						for what, count in result['counts'].items():
+							totals[what]=totals.get(what, 0)+count
+						print("{:<34} {}".format(info.filename, ", ".join(str(count)+" "+what for what, count in result['counts'].items() if count) or "nothing to replace"))
+	finally:
+		source.close()
+
+	print("==========")
+	print("Wrote "+outPath+" in {:.2f}s: ".format(time.perf_counter()-start)+", ".join(str(count)+" "+what for what, count in totals.items()))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# On-disk cache of the normalized project tables built by esxtables.projectTable(), so re-running a report against a project
+# that hasn't changed skips unzipping and parsing the JSON altogether.
+# Entries are content addressed: the key is a hash of the CRCs and sizes of the archive members a table is built from (read
+# from the zip central directory, so working out the key costs nothing). A re-export or copy of a project with the same content
+# hits the same entries, and an edit to one member only invalidates the tables built from it.
+# The same goes for the joins built on top of those tables (see esxtables.cachedStage()), which is what makes --incremental work:
+# each run records the member CRCs it saw in a manifest, and the next run compares against it to report what changed and
+# which tables and joins are being rebuilt. Everything else comes straight out of the cache.
+# Tables are stored as Parquet, which needs pyarrow. The cache directory is kept under a size limit by evicting the least
+# recently used entries.
+# (c) 2024 Ian Beyer
+
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Bump this when the way a table is normalized changes, so entries written by older code stop matching
+formatVersion=4
+
+# Set ESX_COMPACT_TYPES=0 to load the tables with pandas' default types rather than the narrower ones (see esxtables.py).
+# The two give frames with different dtypes, so it's part of the cache key and each mode keeps its own entries.
+compactTables=os.environ.get('ESX_COMPACT_TYPES', '1') != '0'
+
+defaultSizeMB=1024
+defaultCacheDir=os.path.join(os.path.expanduser('~'), '.cache', 'ekahau-tools')
+
+
+class TableCache:
+
+	def __init__(self, cacheDir, maxBytes=defaultSizeMB<<20):
+		self.cacheDir=cacheDir
+		self.maxBytes=maxBytes
+		self.hits=0
+		self.misses=0
+		# Names of the tables that came out of the cache and the ones that had to be built, for the end of run summary
+		self.reused=[]
+		self.rebuilt=[]
+		os.makedirs(cacheDir, exist_ok=True)
+
+	def key(self, crcs, name, members):
+		# crcs comes from memberCRCs(), name is the table, members the archive members it's built from. Missing members are
+		# part of the key too, since a table built without one (e.g. apTags without tagKeys.json) isn't the same table.
+		digest=hashlib.sha1((name+'\0'+str(formatVersion)+'\0'+('compact' if compactTables else 'default')+'\0').encode('utf-8'))
+		for member in members:
+			if member in crcs:
+				crc, size = crcs[member]
+				digest.update((member+'\0'+'%08x' % crc+'\0'+str(size)+'\0').encode('utf-8'))
+			else:
+				digest.update((member+'\0missing\0').encode('utf-8'))
+		return digest.hexdigest()
+
+	def path(self, key):
+		return os.path.join(self.cacheDir, key+'.parquet')
+
+	def get(self, key):
+		# Returns the cached DataFrame, or None if there isn't one (or it can't be read, in which case it gets rebuilt)
+		path=self.path(key)
+		if not os.path.exists(path):
+			self.misses+=1
+			return None
+		try:
+			df=pd.read_parquet(path)
+		except (ImportError, ValueError, OSError):
+			self.misses+=1
+			return None
+		# Reading counts as using it, as far as eviction goes
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+		self.hits+=1
+		return restoreTypes(df)
+
+	def put(self, key, df):
+		# Written to a temp file and renamed into place, so parallel runs (ekahau-batch.py) never see half an entry
+		fd, tmpPath = tempfile.mkstemp(suffix='.parquet.tmp', dir=self.cacheDir)
+		os.close(fd)
+		try:
+			df.to_parquet(tmpPath)
+			os.replace(tmpPath, self.path(key))
+		except (ImportError, ValueError, TypeError) as e:
+			# No pyarrow, or a column Parquet can't hold. The table just doesn't get cached.
+			os.remove(tmpPath)
+			print("Not caching table ("+type(e).__name__+": "+str(e)+")")
+			return False
+		except BaseException:
+			os.remove(tmpPath)
+			raise
+		self.evict()
+		return True
+
+	def manifestPath(self, inputPath, tool):
+		# One manifest per script per project file, since each script builds its own joins
+		name=hashlib.sha1((tool+'\0'+os.path.abspath(inputPath)).encode('utf-8')).hexdigest()
+		return os.path.join(self.cacheDir, 'manifests', name+'.json')
+
+	def loadManifest(self, inputPath, tool):
+		# Member CRCs as of the last run of tool against inputPath, or None if there hasn't been one
+		try:
+			with open(self.manifestPath(inputPath, tool), 'r') as manifestFile:
+				manifest=json.load(manifestFile)
+		except (OSError, ValueError):
+			return None
+		return {member: tuple(crc) for member, crc in manifest['members'].items()}
+
+	def saveManifest(self, inputPath, tool, crcs):
+		path=self.manifestPath(inputPath, tool)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		fd, tmpPath = tempfile.mkstemp(suffix='.json.tmp', dir=os.path.dirname(path))
+		with os.fdopen(fd, 'w') as manifestFile:
+			json.dump({'input': os.path.abspath(inputPath), 'members': crcs}, manifestFile, indent=1)
+		os.replace(tmpPath, path)
+
+	def evict(self):
+		# Drop least recently used entries until the cache fits in maxBytes
+		entries=[]
+		total=0
+		for entry in os.scandir(self.cacheDir):
+			if entry.name.endswith('.parquet') and entry.is_file():
+				stat=entry.stat()
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
+				total+=stat.st_size
+		entries.sort()
+		for mtime, size, path in entries:
+			if total <= self.maxBytes:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				# Another run got to it first
+				pass
+			total-=size
+
+
+def memberCRCs(esx):
+	# CRC and uncompressed size of every member of an open ESXFile, straight from the zip central directory
+	crcs={}
+	for info in esx.archive.infolist():
+		crcs[info.filename]=(info.CRC, info.file_size)
+	return crcs
+
+
+def changedMembers(old, new):
+	# Members that were added, removed or modified between two memberCRCs() results
+	changed=set()
+	for member in set(old) | set(new):
+		if old.get(member) != new.get(member):
+			changed.add(member)
+	return sorted(changed)
+
+
+def reportChanges(cache, crcs, inputPath, tool):
+	# Start of an incremental run: say what's changed in the project since tool last ran against it
+	previous=cache.loadManifest(inputPath, tool)
+	if previous is None:
+		print("No previous "+tool+" run for this project in "+cache.cacheDir+", building everything")
+		return
+	changed=changedMembers(previous, crcs)
+	if changed:
+		print("Changed since the last run: "+", ".join(changed))
+	else:
+		print("Nothing changed since the last run")
+
+
+def finishRun(cache, crcs, inputPath, tool):
+	# End of an incremental run: summarize what was rebuilt and record the manifest for next time
+	print("Rebuilt: "+(", ".join(cache.rebuilt) or "nothing"))
+	print("Reused from cache: "+(", ".join(cache.reused) or "nothing"))
+	cache.saveManifest(inputPath, tool, crcs)
+
+
+def restoreTypes(df):
+	# Parquet hands list columns (channels, technologies, etc.) back as numpy arrays, and gaps in text columns back as None.
+	# The scripts expect lists and NaN, same as a DataFrame built from the JSON, so put those back.
+	for col in df.columns:
+		if df[col].dtype != object:
+			continue
+		missing=df[col].isna()
+		if missing.any():
+			df[col]=df[col].where(~missing, np.nan)
+		sample=df[col][~missing]
+		if len(sample) > 0 and isinstance(sample.iloc[0], np.ndarray):
+			df[col]=[v.tolist() if isinstance(v, np.ndarray) else v for v in df[col]]
+	return df
+
+
+def openCache(cacheDir, sizeMB=defaultSizeMB, incremental=False):
+	# Convenience for the scripts' --cache/--cache-size/--incremental options: no directory means no caching,
+	# unless it's an incremental run, which falls back to the default cache directory
+	if cacheDir is None:
+		if not incremental:
+			return None
+		cacheDir=defaultCacheDir
+	return TableCache(cacheDir, sizeMB<<20)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+# Shared loader for Ekahau project (.esx) archives.
+# An ESX file is a zip archive with one JSON document per table (accessPoints.json, measuredRadios.json, etc.) plus floor plan images.
+# ESXFile opens the archive once and only parses a table the first time something asks for it, so a planned-only report never
+# decodes the measurement tables, and a survey-only report never touches simulatedRadios or antennaTypes.
+# (c) 2024 Ian Beyer
+
+import contextlib
+import zipfile
+import json
+import io
+import re
+import os
+import copy
+import struct
+import tempfile
+import esxjson
+
+# Fields the reports actually use out of the two big survey tables. Streaming with these drops the information elements,
+# which are the bulk of accessPointMeasurements.json on a real survey.
+measurementFields=('id','mac','ssid','security','channel','technologies')
+measuredRadioFields=('id','accessPointId','accessPointMeasurementIds')
+
+
+class ESXFile:
+
+	def __init__(self, path, metrics=None):
+		# metrics is an optional metrics.Metrics, which gets an unzip and a parse stage for every table loaded
+		self.path=path
+		self.archive=zipfile.ZipFile(path,'r')
+		self.members=set(self.archive.namelist())
+		self.cache={}
+		self.metrics=metrics
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def __contains__(self, table):
+		return self.has(table)
+
+	def __getitem__(self, table):
+		return self.table(table)
+
+	def close(self):
+		self.archive.close()
+
+	def memberName(self, table):
+		# Tables are referred to by their JSON key (accessPoints), members by file name (accessPoints.json)
+		if table.endswith('.json'):
+			return table
+		return table+'.json'
+
+	def has(self, table):
+		return self.memberName(table) in self.members
+
+	def load(self, table, default=None):
+		# Returns the whole JSON document for a table, parsed on first access and cached after that.
+		# Missing tables return default rather than raising, since most tables are optional depending on project type.
+		workingFile=self.memberName(table)
+		if workingFile not in self.cache:
+			if workingFile not in self.members:
+				return default
+			# Parse straight from the member bytes with whichever JSON backend is installed (see esxjson.py)
+			if self.metrics is None:
+				self.cache[workingFile]=esxjson.loads(self.archive.read(workingFile))
+			else:
+				with self.metrics.stage('unzip '+workingFile) as stage:
+					data=self.archive.read(workingFile)
+					stage.note(bytes=len(data))
+				with self.metrics.stage('parse '+workingFile) as stage:
+					document=esxjson.loads(data)
+					del data
+					stage.rows(document.get(workingFile[:-len('.json')]) if isinstance(document, dict) else document)
+				self.cache[workingFile]=document
+		return self.cache[workingFile]
+
+	def table(self, table):
+		# Returns the list of records in a table (e.g. accessPointsJSON['accessPoints']), or an empty list if the table doesn't exist.
+		key=self.memberName(table)[:-len('.json')]
+		document=self.load(table)
+		if document is None:
+			return []
+		return document.get(key, [])
+
+	def release(self, table):
+		# Drop a parsed table from the cache once the caller is done with it, so big tables don't hang around for the whole run.
+		self.cache.pop(self.memberName(table), None)
+
+	def iterRecords(self, table, fields=None, chunkSize=1<<20):
+		# Incremental parser: yields the records of a table one at a time straight off the zip member stream,
+		# without ever holding the whole document in memory. If fields is given, only those keys are kept on each record.
+		# Walks the same document json.load would, so the records are identical apart from the field filter.
+		# This always uses the standard library's raw_decode() rather than the esxjson backend, since none of the faster
+		# backends can decode one value at a time out of a partial buffer.
+		workingFile=self.memberName(table)
+		key=workingFile[:-len('.json')]
+		if workingFile not in self.members:
+			return
+		if workingFile in self.cache:
+			# Already parsed, no point going back to the archive
+			for record in self.table(table):
+				yield trimRecord(record, fields)
+			return
+
+		decoder=json.JSONDecoder()
+		arrayStart=re.compile(r'"'+re.escape(key)+r'"\s*:\s*\[')
+		with self.archive.open(workingFile) as stream:
+			reader=io.TextIOWrapper(stream, encoding='utf-8')
+			buf=''
+			pos=0
+			eof=False
+
+			# Find the start of the record list
+			while True:
+				match=arrayStart.search(buf)
+				if match:
+					pos=match.end()
+					break
+				if eof:
+					return
+				chunk=reader.read(chunkSize)
+				eof=(chunk == '')
+				# Keep enough of the tail around that a key split across two chunks still matches
+				buf=buf[-(len(key)+16):]+chunk
+
+			while True:
+				# Skip separators between records
+				while pos < len(buf) and buf[pos] in ' \t\r\n,':
+					pos+=1
+				if pos < len(buf) and buf[pos] == ']':
+					return
+				try:
+					if pos >= len(buf):
+						raise ValueError
+					record, end = decoder.raw_decode(buf, pos)
+				except ValueError:
+					# Record is split across chunks - pull in more data and try again
+					if eof:
+						raise ValueError(workingFile+" is truncated or malformed")
+					chunk=reader.read(chunkSize)
+					eof=(chunk == '')
+					buf=buf[pos:]+chunk
+					pos=0
+					continue
+				pos=end
+				yield trimRecord(record, fields)
+
+
+def trimRecord(record, fields):
+	if fields is None:
+		return record
+	return {f: record[f] for f in fields if f in record}
+
+
+def floorIndex(floorPlans, buildingFloors=(), buildings=()):
+	# floorPlanId -> (building name, floor name, metersPerUnit) for every floor plan, built once per project from the
+	# floorPlans, buildingFloors and buildings records, so placing an AP is one dict lookup.
+	# A floor that isn't in a building (or whose building is missing, or a project with no buildings at all) gets None
+	# for the building, as does a floor with no scale for metersPerUnit.
+	buildingNames={}
+	for building in buildings:
+		buildingNames[building['id']]=building['name']
+	buildingByFloor={}
+	for buildingFloor in buildingFloors:
+		buildingByFloor[buildingFloor['floorPlanId']]=buildingNames.get(buildingFloor['buildingId'])
+	index={}
+	for floorPlan in floorPlans:
+		index[floorPlan['id']]=(buildingByFloor.get(floorPlan['id']), floorPlan['name'], floorPlan.get('metersPerUnit'))
+	return index
+
+
+class ESXWriter:
+	# Writes a modified copy of an ESX archive without extracting it anywhere.
+	# Members that haven't been replaced are copied across as their original compressed bytes - no inflate/deflate - so
+	# floor plan bitmaps cost a file copy rather than a recompress. Only replaced members get encoded.
+	# Output goes to a temp file next to the destination and is renamed into place once complete, so a failed
+	# run never leaves a half-written ESX behind.
+
+	def __init__(self, source, path):
+		# source is an open ESXFile, path is the output file
+		self.source=source
+		self.path=path
+		self.replaced={}
+
+	def replace(self, table, data, indent=None):
+		# data is either the bytes of the new member or a JSON document (dict/list), which is serialized with esxjson
+		if not isinstance(data, (bytes, bytearray)):
+			data=esxjson.dumps(data, indent=indent)
+		# Non-JSON members (floor plan images etc.) are referred to by their exact member name
+		if table not in self.source.members:
+			table=self.source.memberName(table)
+		self.replaced[table]=data
+
+	def save(self):
+		with atomicOutput(self.path) as tmpPath:
+			with zipfile.ZipFile(tmpPath,'w',zipfile.ZIP_DEFLATED) as newArchive:
+				written=set()
+				for info in self.source.archive.infolist():
+					if info.filename in self.replaced:
+						zinfo=zipfile.ZipInfo(info.filename, date_time=info.date_time)
+						zinfo.compress_type=zipfile.ZIP_DEFLATED
+						zinfo.external_attr=info.external_attr
+						newArchive.writestr(zinfo, self.replaced[info.filename])
+					else:
+						copyRawMember(self.source.archive, info, newArchive)
+					written.add(info.filename)
+
+				# Anything that wasn't in the original archive gets added at the end
+				for name in self.replaced:
+					if name not in written:
+						newArchive.writestr(name, self.replaced[name])
+
+
+@contextlib.contextmanager
+def atomicOutput(path):
+	# Yields a temp file path next to path to write the output to. It's renamed over path once the block completes, or
+	# removed if the block fails, so a failed run never leaves a half-written file behind.
+	# mkstemp() always creates the file 0600, so it's given the permissions a plain open() would have (0666 less the umask)
+	# before it's renamed into place.
+	fd, tmpPath = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path)+'.', dir=os.path.dirname(os.path.abspath(path)))
+	os.close(fd)
+	try:
+		yield tmpPath
+		umask=os.umask(0)
+		os.umask(umask)
+		os.chmod(tmpPath, 0o666 & ~umask)
+		os.replace(tmpPath, path)
+	except BaseException:
+		if os.path.exists(tmpPath):
+			os.remove(tmpPath)
+		raise
+
+
+def stripExtra(extra, headerId):
+	# Remove one field type from a zip extra block. Used to drop the old zip64 field, which zipfile rewrites itself if needed.
+	out=b''
+	i=0
+	while i+4 <= len(extra):
+		tp, ln = struct.unpack('<HH', extra[i:i+4])
+		if tp != headerId:
+			out+=extra[i:i+4+ln]
+		i+=4+ln
+	return out
+
+
+def copyRawMember(archive, info, newArchive, chunkSize=1<<20):
+	# Copy one member's compressed bytes verbatim from archive into newArchive (a ZipFile open for writing).
+	zinfo=copy.copy(info)
+	zinfo.extra=stripExtra(info.extra, 1)
+
+	# Find the start of the compressed data - the local header can have a different extra field length from the central directory
+	archive.fp.seek(info.header_offset)
+	localHeader=archive.fp.read(zipfile.sizeFileHeader)
+	nameLen, extraLen = struct.unpack('<HH', localHeader[26:30])
+	archive.fp.seek(info.header_offset+zipfile.sizeFileHeader+nameLen+extraLen)
+
+	def chunks():
+		remaining=info.compress_size
+		while remaining > 0:
+			chunk=archive.fp.read(min(chunkSize, remaining))
+			if not chunk:
+				raise ValueError(info.filename+" is truncated")
+			yield chunk
+			remaining-=len(chunk)
+
+	writeRawMember(newArchive, zinfo, chunks())
+
+
+def writeRawMember(newArchive, zinfo, chunks):
+	# Write a member whose data is already compressed into newArchive (a ZipFile open for writing). zinfo has to have the
+	# CRC, both sizes and the compression type filled in; chunks is an iterable of the compressed bytes.
+	# zipfile has no public API for this, so this writes the local header itself and registers the entry so that
+	# ZipFile.close() puts it in the central directory along with everything else.
+	# Sizes and CRC go in the local header, so no data descriptor is needed after the data
+	zinfo.flag_bits&=~0x08
+
+	out=newArchive.fp
+	zinfo.header_offset=out.tell()
+	out.write(zinfo.FileHeader())
+	for chunk in chunks:
+		out.write(chunk)
+
+	newArchive.filelist.append(zinfo)
+	newArchive.NameToInfo[zinfo.filename]=zinfo
+	newArchive.start_dir=out.tell()
+	newArchive._didModify=True
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# Generate a synthetic Ekahau project (.esx) of any size, for testing and benchmarking the other scripts (see bench-esx.py).
+# Writes the same tables a real project has: buildings, floors and floor plan images, tag keys, antennas, planned APs with
+# simulated Wi-Fi and BLE radios, and surveyed APs with measured radios and BSSID measurements. The values are made up but
+# shaped like the real thing (Aruba models and serials, valid channels and centre frequencies, MACs, tags), so every script
+# runs against it end to end.
+# Everything comes from a seed, so the same options always give the same project.
+# It can also write a matching BSS table CSV in the apbss-db-ekahau.py format, for Update_APs.py.
+# (c) 2024 Ian Beyer
+
+import argparse
+import csv
+import random
+import string
+import uuid
+import zipfile
+import esxjson
+
+# Simulated radio bands with one channel in each, 20/40/80MHz wide, as channel numbers and as centre frequencies
+bands=[
+	('TWO', [6], [2437]),
+	('FIVE', [36, 40], [5180, 5200]),
+	('SIX', [5, 9, 13, 17], [5975, 5995, 6015, 6035])
+	]
+
+# Measured channel lists, in the shape AP_Report.py and ekahau-report.py expect (primary first, then the rest of the channel)
+measuredChannels=[[1], [6], [11], [36, 40], [44, 48], [149, 153, 157, 161], [36, 40, 44, 48, 52, 56, 60, 64]]
+
+models=['AP-505', 'AP-515', 'AP-535', 'AP-555', 'AP-635', 'AP-655']
+externalModels=['AP-514 + AP-ANT-25A', 'AP-534 + AP-ANT-28', 'AP-574 + AP-ANT-40']
+ssids=['corp', 'guest', 'iot', 'voice', '']
+securities=['WPA2_ENTERPRISE', 'WPA2_PERSONAL', 'WPA3_ENTERPRISE', 'OPEN']
+technologyLists=[['N'], ['N', 'AC'], ['N', 'AC', 'AX'], ['B', 'G', 'N']]
+mountings=['CEILING', 'WALL', 'FLOOR']
+
+# Tag keys every generated project has, plus however many extra ones are asked for
+standardTags=['AP Group', 'AP Serial', 'Wired MAC', 'Mount']
+
+
+class Generator:
+
+	def __init__(self, seed=1):
+		self.rng=random.Random(seed)
+
+	def uuid(self):
+		return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+	def mac(self):
+		return ':'.join('%02x' % b for b in [0x20, 0x4c, 0x03]+[self.rng.getrandbits(8) for i in range(3)])
+
+	def serial(self):
+		return self.rng.choice(['CN','TH','VN','US'])+''.join(self.rng.choices(string.ascii_uppercase, k=4))+''.join(self.rng.choices(string.ascii_uppercase+string.digits, k=4))
+
+
+def generate(path, aps=100, buildings=1, floors=2, radios=3, measurements=4, planned=0.5, extraTags=0, antennas=6, imageKB=256, seed=1, bssCSV=None):
+	# Writes the project to path. radios is Wi-Fi radios per AP (plus one BLE radio on planned APs), measurements is
+	# BSSIDs per measured radio. Returns a dict of table sizes.
+	gen=Generator(seed)
+
+	buildingList=[{'id':gen.uuid(), 'name':'Building '+str(b+1), 'status':'CREATED'} for b in range(buildings)]
+	floorPlans=[]
+	buildingFloors=[]
+	for b, building in enumerate(buildingList):
+		for f in range(floors):
+			floorPlan={
+				'id':gen.uuid(),
+				'name':'B'+str(b+1)+' Floor '+str(f+1),
+				'width':4000.0,
+				'height':3000.0,
+				'metersPerUnit':0.05,
+				'imageId':gen.uuid(),
+				'status':'CREATED'
+				}
+			floorPlans.append(floorPlan)
+			buildingFloors.append({'id':gen.uuid(), 'buildingId':building['id'], 'floorPlanId':floorPlan['id'], 'floorNumber':f, 'height':3.5, 'status':'CREATED'})
+
+	tagKeys=[{'id':gen.uuid(), 'key':key, 'status':'CREATED'} for key in standardTags+['Tag '+str(t+1) for t in range(extraTags)]]
+
+	antennaTypes=[]
+	for a in range(antennas):
+		band=bands[a % len(bands)][0]
+		antennaTypes.append({
+			'id':gen.uuid(),
+			'name':'Antenna '+str(a+1)+' '+band,
+			'vendor':'Aruba',
+			'maxGain':round(3.0+a*0.5, 1),
+			'apCoupling':'INTERNAL_ANTENNA' if a < len(bands) else 'EXTERNAL_ANTENNA',
+			'frequencyBand':band,
+			'status':'CREATED'
+			})
+
+	accessPoints=[]
+	simulatedRadios=[]
+	measuredRadios=[]
+	apMeasurements=[]
+	bssRows=[]
+
+	for i in range(aps):
+		apId=gen.uuid()
+		# Spreads the planned APs evenly through the list, so they end up on every floor
+		isPlanned=int((i+1)*planned) > int(i*planned)
+		floorPlan=floorPlans[i % len(floorPlans)]
+		external=gen.rng.random() < 0.2
+		name='AP-'+str(i+1).zfill(5)
+		group='group-'+str(i % 8 + 1)
+		serial=gen.serial()
+		wiredMac=gen.mac()
+		tagValues=[group, serial, wiredMac, 'MNT-'+str(i % 3 + 1)]+['value-'+str(gen.rng.randrange(100)) for t in range(extraTags)]
+		accessPoints.append({
+			'id':apId,
+			'name':name,
+			'mine':isPlanned,
+			'hidden':False,
+			'userDefinedPosition':True,
+			'vendor':'Aruba',
+			'model':gen.rng.choice(externalModels if external else models),
+			'color':'#FF8300',
+			'location':{'floorPlanId':floorPlan['id'], 'coord':{'x':round(gen.rng.random()*4000, 2), 'y':round(gen.rng.random()*3000, 2)}},
+			# Real projects don't have every tag on every AP
+			'tags':[{'tagKeyId':tagKeys[t]['id'], 'value':value} for t, value in enumerate(tagValues) if gen.rng.random() < 0.9],
+			'status':'CREATED'
+			})
+
+		if isPlanned:
+			mounting=gen.rng.choice(mountings)
+			for r in range(radios):
+				band, channels, frequencies = bands[r % len(bands)]
+				simulatedRadios.append({
+					'id':gen.uuid(),
+					'accessPointId':apId,
+					'accessPointIndex':r,
+					'radioTechnology':'IEEE802_11',
+					'antennaTypeId':antennaTypes[r % len(antennaTypes)]['id'],
+					'transmitPower':round(gen.rng.uniform(5, 20), 2),
+					'channel':channels,
+					'channelByCenterFrequencyDefinedNarrowChannels':frequencies,
+					'antennaDirection':float(gen.rng.randrange(0, 360, 15)),
+					'antennaTilt':0.0,
+					'antennaHeight':2.7,
+					'antennaMounting':mounting,
+					'technology':'AX',
+					'spatialStreamCount':2,
+					'shortGuardInterval':True,
+					'enabled':True,
+					'greenfield':False,
+					'defaultAntennas':[],
+					'status':'CREATED'
+					})
+			simulatedRadios.append({
+				'id':gen.uuid(),
+				'accessPointId':apId,
+				'accessPointIndex':radios,
+				'radioTechnology':'BLUETOOTH',
+				'antennaTypeId':antennaTypes[0]['id'],
+				'transmitPower':1.0,
+				'antennaDirection':0.0,
+				'antennaTilt':0.0,
+				'antennaHeight':2.7,
+				'antennaMounting':mounting,
+				'enabled':True,
+				'defaultAntennas':[],
+				'status':'CREATED'
+				})
+		else:
+			for r in range(radios):
+				measurementIds=[]
+				channel=gen.rng.choice(measuredChannels[:3] if r == 0 else measuredChannels[3:])
+				for m in range(measurements):
+					bssid=gen.mac()
+					ssid=ssids[m % len(ssids)]
+					measurement={
+						'id':gen.uuid(),
+						'mac':bssid,
+						'ssid':ssid,
+						'security':gen.rng.choice(securities),
+						'channel':channel,
+						'technologies':gen.rng.choice(technologyLists),
+						# Stands in for the base64 beacon IEs, which are most of the size of this table on a real survey
+						'informationElements':''.join(gen.rng.choices(string.ascii_letters+string.digits, k=120)),
+						'status':'CREATED'
+						}
+					apMeasurements.append(measurement)
+					measurementIds.append(measurement['id'])
+					bssRows.append([bssid, ssid, name, group, 'AP-515', serial, wiredMac, 'Orange'])
+				measuredRadios.append({'id':gen.uuid(), 'accessPointId':apId, 'accessPointMeasurementIds':measurementIds, 'status':'CREATED'})
+
+	tables=[
+		('project', {'name':'Synthetic project', 'id':gen.uuid(), 'schemaVersion':'1.0'}),
+		('buildings', buildingList),
+		('floorPlans', floorPlans),
+		('buildingFloors', buildingFloors),
+		('tagKeys', tagKeys),
+		('antennaTypes', antennaTypes),
+		('accessPoints', accessPoints),
+		('simulatedRadios', simulatedRadios),
+		('measuredRadios', measuredRadios),
+		('accessPointMeasurements', apMeasurements),
+		('notes', [{'id':gen.uuid(), 'text':'Generated by esxgen.py', 'status':'CREATED'}])
+		]
+
+	with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+		for name, data in tables:
+			archive.writestr(name+'.json', esxjson.dumps({name:data}))
+		# Floor plan bitmaps don't compress, so random bytes are a fair stand-in for their size
+		for floorPlan in floorPlans:
+			archive.writestr('image-'+floorPlan['imageId'], gen.rng.randbytes(imageKB*1024), compress_type=zipfile.ZIP_STORED)
+
+	if bssCSV:
+		with open(bssCSV, 'w', newline='') as csvfile:
+			writer=csv.writer(csvfile)
+			writer.writerow(['bss','ess','ap_name','group','model','serial','wired-mac','color'])
+			writer.writerows(bssRows)
+
+	return {name: len(data) for name, data in tables if isinstance(data, list)}
+
+
+def main():
+
+	cli=argparse.ArgumentParser(description='Generate a synthetic Ekahau project file for testing and benchmarking')
+
+	cli.add_argument("-o", "--output", required=True, help='Output .esx file')
+	cli.add_argument("-n", "--aps", required=False, type=int, help="Number of APs, planned and surveyed (default 100)", default=100)
+	cli.add_argument("-b", "--buildings", required=False, type=int, help="Number of buildings (default 1)", default=1)
+	cli.add_argument("-f", "--floors", required=False, type=int, help="Floors per building (default 2)", default=2)
+	cli.add_argument("-r", "--radios", required=False, type=int, help="Wi-Fi radios per AP (default 3)", default=3)
+	cli.add_argument("-m", "--measurements", required=False, type=int, help="BSSIDs per measured radio (default 4)", default=4)
+	cli.add_argument("--planned", required=False, type=float, help="Fraction of APs that are planned rather than surveyed (default 0.5)", default=0.5)
+	cli.add_argument("-t", "--extra-tags", required=False, type=int, help="Tag keys on top of AP Group, AP Serial, Wired MAC and Mount (default 0)", default=0)
+	cli.add_argument("-a", "--antennas", required=False, type=int, help="Number of antenna types (default 6)", default=6)
+	cli.add_argument("--image-kb", required=False, type=int, help="Size of each floor plan image in KB (default 256)", default=256)
+	cli.add_argument("-s", "--seed", required=False, type=int, help="Random seed (default 1)", default=1)
+	cli.add_argument("--bss-csv", required=False, metavar='FILE', help="Also write the surveyed BSSIDs as an apbss-db-ekahau.py CSV, for Update_APs.py", default=None)
+
+	args = vars(cli.parse_args())
+
+	counts=generate(args['output'], args['aps'], args['buildings'], args['floors'], args['radios'], args['measurements'], args['planned'],
+		args['extra_tags'], args['antennas'], args['image_kb'], args['seed'], args['bss_csv'])
+	print("Wrote "+args['output']+": "+", ".join(str(count)+" "+name for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# JSON backend used for reading and writing ESX tables.
+# Uses orjson or simdjson if one of them is installed, otherwise falls back to the standard library json module.
+# Everything works off bytes, so a table can be parsed straight from archive.read() without decoding it to a str first.
+# Set ESX_JSON_BACKEND=json (or orjson/simdjson) in the environment to force a particular backend.
+# (c) 2024 Ian Beyer
+
+import json
+import os
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import simdjson
+except ImportError:
+	simdjson = None
+
+backends=['orjson','simdjson','json']
+
+
+def available():
+	found=[]
+	if orjson is not None: found.append('orjson')
+	if simdjson is not None: found.append('simdjson')
+	found.append('json')
+	return found
+
+
+def setBackend(name=None):
+	# Pick a backend by name, or the fastest one installed if name is None.
+	global backend
+	if name is None:
+		name=available()[0]
+	if name not in available():
+		raise ValueError("JSON backend "+name+" is not installed. Available: "+", ".join(available()))
+	backend=name
+	return backend
+
+
+def loads(data, using=None):
+	using=using or backend
+	if using == 'orjson':
+		return orjson.loads(data)
+	if using == 'simdjson':
+		# as_dict/as_list turn the lazy simdjson proxy into plain python objects
+		doc=simdjson.Parser().parse(data)
+		if isinstance(doc, simdjson.Object):
+			return doc.as_dict()
+		if isinstance(doc, simdjson.Array):
+			return doc.as_list()
+		return doc
+	return json.loads(data)
+
+
+def dumps(obj, indent=None, using=None):
+	# Returns bytes, ready to be written into an archive member.
+	# simdjson is parse-only, so it writes with orjson if that's around, otherwise the stdlib.
+	# orjson can only indent by 2, so any other indent goes through the stdlib as well.
+	# Both backends give the same bytes for the same call: no indent (None or 0) is compact with no spaces, and text is
+	# written as UTF-8 rather than escaped.
+	using=using or backend
+	if using == 'simdjson':
+		using='orjson' if orjson is not None else 'json'
+	if using == 'orjson' and indent in (None, 0, 2):
+		option=orjson.OPT_INDENT_2 if indent else 0
+		return orjson.dumps(obj, option=option)
+	if not indent:
+		return json.dumps(obj, separators=(',',':'), ensure_ascii=False).encode('utf-8')
+	return json.dumps(obj, indent=indent, ensure_ascii=False).encode('utf-8')
+
+
+backend=None
+setBackend(os.environ.get('ESX_JSON_BACKEND'))
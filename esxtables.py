@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# pandas helpers shared by ekahau-deploy.py and ekahau-report.py for turning ESX tables into report-ready DataFrames.
+# (c) 2024 Ian Beyer
+
+import os
+import re
+import numpy as np
+import pandas as pd
+from esxfile import floorIndex, measurementFields, measuredRadioFields
+from esxcache import memberCRCs, compactTables
+
+# Center frequency (MHz) to channel number, indexed by frequency - channelmapBase.
+# Covers 2.4GHz (1-13 plus the odd one out, 14 at 2484), 5GHz (32-177) and 6GHz (1-233, plus channel 2 at 5935).
+# The bands don't overlap in frequency, so no band information is needed to do the lookup. Anything else maps to 0.
+channelmapBase=2400
+channelmap=np.zeros(7200-channelmapBase, dtype=np.int16)
+for ch in range(1,14):
+	channelmap[2407+5*ch-channelmapBase]=ch
+channelmap[2484-channelmapBase]=14
+for ch in range(32,178):
+	channelmap[5000+5*ch-channelmapBase]=ch
+channelmap[5935-channelmapBase]=2
+for ch in range(1,234):
+	channelmap[5950+5*ch-channelmapBase]=ch
+
+
+def tagPivot(apTagsRawDF, tagKeys, idColumn='ap_id'):
+	# Turns the per-AP tags lists into one column per tag (tag_<Key_Name>), one row per AP that has tags.
+	# apTagsRawDF has the AP ID in idColumn and the raw Ekahau tags list in 'tags'. tagKeys is the tagKeys.json record list.
+	# Returns the pivoted DataFrame (AP ID in 'accessPointId') and the list of tag columns, in tagKeys order.
+
+	tagNames={}
+	for key in tagKeys:
+		tagNames[key['id']]='tag_'+key['key'].replace(" ","_")
+
+	# One row per (AP, tag)
+	tags=apTagsRawDF[[idColumn,'tags']].explode('tags').dropna(subset=['tags'])
+	flat=pd.DataFrame(tags['tags'].tolist(), index=tags.index, columns=['tagKeyId','value'])
+	flat['accessPointId']=tags[idColumn]
+	flat['tagname']=flat['tagKeyId'].map(tagNames)
+	# Tags pointing at a key that isn't defined in tagKeys.json can't be named, so they're dropped
+	flat=flat.dropna(subset=['tagname'])
+
+	# If an AP has the same tag twice, the last one wins, same as setting it in a dict
+	flat=flat.drop_duplicates(subset=['accessPointId','tagname'], keep='last')
+
+	tagnameList=[]
+	used=set(flat['tagname'])
+	for tagname in tagNames.values():
+		if tagname in used and tagname not in tagnameList:
+			tagnameList.append(tagname)
+
+	apTagsListDF=flat.pivot(index='accessPointId', columns='tagname', values='value')
+	apTagsListDF=apTagsListDF.reindex(columns=tagnameList)
+	apTagsListDF.columns.name=None
+	apTagsListDF.reset_index(inplace=True)
+
+	return apTagsListDF, tagnameList
+
+
+def frequencyToChannel(freqs):
+	# Vectorized lookup of channel numbers for an array of center frequencies in MHz.
+	freqs=np.asarray(freqs, dtype=np.int64)-channelmapBase
+	inRange=(freqs >= 0) & (freqs < len(channelmap))
+	return np.where(inRange, channelmap[np.clip(freqs, 0, len(channelmap)-1)], 0)
+
+
+def channelsFromFrequencies(freqLists):
+	# Takes a column of center frequency lists (e.g. channelByCenterFrequencyDefinedNarrowChannels) and returns
+	# a column of channel number lists and a column of channel widths (20MHz per narrow channel), on the same index.
+	# Rows without a list come back as NaN in both.
+	exploded=freqLists.explode().dropna()
+	chans=pd.Series(frequencyToChannel(exploded.to_numpy(dtype=np.int64)), index=exploded.index)
+	grouped=chans.groupby(level=0, sort=False)
+	channels=grouped.agg(list).reindex(freqLists.index)
+	widths=(grouped.size()*20).reindex(freqLists.index).astype('Int64')
+	return channels, widths
+
+
+def radioPivot(simRadiosDF, antennasDF, radioFields, bleFields):
+	# Reshapes simulatedRadios into one row per AP. Each WiFi radio's columns come out as r<accessPointIndex>-<field>, so
+	# dual, tri and quad radio APs are all handled the same way, and the BLE radio's columns come out as ble-<field>.
+	# radioFields/bleFields map source column -> output field name, and can include antennaTypes columns (name, maxGain, etc.),
+	# which are looked up once for every radio by antennaTypeId.
+	# Returns the per-AP DataFrame (AP ID in 'accessPointId') and the sorted list of WiFi radio indexes found.
+
+	antennaFields=[]
+	for f in list(radioFields)+list(bleFields):
+		if f in antennasDF.columns and f not in simRadiosDF.columns and f not in antennaFields:
+			antennaFields.append(f)
+	antennas=antennasDF.reindex(columns=['id']+antennaFields).rename(columns={'id':'antennaTypeId'})
+	radios=pd.merge(simRadiosDF, antennas, on='antennaTypeId', how='left')
+
+	wifi=radios[radios['radioTechnology']=="IEEE802_11"]
+	wifi=wifi.drop_duplicates(subset=['accessPointId','accessPointIndex'])
+	wifi=wifi.set_index(['accessPointId','accessPointIndex']).reindex(columns=list(radioFields)).rename(columns=radioFields)
+	radioList=sorted(int(r) for r in wifi.index.get_level_values('accessPointIndex').unique())
+
+	if len(wifi) > 0:
+		wide=wifi.unstack('accessPointIndex')
+		wide.columns=['r'+str(int(idx))+'-'+f for f, idx in wide.columns]
+		wide=wide[['r'+str(r)+'-'+f for r in radioList for f in radioFields.values()]]
+	else:
+		wide=pd.DataFrame(index=pd.Index([], name='accessPointId'))
+
+	ble=radios[radios['radioTechnology']=="BLUETOOTH"].drop_duplicates(subset=['accessPointId'])
+	ble=ble.set_index('accessPointId').reindex(columns=list(bleFields)).rename(columns=bleFields)
+
+	radiosDF=wide.join(ble, how='outer')
+	radiosDF.index.name='accessPointId'
+	radiosDF.reset_index(inplace=True)
+
+	return radiosDF, radioList
+
+
+def radioIndexes(radiosDF):
+	# The WiFi radio indexes in a radioPivot() result, from its r<N>- column names. Same as the radioList radioPivot() returns.
+	found=set()
+	for col in radiosDF.columns:
+		match=re.match(r'r(\d+)-', col)
+		if match:
+			found.add(int(match.group(1)))
+	return sorted(found)
+
+
+def placeAPs(apsDF, floorPlansDF, buildingFloorsDF, buildingsDF):
+	# Replaces each AP's floorPlanId with its building and floor names, looked up in one esxfile.floorIndex() for the project
+	# rather than merging the three tables onto every AP. APs on a floor plan that isn't in floorPlans.json are dropped, as
+	# the merges did. Floors that aren't in a building, and projects without buildings, just get no building.
+	floors=floorIndex(floorPlansDF.to_dict('records'), buildingFloorsDF.to_dict('records'), buildingsDF.to_dict('records'))
+	apsDF=apsDF[apsDF['floorPlanId'].isin(list(floors))].reset_index(drop=True)
+	apsDF['building']=apsDF['floorPlanId'].map({floorPlanId: place[0] for floorPlanId, place in floors.items()}).astype(object)
+	apsDF['floor']=apsDF['floorPlanId'].map({floorPlanId: place[1] for floorPlanId, place in floors.items()}).astype(object)
+	apsDF=apsDF.drop(columns=['floorPlanId'])
+	if compactTables:
+		apsDF=compactTypes(apsDF, {'category': ['building','floor']})
+	return apsDF
+
+
+# The normalized tables projectTable() can build, and the archive members each one is built from.
+# The member list is what the cache key is made of, so a change to any of them rebuilds the table.
+tableSources={
+	'accessPoints': ['accessPoints.json'],
+	'apTags': ['accessPoints.json','tagKeys.json'],
+	'tagKeys': ['tagKeys.json'],
+	'antennaTypes': ['antennaTypes.json'],
+	'simulatedRadios': ['simulatedRadios.json'],
+	'measuredRadios': ['measuredRadios.json'],
+	'accessPointMeasurements': ['accessPointMeasurements.json'],
+	'floorPlans': ['floorPlans.json'],
+	'buildings': ['buildings.json'],
+	'buildingFloors': ['buildingFloors.json'],
+}
+
+
+# Narrower dtypes for the tables that grow with the size of the project (see compactTypes()). Strings with a handful of distinct
+# values repeated on every row become categoricals. The IDs a table refers to (its AP, antenna or floor plan) repeat on every
+# radio, so they're categoricals too; each row's own ID is unique and stays a string.
+# Coordinates, heights, angles and powers stay float64: they're written to the CSV and Excel outputs, and float32 would change
+# the figures there. Only spatialStreamCount, a small whole number that float32 holds exactly, is narrowed.
+# Floor and building names are categoricals so the names joined onto every AP are too.
+tableTypes={
+	'accessPoints': {
+		'category': ['vendor','model','color','status','floorPlanId']
+		},
+	'simulatedRadios': {
+		'category': ['accessPointId','antennaTypeId','radioTechnology','technology','antennaMounting','status'],
+		'float32': ['spatialStreamCount'],
+		'int16': ['accessPointIndex']
+		},
+	'measuredRadios': {
+		'category': ['accessPointId']
+		},
+	'accessPointMeasurements': {
+		'category': ['ssid','security']
+		},
+	'floorPlans': {
+		'category': ['name']
+		},
+	'buildings': {
+		'category': ['name']
+		},
+}
+
+# compactTables (from esxcache) is False with ESX_COMPACT_TYPES=0, which loads everything with pandas' default types,
+# e.g. to compare memory use with --metrics
+
+
+def compactTypes(df, types):
+	# Converts the columns named in types ({'category': [...], 'float32': [...], 'int16': [...]}) that df actually has.
+	# Integer columns with gaps (e.g. a field the BLE radios don't have) are left alone rather than turned into floats.
+	for dtype, columns in types.items():
+		for col in columns:
+			if col not in df.columns:
+				continue
+			if dtype == 'category':
+				df[col]=df[col].astype('category')
+			elif dtype.startswith('int'):
+				if df[col].notna().all():
+					df[col]=df[col].astype(dtype)
+			else:
+				df[col]=pd.to_numeric(df[col], errors='coerce').astype(dtype)
+	return df
+
+
+def frameMB(df):
+	# Memory used by a DataFrame in MB, strings and all
+	return df.memory_usage(deep=True).sum()/1048576.0
+
+
+def buildTable(esx, name):
+	# Builds one normalized table straight from the archive, with narrower column types where it can (see tableTypes)
+	df=buildFrame(esx, name)
+	if compactTables and name in tableTypes:
+		df=compactTypes(df, tableTypes[name])
+	return df
+
+
+def buildFrame(esx, name):
+	# The table as it comes out of the JSON, before compactTypes()
+	if name == 'accessPoints':
+		# APs with the location flattened into floorPlanId/coord.x/coord.y. Tags are in the apTags table.
+		accessPointsDF=pd.DataFrame(esx['accessPoints'])
+		if 'location' in accessPointsDF.columns:
+			accessPointsDF=accessPointsDF.join(pd.json_normalize(accessPointsDF.location))
+		return accessPointsDF.drop(columns=['location','tags'], errors='ignore')
+	if name == 'apTags':
+		apTagsRawDF=pd.DataFrame.from_records(esx['accessPoints'], columns=['id','tags'])
+		apTagsListDF, tagnameList = tagPivot(apTagsRawDF, esx['tagKeys'], idColumn='id')
+		return apTagsListDF
+	if name in ('measuredRadios','accessPointMeasurements'):
+		# Streamed, keeping only the fields the reports use - the full tables can be hundreds of MB
+		fields=measuredRadioFields if name == 'measuredRadios' else measurementFields
+		return pd.DataFrame.from_records(esx.iterRecords(name, fields), columns=fields)
+	if name == 'simulatedRadios':
+		# defaultAntennas isn't used by anything, and its nested records are more trouble than they're worth to cache
+		return pd.DataFrame(esx['simulatedRadios']).drop(columns=['defaultAntennas'], errors='ignore')
+	return pd.DataFrame(esx[name])
+
+
+def projectTable(esx, name, cache=None, metrics=None):
+	# Returns one of the normalized project tables (see tableSources) as a DataFrame, from the cache (an esxcache.TableCache)
+	# if it has it, otherwise built from the archive and added to the cache. Tables missing from the archive come back empty.
+	# The tag columns of apTags are everything after accessPointId, in tagKeys order.
+	# With metrics (a metrics.Metrics), building or fetching the table is recorded as a stage named after the table.
+	if cache is None:
+		return timedStage(metrics, name, lambda: buildTable(esx, name))
+	return cachedStage(cache, memberCRCs(esx), name, tableSources[name], lambda: buildTable(esx, name), metrics)
+
+
+def cachedStage(cache, crcs, name, members, build, metrics=None):
+	# Returns the DataFrame build() makes, or the copy cached by an earlier run if none of the archive members it depends on
+	# have changed since. Used for the joins and pivots the scripts build on top of the project tables, so an edit to
+	# accessPoints.json doesn't redo the radio pivot, for example. crcs is esxcache.memberCRCs() of the project.
+	# name has to be unique to what build() does - the scripts prefix theirs with the script name. It's also the stage name
+	# in metrics, if given.
+	if cache is None:
+		return timedStage(metrics, name, build)
+	if metrics is not None:
+		with metrics.stage(name) as stage:
+			reused=len(cache.reused)
+			df=cachedStage(cache, crcs, name, members, build)
+			stage.rows(df)
+			stage.note(cached=len(cache.reused) > reused, frameMB=round(frameMB(df), 2))
+		return df
+	key=cache.key(crcs, name, members)
+	df=cache.get(key)
+	if df is None:
+		df=build()
+		cache.put(key, df)
+		cache.rebuilt.append(name)
+	else:
+		cache.reused.append(name)
+	return df
+
+
+def timedStage(metrics, name, build):
+	# build() recorded as a stage in metrics (a metrics.Metrics), or just build() if there's no metrics
+	if metrics is None:
+		return build()
+	with metrics.stage(name) as stage:
+		df=build()
+		stage.rows(df)
+		stage.note(frameMB=round(frameMB(df), 2))
+	return df
+
+
+def debugDump(dumpDir, name, df):
+	# Writes a snapshot of an intermediate table to dumpDir/<name>.parquet when --debug-dump is set, and does nothing otherwise.
+	# Parquet needs pyarrow (or fastparquet) and can't hold every mix of types pandas can, so it falls back to CSV when it can't be used.
+	if dumpDir is None:
+		return
+	os.makedirs(dumpDir, exist_ok=True)
+	path=os.path.join(dumpDir, name)
+	try:
+		df.to_parquet(path+'.parquet')
+	except (ImportError, ValueError, TypeError) as e:
+		print("Parquet not available for "+name+" ("+type(e).__name__+"), writing CSV instead")
+		if os.path.exists(path+'.parquet'):
+			os.remove(path+'.parquet')
+		df.to_csv(path_or_buf=path+'.csv')
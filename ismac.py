@@ -1,32 +1,19 @@
 #!/usr/bin/python3
 
-import re
+from macaddr import classify, kindDelimiters, kindSerial, formatMac
 
-for sourceString in ['aa:bb:cc:dd:ee:ff', "AA-BB-CC-DD-EE-FF", "aaaa.bbbb.cccc", "This. is-not a : hex string"]:
-	print("\n\nSource String: "+sourceString)
-	isMac=False 
-	delimiter=""
-	# Let's Check to see if this is at least vaguely hexadecimal
-	if '.' in sourceString:
-		macMatch=re.match(r"^([0-9A-Fa-f]{4}[.]){2}([0-9A-Fa-f]{4})$", sourceString)
-		if macMatch:
-			isMac=True
-			delimiter = '.'
-			print(macMatch.group())
-	if ':' in sourceString:
-		macMatch=re.match(r"^([0-9A-Fa-f]{2}[:]){5}([0-9A-Fa-f]{2})$", sourceString)
-		if macMatch:
-			isMac=True
-			delimiter = ':'
-			print(macMatch.group())
-	if '-' in sourceString:
-		macMatch=re.match(r"^([0-9A-Fa-f]{2}[-]){5}([0-9A-Fa-f]{2})$", sourceString)
-		if macMatch:
-			isMac=True
-			delimiter = '-'
-			print(macMatch.group())
+sourceStrings=['aa:bb:cc:dd:ee:ff', "AA-BB-CC-DD-EE-FF", "aaaa.bbbb.cccc", "aabbccddeeff", "CNABCD1234", "This. is-not a : hex string"]
 
+# All of them in one go - this is how the scripts scan a whole column of tag values
+kinds, macs = classify(sourceStrings)
 
+for sourceString, kind, mac in zip(sourceStrings, kinds.tolist(), macs.tolist()):
+	print("\n\nSource String: "+sourceString)
+	isMac = kind in kindDelimiters
+	if isMac:
+		print(formatMac(mac))
 	print (isMac)
-	print("Delimiter: " + delimiter)
-
+	if isMac:
+		print("Delimiter: " + kindDelimiters[kind])
+	if kind == kindSerial:
+		print("Aruba serial number")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# MAC addresses and BSSIDs as 48-bit integers, held in numpy uint64 arrays.
+# The scripts see MACs written three ways - aa:bb:cc:dd:ee:ff (Ekahau, AOS8), AA-BB-CC-DD-EE-FF (Windows, some exports) and
+# aabb.ccdd.eeff (Cisco style, tag values) - in either case. Parsed to integers they all compare equal, so joins and dedup
+# are integer hash lookups with no string normalization, and prefix matching (OUI, BSSID base address) is a shift.
+# Parsing and formatting work on whole arrays/columns at once: the strings are laid out as a fixed width byte matrix and
+# decoded with a lookup table, with no per-value Python. classify() does the same for scanning tag values, picking out the
+# MACs and the Aruba serial numbers together.
+# (c) 2024 Ian Beyer
+
+import numpy as np
+import pandas as pd
+
+# Hex digit value of every byte, 255 for anything that isn't one
+hexValue=np.full(256, 255, dtype=np.uint8)
+for i, c in enumerate(b'0123456789abcdef'):
+	hexValue[c]=i
+for i, c in enumerate(b'ABCDEF'):
+	hexValue[c]=10+i
+
+hexLower=np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+hexUpper=np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+
+# What classify() makes of each value
+kindOther=0
+kindColon=1		# aa:bb:cc:dd:ee:ff
+kindDash=2		# aa-bb-cc-dd-ee-ff
+kindDot=3		# aabb.ccdd.eeff
+kindBare=4		# aabbccddeeff
+kindSerial=5	# Aruba serial number, e.g. CNABCD1234
+
+kindDelimiters={kindColon: ':', kindDash: '-', kindDot: '.', kindBare: ''}
+
+# Where the 12 hex digits and the delimiters sit in each notation, keyed by string length
+layouts={
+	17: ([0,1,3,4,6,7,9,10,12,13,15,16], [2,5,8,11,14]),	# aa:bb:cc:dd:ee:ff, aa-bb-cc-dd-ee-ff
+	14: ([0,1,2,3,5,6,7,8,10,11,12,13], [4,9]),			# aabb.ccdd.eeff
+	12: (list(range(12)), [])								# aabbccddeeff
+}
+
+# Aruba serials are two letter country of manufacture, four letters, then four letters/digits
+serialLength=10
+isUpper=np.zeros(256, dtype=bool)
+isUpper[np.frombuffer(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ', dtype=np.uint8)]=True
+isUpperOrDigit=isUpper.copy()
+isUpperOrDigit[np.frombuffer(b'0123456789', dtype=np.uint8)]=True
+
+shifts=np.arange(44, -4, -4, dtype=np.uint64)
+
+
+def classify(values):
+	# Sorts a list/array/Series of values into MACs (by notation), Aruba serials and everything else in one pass: each string
+	# of a length that could be one of them is laid out in a fixed width byte matrix, and checked a column at a time against
+	# the lookup tables above. Returns (kinds, macs): an int8 array of the kind* values, and a uint64 array with the 48-bit
+	# value of every MAC (0 for anything else). None, NaN and non-strings are kindOther.
+	strings=pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values.astype(object)
+	n=len(strings)
+	kinds=np.zeros(n, dtype=np.int8)
+	macs=np.zeros(n, dtype=np.uint64)
+	if n == 0:
+		return kinds, macs
+
+	isString=strings.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+	lengths=np.zeros(n, dtype=np.int64)
+	lengths[isString]=strings[isString].str.len().to_numpy()
+
+	for length in [17, 14, 12, serialLength]:
+		rows=np.flatnonzero(lengths == length)
+		if len(rows) == 0:
+			continue
+		# Non-ASCII characters come out as '?', which isn't a hex digit, delimiter or serial character, so those rows fail the checks below
+		encoded=strings.iloc[rows].str.encode('ascii', 'replace')
+		chars=np.array(encoded.tolist(), dtype='S'+str(length)).view(np.uint8).reshape(len(rows), length)
+
+		if length == serialLength:
+			ok=isUpper[chars[:, :6]].all(axis=1) & isUpperOrDigit[chars[:, 6:]].all(axis=1)
+			kinds[rows[ok]]=kindSerial
+			continue
+
+		digits, delimiters = layouts[length]
+		nibbles=hexValue[chars[:, digits]]
+		ok=(nibbles < 16).all(axis=1)
+		if length == 17:
+			seps=chars[:, delimiters]
+			ok&=(seps == seps[:, :1]).all(axis=1)
+			kind=np.where(seps[:, 0] == ord(':'), kindColon, np.where(seps[:, 0] == ord('-'), kindDash, kindOther))
+			ok&=kind != kindOther
+		elif length == 14:
+			ok&=(chars[:, delimiters] == ord('.')).all(axis=1)
+			kind=np.full(len(rows), kindDot)
+		else:
+			kind=np.full(len(rows), kindBare)
+		parsed=(nibbles.astype(np.uint64) << shifts).sum(axis=1, dtype=np.uint64)
+		macs[rows[ok]]=parsed[ok]
+		kinds[rows[ok]]=kind[ok]
+	return kinds, macs
+
+
+def parseMacs(values):
+	# Parses a list/array/Series of MAC strings in any of the notations above.
+	# Returns (macs, valid): a uint64 array of the 48-bit values, and a bool array that's False for anything that isn't a MAC
+	# (its value in macs is 0). None, NaN and non-strings are just not MACs.
+	kinds, macs = classify(values)
+	return macs, (kinds >= kindColon) & (kinds <= kindBare)
+
+
+def formatMacs(macs, delimiter=':', upper=False):
+	# The reverse of parseMacs(): a numpy array of strings in the given notation (':', '-', '.' or '' for bare hex).
+	# Pass valid from parseMacs() as macs[valid] if some of them weren't MACs.
+	macs=np.asarray(macs, dtype=np.uint64)
+	nibbles=((macs[:, None] >> shifts) & np.uint64(0xF)).astype(np.uint8)
+	chars=(hexUpper if upper else hexLower)[nibbles]
+	if delimiter == '.':
+		groups=[chars[:, 0:4], chars[:, 4:8], chars[:, 8:12]]
+	elif delimiter:
+		groups=[chars[:, i:i+2] for i in range(0, 12, 2)]
+	else:
+		groups=[chars]
+	if delimiter:
+		sep=np.full((len(macs), 1), ord(delimiter), dtype=np.uint8)
+		parts=[]
+		for g in groups:
+			if parts:
+				parts.append(sep)
+			parts.append(g)
+		chars=np.hstack(parts)
+	width=chars.shape[1]
+	return np.ascontiguousarray(chars).view('S'+str(width)).ravel().astype('U'+str(width))
+
+
+def parseMac(value):
+	# Single value version of parseMacs(): the integer, or None if it isn't a MAC
+	macs, valid = parseMacs([value])
+	return int(macs[0]) if valid[0] else None
+
+
+def formatMac(mac, delimiter=':', upper=False):
+	return str(formatMacs([mac], delimiter, upper)[0])
+
+
+def macPrefix(macs, bits):
+	# The top bits of each MAC (24 for the OUI), for prefix matching. Works on a single int or an array.
+	shift=48-bits
+	if isinstance(macs, (int, np.integer)):
+		return int(macs) >> shift
+	return np.asarray(macs, dtype=np.uint64) >> np.uint64(shift)
+
+
+def isLocal(macs):
+	# Locally administered bit (second bit of the first octet), set on randomized and anonymized MACs
+	return (np.asarray(macs, dtype=np.uint64) >> np.uint64(41)) & np.uint64(1) == 1
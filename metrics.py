@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Per-stage timing for the scripts: wall time, rows in and out, and memory before/after each stage of a run
+# (unzipping and parsing each table, building the DataFrames, tag pivots, merges, writing the outputs).
+# Stages nest, so a table load shows the unzip and parse stages inside it.
+# Scripts create one Metrics per run, and with --metrics FILE.json the stages are written out as JSON for monitoring to
+# pick up. Quiet mode (-q) goes through the same object: banner() is how the scripts print their "==========" and
+# "Loading X..." progress lines, and it prints nothing when quiet.
+# (c) 2024 Ian Beyer
+
+import datetime
+import json
+import os
+import sys
+import time
+
+try:
+	import resource
+except ImportError:
+	# Windows
+	resource = None
+
+
+def rssMB():
+	# Current resident set size in MB. Linux has it in /proc; elsewhere the best there is without psutil is the peak.
+	try:
+		with open('/proc/self/statm', 'r') as statm:
+			return int(statm.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1048576.0
+	except (OSError, ValueError, IndexError, AttributeError):
+		return peakRSSMB()
+
+
+def peakRSSMB():
+	if resource is None:
+		return None
+	# ru_maxrss is in KB on Linux, bytes on macOS
+	peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+	if sys.platform == 'darwin':
+		peak=peak/1024.0
+	return peak
+
+
+def rowCount(rows):
+	# Rows in a DataFrame, list, dict etc., or rows itself if it's already a number
+	if rows is None or isinstance(rows, int):
+		return rows
+	try:
+		return len(rows)
+	except TypeError:
+		return None
+
+
+class Stage:
+
+	def __init__(self, metrics, name, rowsIn=None):
+		self.metrics=metrics
+		self.name=name
+		self.depth=len(metrics.active)
+		self.rowsIn=rowCount(rowsIn)
+		self.rowsOut=None
+		self.extra={}
+
+	def rows(self, rowsOut, rowsIn=None):
+		# Record what the stage produced (and what went in, if it wasn't known at the start). Takes a count or anything with a len().
+		self.rowsOut=rowCount(rowsOut)
+		if rowsIn is not None:
+			self.rowsIn=rowCount(rowsIn)
+
+	def note(self, **extra):
+		# Anything else worth keeping about the stage, e.g. bytes=... or cached=True
+		self.extra.update(extra)
+
+	def __enter__(self):
+		self.metrics.active.append(self)
+		self.rssBefore=rssMB()
+		self.start=time.perf_counter()
+		return self
+
+	def __exit__(self, excType, exc, tb):
+		self.seconds=time.perf_counter()-self.start
+		self.rssAfter=rssMB()
+		self.metrics.active.pop()
+		record={
+			'name':self.name,
+			'depth':self.depth,
+			'seconds':round(self.seconds, 6),
+			'rowsIn':self.rowsIn,
+			'rowsOut':self.rowsOut,
+			'rssBeforeMB':round(self.rssBefore, 1) if self.rssBefore is not None else None,
+			'rssAfterMB':round(self.rssAfter, 1) if self.rssAfter is not None else None,
+			'rssDeltaMB':round(self.rssAfter-self.rssBefore, 1) if self.rssBefore is not None else None
+			}
+		if excType is not None:
+			record['error']=excType.__name__
+		record.update(self.extra)
+		self.metrics.stages.append(record)
+		return False
+
+
+class Metrics:
+
+	def __init__(self, tool, quiet=False):
+		self.tool=tool
+		self.quiet=quiet
+		self.stages=[]
+		self.active=[]
+		self.info={}
+		self.started=datetime.datetime.now().astimezone()
+		self.start=time.perf_counter()
+
+	def stage(self, name, rowsIn=None):
+		# with metrics.stage('merge.tags', apsDF) as stage: ... stage.rows(resultDF)
+		return Stage(self, name, rowsIn)
+
+	def banner(self, *text):
+		# Progress output that quiet mode suppresses
+		if not self.quiet:
+			print(*text)
+
+	def pprint(self, pp, obj):
+		# Same, for the scripts' pretty-printed dumps (args and so on)
+		if not self.quiet:
+			pp.pprint(obj)
+
+	def report(self):
+		# Everything as one JSON-ready dict. Stages are listed in the order they finished, so nested stages come before the
+		# stage they're part of; depth says how far down each one is.
+		return {
+			'tool':self.tool,
+			'started':self.started.isoformat(timespec='seconds'),
+			'seconds':round(time.perf_counter()-self.start, 6),
+			'peakRSSMB':peakRSSMB(),
+			'info':self.info,
+			'stages':self.stages
+			}
+
+	def write(self, path):
+		# Written to a temp file and renamed into place, so whatever's scraping the file never reads half of it
+		tmpPath=path+'.tmp'
+		with open(tmpPath, 'w') as metricsFile:
+			json.dump(self.report(), metricsFile, indent=1)
+		os.replace(tmpPath, path)
+
+	def summary(self):
+		# Stage table for the end of a run, in start order with nested stages indented
+		# mem MB is the change in RSS over the stage, frame MB the size of the DataFrame it produced (where there is one)
+		lines=["{:<40} {:>10} {:>10} {:>10} {:>10} {:>10}".format('stage','seconds','rows in','rows out','mem MB','frame MB')]
+		for stage in self.ordered():
+			lines.append("{:<40} {:>10.3f} {:>10} {:>10} {:>10} {:>10}".format(('  '*stage['depth']+stage['name'])[:40], stage['seconds'],
+				'' if stage['rowsIn'] is None else stage['rowsIn'], '' if stage['rowsOut'] is None else stage['rowsOut'],
+				'' if stage['rssDeltaMB'] is None else '{:+.1f}'.format(stage['rssDeltaMB']),
+				'{:.2f}'.format(stage['frameMB']) if 'frameMB' in stage else ''))
+		lines.append("{:<40} {:>10.3f}   peak RSS {:.1f} MB".format('total', time.perf_counter()-self.start, peakRSSMB() or 0))
+		return "\n".join(lines)
+
+	def ordered(self):
+		# Stages are recorded as they finish, so a stage comes after the ones nested in it. Put parents first for display.
+		ordered=[]
+		pending=[]
+		for stage in self.stages:
+			children=[]
+			while pending and pending[-1]['depth'] > stage['depth']:
+				children.insert(0, pending.pop())
+			pending.append(dict(stage, children=children))
+		def flatten(stages):
+			for stage in stages:
+				ordered.append(stage)
+				flatten(stage['children'])
+		flatten(pending)
+		return ordered
+
+	def finish(self, path=None):
+		# End of run: write the metrics file if there is one, and print the stage table unless quiet
+		if path:
+			self.write(path)
+			if not self.quiet:
+				print("==========")
+				print(self.summary())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# Local stand-in for an ArubaOS 8 Mobility Conductor and its controllers, for testing and benchmarking apbss-db-ekahau.py
+# without touching a production environment.
+# Implements the bits of the REST API the collector uses: api/login, api/logout and configuration/showcommand for
+# "show switches", "show ap database long" and "show ap bss-table details".
+# One server plays every device: the conductor answers on 127.0.0.1, and controller N on 127.0.0.(N+1), so point the
+# collector at -t 127.0.0.1 and it finds the controllers the same way it would on a real network. Linux routes all of
+# 127.0.0.0/8 to loopback out of the box; on macOS add the extra addresses with "ifconfig lo0 alias 127.0.0.2" etc.
+# Data is generated from a seed, so every run against the same options returns the same tables.
+# (c) 2024 Ian Beyer
+
+import argparse
+import http.server
+import ipaddress
+import json
+import os
+import random
+import secrets
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+conductorAddress='127.0.0.1'
+
+
+def buildInventory(controllers, apsPerController, bssPerAp, down, seed):
+	# Returns the switch list, the AP database and the BSS table for each controller address
+	rng=random.Random(seed)
+	switches=[{
+		'IP Address': conductorAddress,
+		'Name': 'mock-mcr',
+		'Type': 'conductor',
+		'Model': 'MM-VA-500',
+		'Status': 'up',
+		'Version': '8.10.0.0',
+		'Location': 'Building1.floor1',
+		'Configuration State': 'UPDATE SUCCESSFUL'
+		}]
+	apDatabase=[]
+	bssTables={}
+	models=['515','535','555','635','655']
+	ssids=['corp','guest','iot','voice']
+	for c in range(controllers):
+		address=str(ipaddress.ip_address(conductorAddress)+c+1)
+		name='mock-md-'+str(c+1)
+		switches.append({
+			'IP Address': address,
+			'Name': name,
+			'Type': 'MD',
+			'Model': 'A7240XM',
+			'Status': 'down' if c < down else 'up',
+			'Version': '8.10.0.0',
+			'Location': 'Building1.floor1',
+			'Configuration State': 'UPDATE SUCCESSFUL'
+			})
+		bssTables[address]=[]
+		for a in range(apsPerController):
+			apName=name+'-ap-'+str(a+1)
+			wiredMac=':'.join('%02x' % b for b in [0x20, 0x4c, 0x03, c & 0xff, a >> 8 & 0xff, a & 0xff])
+			apDatabase.append({
+				'Name': apName,
+				'Group': 'group-'+str(c % 4 + 1),
+				'AP Type': rng.choice(models),
+				'IP Address': '10.'+str(c+1)+'.'+str(a >> 8)+'.'+str(a & 0xff),
+				'Status': 'Up 3d:4h:5m:6s',
+				'Flags': '',
+				'Switch IP': address,
+				'Standby IP': '0.0.0.0',
+				'Wired MAC Address': wiredMac,
+				'Serial #': 'CN'+''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ') for i in range(4))+''.join(rng.choice('0123456789ABCDEFGHJKLMNPQRSTUVWXYZ') for i in range(4)),
+				'Port': 'N/A',
+				'FQLN': 'N/A',
+				'Outer IP': 'N/A',
+				'User': ''
+				})
+			for b in range(bssPerAp):
+				bssid=':'.join('%02x' % x for x in [0x20, 0x4c, 0x03, c & 0xff, a & 0xff, (a >> 8 & 0x0f) << 4 | b])
+				band=b % 2
+				bssTables[address].append({
+					'bss': bssid,
+					'ess': ssids[b // 2 % len(ssids)],
+					's/p': 'N/A',
+					'ap name': apName,
+					'phy': '5GHz-he' if band else '2.4GHz-he',
+					'type': 'ap',
+					'ch/EIRP/max-EIRP': ('36E/18/23' if band else '6/12/21'),
+					'cur-cl': '0',
+					'ap name_1': apName,
+					'in-t(s)': '0',
+					'tot-t': '3d:4h:5m:6s',
+					'mtu': '1500',
+					'acl-state,acl': '7,7',
+					'acl': '7',
+					'fwd-mode': 'tunnel'
+					})
+	return switches, apDatabase, bssTables
+
+
+class MockAOS8Handler(http.server.BaseHTTPRequestHandler):
+
+	protocol_version='HTTP/1.1'
+
+	def log_message(self, format, *args):
+		if self.server.options['verbose']:
+			http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def reply(self, status, document, cookie=None):
+		body=json.dumps(document).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		if cookie is not None:
+			self.send_header('Set-Cookie', 'SESSION='+cookie+'; Path=/; Secure; HttpOnly')
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		server=self.server
+		options=server.options
+		# Which device this is depends on which loopback address the request came in on
+		device=self.connection.getsockname()[0]
+		url=urllib.parse.urlsplit(self.path)
+		params=dict(urllib.parse.parse_qsl(url.query))
+		endpoint=url.path.split('/', 2)[-1]
+		server.count(device)
+
+		if device != conductorAddress and device not in server.bssTables:
+			self.reply(404, {'_global_result': {'status': '1', 'status_str': 'No such device'}})
+			return
+
+		delay=(options['latency']+random.uniform(0, options['jitter']))/1000.0
+		if device in server.hung:
+			delay=max(delay, options['hang'])
+		if delay > 0:
+			time.sleep(delay)
+
+		if options['fail_rate'] > 0 and random.random() < options['fail_rate']:
+			server.count('failures')
+			self.reply(500, {'_global_result': {'status': '1', 'status_str': 'Injected failure'}})
+			return
+
+		if endpoint == 'api/login':
+			if params.get('username') != options['username'] or params.get('password') != options['password']:
+				self.reply(401, {'_global_result': {'status': '1', 'status_str': 'Unauthorized request'}})
+				return
+			token=secrets.token_hex(16)
+			with server.lock:
+				server.tokens[token]=device
+			self.reply(200, {'_global_result': {'status': '0', 'status_str': "You've logged in successfully.", 'UIDARUBA': token}}, cookie=token)
+			return
+
+		token=params.get('UIDARUBA')
+		if token is None and 'SESSION=' in self.headers.get('Cookie', ''):
+			token=self.headers.get('Cookie').split('SESSION=', 1)[1].split(';')[0]
+
+		if endpoint == 'api/logout':
+			with server.lock:
+				server.tokens.pop(token, None)
+			self.reply(200, {'_global_result': {'status': '0', 'status_str': "You've logged out successfully.", 'UIDARUBA': token}})
+			return
+
+		if endpoint == 'configuration/showcommand':
+			if server.tokens.get(token) != device:
+				self.reply(401, {'_global_result': {'status': '1', 'status_str': 'Invalid session'}})
+				return
+			command=' '.join(params.get('command', '').split())
+			if command == 'show switches' and device == conductorAddress:
+				self.reply(200, {'All Switches': server.switches, '_meta': ['IP Address','Name','Type','Model','Status']})
+			elif command == 'show ap database long' and device == conductorAddress:
+				self.reply(200, {'AP Database': server.apDatabase, '_meta': list(server.apDatabase[0].keys()) if server.apDatabase else []})
+			elif command == 'show ap bss-table details' and device != conductorAddress:
+				self.reply(200, {'Aruba AP BSS Table': server.bssTables[device], '_meta': ['bss','ess','ap name','phy']})
+			else:
+				self.reply(200, {'_data': ['% Invalid input detected at \'^\' marker.']})
+			return
+
+		self.reply(404, {'_global_result': {'status': '1', 'status_str': 'Unknown endpoint'}})
+
+
+class MockAOS8Server(http.server.ThreadingHTTPServer):
+
+	daemon_threads=True
+
+	def __init__(self, options):
+		http.server.ThreadingHTTPServer.__init__(self, ('0.0.0.0', options['port']), MockAOS8Handler)
+		self.options=options
+		self.switches, self.apDatabase, self.bssTables = buildInventory(options['controllers'], options['aps'], options['bss'], options['down'], options['seed'])
+		# The last --hang controllers accept the connection but take --hang seconds to answer anything
+		addresses=list(self.bssTables.keys())
+		self.hung=set(addresses[len(addresses)-options['hang_count']:]) if options['hang_count'] > 0 else set()
+		self.tokens={}
+		self.requests={}
+		self.lock=threading.Lock()
+
+	def count(self, device):
+		with self.lock:
+			self.requests[device]=self.requests.get(device, 0)+1
+
+
+def selfSignedCert(directory):
+	# Throwaway certificate for the TLS listener, made with the openssl command line tool
+	certfile=os.path.join(directory, 'mock-aos8.crt')
+	keyfile=os.path.join(directory, 'mock-aos8.key')
+	subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=mock-aos8',
+		'-keyout', keyfile, '-out', certfile], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	return certfile, keyfile
+
+
+def main():
+
+	cli=argparse.ArgumentParser(description='Mock ArubaOS 8 Mobility Conductor/controller API for testing apbss-db-ekahau.py')
+
+	cli.add_argument("-P", "--port", required=False, type=int, help="Port to listen on (default 4343, same as AOS8)", default=4343)
+	cli.add_argument("-C", "--controllers", required=False, type=int, help="Number of Mobility Controllers (default 4)", default=4)
+	cli.add_argument("-A", "--aps", required=False, type=int, help="APs per controller (default 50)", default=50)
+	cli.add_argument("-B", "--bss", required=False, type=int, help="BSSIDs per AP (default 4)", default=4)
+	cli.add_argument("-u", "--username", required=False, help="Username to accept (default admin)", default='admin')
+	cli.add_argument("-p", "--password", required=False, help="Password to accept (default admin)", default='admin')
+	cli.add_argument("-l", "--latency", required=False, type=float, help="Added latency per request in milliseconds (default 0)", default=0)
+	cli.add_argument("-j", "--jitter", required=False, type=float, help="Random extra latency per request, up to this many milliseconds (default 0)", default=0)
+	cli.add_argument("-f", "--fail-rate", required=False, type=float, help="Fraction of requests answered with HTTP 500 (default 0)", default=0)
+	cli.add_argument("--down", required=False, type=int, help="Number of controllers reported as down in show switches (default 0)", default=0)
+	cli.add_argument("--hang-count", required=False, type=int, help="Number of controllers that stall before answering (default 0)", default=0)
+	cli.add_argument("--hang", required=False, type=float, help="How long stalled controllers take to answer, in seconds (default 60)", default=60)
+	cli.add_argument("-s", "--seed", required=False, type=int, help="Seed for the generated inventory (default 1)", default=1)
+	cli.add_argument("--certfile", required=False, help="TLS certificate (default: generate a self-signed one with openssl)", default=None)
+	cli.add_argument("--keyfile", required=False, help="TLS private key for --certfile", default=None)
+	cli.add_argument("-v", "--verbose", required=False, action="store_true", help="Log every request")
+
+	options=vars(cli.parse_args())
+
+	server=MockAOS8Server(options)
+
+	with tempfile.TemporaryDirectory() as certDir:
+		certfile, keyfile = options['certfile'], options['keyfile']
+		if certfile is None:
+			try:
+				certfile, keyfile = selfSignedCert(certDir)
+			except (OSError, subprocess.CalledProcessError):
+				sys.exit("Couldn't generate a certificate with openssl - pass --certfile/--keyfile instead")
+		context=ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+		context.load_cert_chain(certfile, keyfile)
+		server.socket=context.wrap_socket(server.socket, server_side=True)
+
+		print("Mock conductor on https://"+conductorAddress+":"+str(options['port'])+" with "+str(options['controllers'])+" controllers, "+str(options['controllers']*options['aps'])+" APs, "+str(sum(len(t) for t in server.bssTables.values()))+" BSSIDs", flush=True)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+			print("Requests served: "+json.dumps(server.requests, sort_keys=True))
+
+
+if __name__ == "__main__":
+	main()
@@ -16,6 +16,7 @@ import re
 import string
 import uuid
 import pandas as pd
+from esxfile import ESXFile, ESXWriter
 
 pp = pprint.PrettyPrinter(indent=3)
 
@@ -36,18 +37,16 @@ def main():
 	#Load Ekahau Project archive
 	current_filename = pathlib.PurePath(args['input']).stem
 
-	orig_archive = zipfile.ZipFile(args['input'],'r')
+	esx = ESXFile(args['input'])
 
 
 	print("==========")
 	# Load Tag Keys Table
 	workingFile='tagKeys.json'
 
-	if workingFile in orig_archive.namelist():
+	if esx.has(workingFile):
 		print ("Loading "+workingFile+"...")
-		with orig_archive.open(workingFile) as json_file:
-			tagKeysJSON = json.load(json_file)
-			json_file.close()
+		tagKeysJSON = esx.load(workingFile)
 	#	tagKeysDF=pd.DataFrame(tagKeysJSON['tagKeys'])		
 	#	tagKeysDF.drop(columns=['status'])
 		tagData = True
@@ -70,23 +69,17 @@ def main():
 
 	if len(tagKeysJSON['tagKeys']) > 0:
 
-		with tempfile.TemporaryDirectory() as tmpdirname:
-		# Get all the other stuff from the input ESX
-			orig_archive.extractall(tmpdirname)
+		# Only tagKeys.json changes - everything else is copied across as-is, without being decompressed. 
+		new_archive = ESXWriter(esx, current_filename + "_modified.esx")
 
 		# Write out the tag data
-			with open(os.path.join(tmpdirname, 'tagKeys.json'), 'w') as outfile:
-				outfile.write(json.dumps(tagKeysJSON, indent=2))
-		
+		new_archive.replace('tagKeys.json', tagKeysJSON, indent=2)
+
 		# Create new ESX file
-			new_archive = zipfile.ZipFile(current_filename + "_modified.esx",'w',zipfile.ZIP_DEFLATED)
-			for dirname, subdirs, files in os.walk(tmpdirname):
-				for filename in files:
-					new_archive.write(os.path.join(tmpdirname, filename), filename)
+		new_archive.save()
 
 		# Close the files
-		orig_archive.close()
-		new_archive.close()
+		esx.close()
 
 
 	# End of conditional loop